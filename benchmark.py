@@ -0,0 +1,272 @@
+"""视频文件管理模板性能基准测试
+
+生成包含大量稀疏文件的 input_videos/output_videos 目录，不经过浏览器直接调用界面的
+事件处理函数，统计延迟分位数和内存峰值，并把结果写入JSON，便于比较不同版本。
+
+用法：
+    python benchmark.py                                  # 默认 1k / 10k / 100k 个文件
+    python benchmark.py --sizes 1000,1000000 -o new.json
+    python benchmark.py --compare old.json -o new.json   # 与上次结果对比
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "视频文件管理+预览模板.py")
+SPARSE_SIZE = 200 * 1024 * 1024  # 稀疏文件的表观大小（不占用磁盘空间）
+OUTPUT_RATIO = 0.1  # output目录的文件数占input目录的比例
+
+
+def generate_fixture(root, count, real_files, real_size):
+    """生成测试目录：count个稀疏文件，外加real_files个真实写入数据的文件"""
+    input_dir = os.path.join(root, "input_videos")
+    output_dir = os.path.join(root, "output_videos")
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    for directory, n in ((input_dir, count), (output_dir, max(1, int(count * OUTPUT_RATIO)))):
+        for i in range(n):
+            fd = os.open(os.path.join(directory, f"clip_{i:07d}.mp4"), os.O_WRONLY | os.O_CREAT, 0o644)
+            os.ftruncate(fd, SPARSE_SIZE)
+            os.close(fd)
+    block = os.urandom(1024 * 1024)
+    for i in range(real_files):
+        with open(os.path.join(input_dir, f"real_{i:02d}.mp4"), "wb") as f:
+            for _ in range(real_size):
+                f.write(block)
+
+
+def load_app():
+    """在当前目录下导入主程序（监听、缩略图、预览代理都关闭，避免后台任务干扰计时）"""
+    os.environ.setdefault("WEBUI_WATCH_MODE", "off")
+    os.environ.setdefault("WEBUI_FFMPEG", "off")
+    os.environ.setdefault("WEBUI_PROXY_MODE", "off")
+    os.environ.setdefault("WEBUI_JOB_WORKERS", "1")
+    spec = importlib.util.spec_from_file_location("webui_app", APP_FILE)
+    app = importlib.util.module_from_spec(spec)
+    sys.modules["webui_app"] = app
+    spec.loader.exec_module(app)
+    return app
+
+
+def percentile(values, p):
+    """线性插值的分位数"""
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def measure(run, setup=None, repeat=10, budget=10.0):
+    """先用tracemalloc测一次内存峰值，再重复计时；超过时间预算后提前结束（至少3次）"""
+    if setup:
+        setup()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - t0) * 1000)
+        if len(timings) >= 3 and time.perf_counter() - started > budget:
+            break
+    return {
+        "runs": len(timings),
+        "mean_ms": sum(timings) / len(timings),
+        "p50_ms": percentile(timings, 50),
+        "p90_ms": percentile(timings, 90),
+        "p99_ms": percentile(timings, 99),
+        "max_ms": max(timings),
+        "peak_alloc_mb": peak / 1024 / 1024,
+    }
+
+
+def run_worker(args):
+    """子进程：在测试目录中导入主程序并逐个计时事件处理函数"""
+    os.chdir(args.workdir)
+    t0 = time.perf_counter()
+    app = load_app()
+    import_seconds = time.perf_counter() - t0
+    app.INDEX_READY.wait()  # 等待后台复核完成，避免与计时的处理函数争用索引锁
+    ready_seconds = time.perf_counter() - t0
+    if not args.verbose:
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+
+    session = "benchmark"
+    view = dict(app.DEFAULT_VIEW)
+    real_paths = sorted(os.path.join(app.INPUT_DIR, f) for f in os.listdir(app.INPUT_DIR) if f.startswith("real_"))
+    page_rows = app.render_page(app.INPUT_DIR, view)["value"]
+    toggle = {"checked": False}
+    added = {"n": 0}
+
+    def toggle_first_row():
+        toggle["checked"] = not toggle["checked"]
+        page_rows[0][0] = toggle["checked"]
+
+    def add_file():
+        added["n"] += 1
+        open(os.path.join(app.INPUT_DIR, f"added_{added['n']:05d}.mp4"), "wb").close()
+
+    def clear_archive_cache():
+        app.ARCHIVE_CACHE.clear()
+        for name in os.listdir(app.DOWNLOAD_DIR):
+            path = os.path.join(app.DOWNLOAD_DIR, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+    def versions():
+        return app.table_version(app.INPUT_DIR), app.table_version(app.OUTPUT_DIR)
+
+    cached_versions = list(versions())
+    cases = [
+        ("list_files", lambda: app.list_files(app.INPUT_DIR), None),
+        ("full_refresh", lambda: app.full_refresh(view, view, session), None),
+        ("refresh_files_only(无变化)", lambda: app.refresh_files_only(*versions(), view, view, session), None),
+        ("refresh_files_only(新增1个文件)", lambda: app.refresh_files_only(*cached_versions, view, view, session),
+         lambda: [add_file(), cached_versions.__setitem__(slice(None), versions())]),
+        ("update_selections", lambda: app.update_selections(page_rows, True, session), toggle_first_row),
+        ("select_all_files", lambda: app.select_all_files(True, view, session), None),
+        ("search_files(子串)", lambda: app.search_files("clip_00001"), None),
+        ("search_files(通配符+范围)", lambda: app.search_files("*.mp4 size>100MB age<1d"), None),
+        ("download_files(生成)", lambda: app.download_files(real_paths), clear_archive_cache),
+        ("download_files(缓存命中)", lambda: app.download_files(real_paths), None),
+    ]
+
+    results = []
+    for name, run, setup in cases:
+        if name.startswith("download_files") and not real_paths:
+            continue
+        result = measure(run, setup, args.repeat, args.budget)
+        result["handler"] = name
+        results.append(result)
+        print(f"  {name:<32} p50 {result['p50_ms']:10.2f} ms  p99 {result['p99_ms']:10.2f} ms  "
+              f"峰值分配 {result['peak_alloc_mb']:8.2f} MB", file=sys.stderr)
+
+    print(json.dumps({
+        "import_seconds": import_seconds,
+        "ready_seconds": ready_seconds,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "results": results,
+    }))
+    for child in multiprocessing.active_children():
+        child.kill()  # 进程池中的子进程
+    os._exit(0)  # 不等待后台线程
+
+
+def compare(baseline, current, threshold):
+    """按(文件数, 处理函数)对比两次结果，p50变慢超过阈值的标记为回退"""
+    old = {(r["files"], r["handler"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\n{'文件数':>9}  {'处理函数':<32} {'旧p50(ms)':>12} {'新p50(ms)':>12} {'比值':>7}")
+    for r in current["results"]:
+        prev = old.get((r["files"], r["handler"]))
+        if not prev:
+            continue
+        ratio = r["p50_ms"] / prev["p50_ms"] if prev["p50_ms"] else float("inf")
+        flag = "  ⚠ 回退" if ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{r['files']:>9}  {r['handler']:<32} {prev['p50_ms']:>12.2f} {r['p50_ms']:>12.2f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def git_revision():
+    """当前代码版本（不在git仓库中时返回None）"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(APP_FILE),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频文件管理模板性能基准测试")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="input目录的文件数，逗号分隔（最大可到1000000）")
+    parser.add_argument("--real-files", type=int, default=3, help="真实写入数据的文件数（用于下载测试）")
+    parser.add_argument("--real-size", type=int, default=16, help="每个真实文件的大小（MB）")
+    parser.add_argument("--repeat", type=int, default=20, help="每个处理函数最多计时的次数")
+    parser.add_argument("--budget", type=float, default=10.0, help="每个处理函数的计时预算（秒）")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="结果JSON文件")
+    parser.add_argument("--compare", help="与之前的结果JSON对比")
+    parser.add_argument("--threshold", type=float, default=1.2, help="p50变慢超过该倍数视为回退")
+    parser.add_argument("--fixture-dir", help="测试目录的存放位置（默认使用临时目录，结束后删除）")
+    parser.add_argument("--verbose", action="store_true", help="保留主程序的INFO日志")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    report = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": [],
+        "results": [],
+    }
+    base_dir = args.fixture_dir or tempfile.mkdtemp(prefix="webui-bench-")
+    try:
+        for count in (int(s) for s in args.sizes.split(",")):
+            workdir = os.path.join(base_dir, f"files_{count}")
+            shutil.rmtree(workdir, ignore_errors=True)
+            print(f"生成测试目录: {count} 个文件 ...", file=sys.stderr)
+            t0 = time.perf_counter()
+            generate_fixture(workdir, count, args.real_files, args.real_size)
+            fixture_seconds = time.perf_counter() - t0
+
+            # 每种规模在独立进程中运行，内存峰值和索引缓存互不影响
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--workdir", workdir,
+                   "--repeat", str(args.repeat), "--budget", str(args.budget)]
+            if args.verbose:
+                cmd.append("--verbose")
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+            if proc.returncode != 0:
+                print(f"{count} 个文件的测试失败，退出码 {proc.returncode}", file=sys.stderr)
+                continue
+            worker = json.loads(proc.stdout.strip().splitlines()[-1])
+            report["sizes"].append({"files": count, "fixture_seconds": fixture_seconds,
+                                    "import_seconds": worker["import_seconds"], "ready_seconds": worker["ready_seconds"],
+                                    "max_rss_mb": worker["max_rss_mb"]})
+            for result in worker["results"]:
+                report["results"].append({"files": count, **result})
+            print(f"  导入耗时 {worker['import_seconds']:.2f} 秒，复核完成 {worker['ready_seconds']:.2f} 秒，"
+                  f"最大常驻内存 {worker['max_rss_mb']:.1f} MB",
+                  file=sys.stderr)
+            if not args.fixture_dir:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        if not args.fixture_dir:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
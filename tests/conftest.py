@@ -0,0 +1,31 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "视频文件管理+预览模板.py")
+AGENT_TOKEN = "secret"
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """在临时目录中以代理节点模式导入主程序（目录都是相对路径，测试期间保持该工作目录）"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("webui"))
+    patch = pytest.MonkeyPatch()
+    for key, value in {"WEBUI_MODE": "agent", "WEBUI_AGENT_TOKEN": AGENT_TOKEN, "WEBUI_WATCH_MODE": "off",
+                       "WEBUI_FFMPEG": "off", "WEBUI_PROXY_MODE": "off", "WEBUI_JOB_WORKERS": "1",
+                       "WEBUI_LOG_FILE": "", "WEBUI_AGENTS": ""}.items():
+        patch.setenv(key, value)
+    spec = importlib.util.spec_from_file_location("webui_app", APP_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["webui_app"] = module
+    spec.loader.exec_module(module)
+    module.INDEX_READY.wait(30)
+    yield module
+    module.METADATA.flush()
+    module.HASHES.flush()
+    module.FILE_INDEX.save()  # 在恢复工作目录前写完缓存，退出时无需再写相对路径下的文件
+    os.chdir(cwd)
+    patch.undo()
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import AGENT_TOKEN
+
+
+@pytest.fixture
+def client(app):
+    return TestClient(app.app)
+
+
+@pytest.fixture
+def output_file(app):
+    path = os.path.join(app.OUTPUT_DIR, "x.mp4")
+    with open(path, "wb") as f:
+        f.write(b"\0" * 1024)
+    app.FILE_INDEX.apply_event(app.OUTPUT_DIR, "x.mp4")
+    yield path
+    if os.path.exists(path):
+        os.unlink(path)
+        app.FILE_INDEX.apply_event(app.OUTPUT_DIR, "x.mp4")
+
+
+@pytest.mark.parametrize("method, url, body", [
+    ("POST", "/api/batch/delete", {"glob": "*", "side": "output"}),
+    ("POST", "/api/batch/archive", {"glob": "*", "side": "output"}),
+    ("POST", "/api/upload", {"filename": "a.mp4", "size": 1}),
+    ("GET", "/preview/output/x.mp4", None),
+    ("GET", "/agent/files", None),
+    ("DELETE", "/agent/files/output/x.mp4", None),
+    ("GET", "/api/files?side=output", None),
+    ("GET", "/api/manifest", None),
+    ("GET", "/api/changes", None),
+    ("GET", "/metrics", None),
+])
+def test_agent_rejects_missing_token(client, output_file, method, url, body):
+    for headers in ({}, {"Authorization": "Bearer wrong"}):
+        assert client.request(method, url, json=body, headers=headers).status_code == 401
+    assert os.path.exists(output_file)
+
+
+def test_agent_accepts_token(client, output_file):
+    headers = {"Authorization": f"Bearer {AGENT_TOKEN}"}
+    response = client.get("/preview/output/x.mp4", headers={**headers, "Range": "bytes=0-9"})
+    assert response.status_code == 206 and len(response.content) == 10
+    assert client.get("/agent/files", headers=headers).status_code == 200
+    response = client.post("/api/batch/delete", json={"paths": [output_file]}, headers=headers)
+    assert response.status_code == 200
+    assert not os.path.exists(output_file)
+
+
+def test_agent_is_lightweight(app):
+    assert not hasattr(app, "demo")
+    assert app.JOBS.pool is None and app.THUMBNAILS.pool is None
+    assert not app.PROXIES.enabled
+
+
+def test_batch_paths_are_filtered(client, output_file):
+    headers = {"Authorization": f"Bearer {AGENT_TOKEN}"}
+    directory = os.path.dirname(output_file)
+    others = [os.path.join(directory, name) for name in ("notes.txt", "x.mp4.job1.partial")]
+    for path in others:
+        with open(path, "wb") as f:
+            f.write(b"keep")
+    try:
+        response = client.post("/api/batch/delete", json={"paths": [output_file] + others, "side": "input"},
+                               headers=headers)
+        assert response.json()["rejected"] == [output_file] + others  # output下的文件不属于side=input
+        response = client.post("/api/batch/delete", json={"paths": [output_file] + others, "side": "output"},
+                               headers=headers)
+        assert response.json()["deleted"] == 1 and response.json()["rejected"] == others
+        assert not os.path.exists(output_file) and all(map(os.path.exists, others))
+        assert client.post("/api/batch/delete", json={"paths": [], "side": "x"}, headers=headers).status_code == 400
+    finally:
+        for path in others:
+            os.unlink(path)
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+from conftest import AGENT_TOKEN
+
+
+def persisted_seq(app):
+    with sqlite3.connect(app.CHANGES_DB) as db:
+        return db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+
+def test_published_seq_is_persisted(app):
+    client = TestClient(app.app, headers={"Authorization": f"Bearer {AGENT_TOKEN}"})
+    path = os.path.join(app.OUTPUT_DIR, "journal.mp4")
+    with open(path, "wb") as f:
+        f.write(b"\0" * 10)
+    app.FILE_INDEX.apply_event(app.OUTPUT_DIR, "journal.mp4")  # 只记录在内存中，尚未写入变更日志
+    try:
+        response = client.get("/api/manifest?side=output", headers={"Accept-Encoding": "identity"})
+        seq = response.json()["seq"]
+        assert seq == app.FILE_INDEX.seq and persisted_seq(app) >= seq
+        assert response.headers["vary"] == "Accept-Encoding"
+
+        compressed = client.get("/api/manifest?side=output", headers={"Accept-Encoding": "gzip"})
+        assert compressed.headers["content-encoding"] == "gzip"
+        assert compressed.headers["vary"] == "Accept-Encoding"
+        assert compressed.headers["etag"] != response.headers["etag"]
+        assert client.get("/api/manifest?side=output",
+                          headers={"If-None-Match": response.headers["etag"], "Accept-Encoding": "identity"}).status_code == 304
+
+        changes = client.get(f"/api/changes?since={seq - 1}&side=output").json()
+        assert [c["name"] for c in changes["changes"]] == ["journal.mp4"] and changes["next"] == seq
+    finally:
+        os.unlink(path)
+        app.FILE_INDEX.apply_event(app.OUTPUT_DIR, "journal.mp4")
+    response = client.post("/api/batch/delete", json={"paths": []})
+    assert persisted_seq(app) >= response.json()["seq"] == app.FILE_INDEX.seq
@@ -0,0 +1,99 @@
+import os
+import random
+
+
+def make_file(directory, name, size, mtime):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.truncate(size)
+    os.utime(path, (mtime, mtime))
+
+
+def expected(index, directory, sort_key):
+    table = index.entries(directory)
+    if sort_key == "name":
+        return sorted(table)
+    return sorted(table, key=lambda n: (index._entry_value(directory, sort_key, n, table[n]), n))
+
+
+def test_sorted_names_incremental(app, tmp_path):
+    index = app.FileIndex(str(tmp_path / "index.json"))
+    index.sort_providers["length"] = (lambda directory: 0, lambda directory, name, entry: len(name))
+    directory = str(tmp_path / "videos")
+    os.mkdir(directory)
+    rng = random.Random(1)
+    for i in range(300):
+        make_file(directory, f"v{i:04d}.mp4", rng.randrange(100), 1_000_000 + rng.randrange(50))
+    index.scan(directory)
+    sort_keys = ("name", "size", "mtime", "length")
+    orders = {key: index.sorted_names(directory, key) for key in sort_keys}
+
+    for step in range(400):
+        names = list(index.entries(directory))
+        op = rng.random()
+        if op < 0.4:
+            name = f"{'x' * rng.randrange(3)}n{step}.mp4"
+            make_file(directory, name, rng.randrange(100), 1_000_000 + rng.randrange(50))
+        elif op < 0.7 and names:
+            name = rng.choice(names)
+            make_file(directory, name, rng.randrange(100), 1_000_000 + rng.randrange(50))
+        elif names:
+            name = rng.choice(names)
+            os.unlink(os.path.join(directory, name))
+        index.apply_event(directory, name)
+        for key in sort_keys:
+            assert index.sorted_names(directory, key) == expected(index, directory, key)
+    # 增量更新的是同一个列表对象，没有整体重新排序
+    for key in sort_keys:
+        assert index.sorted_names(directory, key) is orders[key]
+
+    # 一次变化很多时改为整体排序
+    paths = []
+    for i in range(app.SORT_INCREMENTAL_LIMIT + 1):
+        make_file(directory, f"batch{i:04d}.mp4", i, 1_000_000)
+        paths.append(os.path.join(directory, f"batch{i:04d}.mp4"))
+    index.apply_batch(paths)
+    for key in sort_keys:
+        assert index.sorted_names(directory, key) == expected(index, directory, key)
+
+    # 整体排序在锁外进行，期间记录的变更排好后补上
+    sort = index._sort
+
+    def sort_with_change(*args):
+        result = sort(*args)
+        make_file(directory, f"during{len(index.orders)}.mp4", 5, 1_000_000 + len(index.orders))
+        index.apply_event(directory, f"during{len(index.orders)}.mp4")
+        return result
+
+    index._sort = sort_with_change
+    index.orders.clear()
+    for key in sort_keys:
+        assert index.sorted_names(directory, key) == expected(index, directory, key)
+
+
+def test_sort_data_refresh_is_throttled(app, tmp_path):
+    index = app.FileIndex(str(tmp_path / "index.json"))
+    weights = {}
+    data = {"version": 0}
+    index.sort_providers["weight"] = (lambda directory: data["version"],
+                                      lambda directory, name, entry: weights.get(name, 0))
+    directory = str(tmp_path / "videos")
+    os.mkdir(directory)
+    for i in range(20):
+        make_file(directory, f"v{i:02d}.mp4", i, 1_000_000)
+    index.scan(directory)
+    names = index.sorted_names(directory, "weight")
+    assert names == sorted(names)
+
+    # 元数据变化后不立即重新排序，新增文件照常增量插入
+    weights["v00.mp4"] = 100
+    data["version"] += 1
+    make_file(directory, "new.mp4", 1, 1_000_000)
+    index.apply_event(directory, "new.mp4")
+    assert index.sorted_names(directory, "weight") is names
+    assert "new.mp4" in names
+
+    # 超过SORT_DATA_REFRESH秒后按新数据重新排序
+    index.orders[directory]["weight"].built -= app.SORT_DATA_REFRESH
+    resorted = index.sorted_names(directory, "weight")
+    assert resorted is not names and resorted[-1] == "v00.mp4"
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+from concurrent.futures import Future
+
+
+def test_keys_include_device(app, tmp_path):
+    index = app.HashIndex(str(tmp_path / "hashes.sqlite"), 1)
+    path = tmp_path / "a.mp4"
+    path.write_bytes(b"a" * 100)
+    key = index.stat_key(os.stat(path))
+    assert key[0] == os.stat(path).st_dev
+    assert index.entry_key(str(tmp_path), (key[2], key[3], key[1])) == key
+
+    index.ensure(str(path), key)
+    other = (key[0] + 1, *key[1:])  # 另一块磁盘上inode、大小、修改时间都相同的文件
+    assert index.digests([key, other]) == [index.hashes[key], (None, None)]
+
+
+def test_old_cache_is_dropped(app, tmp_path):
+    db_path = str(tmp_path / "hashes.sqlite")
+    with sqlite3.connect(db_path) as db:
+        db.execute("CREATE TABLE hashes (ino INTEGER, size INTEGER, mtime REAL, sample TEXT, full TEXT, "
+                   "PRIMARY KEY (ino, size, mtime))")
+        db.execute("INSERT INTO hashes VALUES (1, 2, 3.0, 'x', NULL)")
+    index = app.HashIndex(db_path, 1)
+    index.load()
+    assert index.hashes == {}
+    assert "dev" in [row[1] for row in index.db.execute("PRAGMA table_info(hashes)")]
+
+
+def test_untrack_batches_database_writes(app, tmp_path, monkeypatch):
+    index = app.HashIndex(str(tmp_path / "hashes.sqlite"), 1)
+    monkeypatch.setattr(index.writer, "submit", lambda fn: None)  # 由测试手动写入
+    keys = []
+    for i in range(20):
+        path = tmp_path / f"{i}.mp4"
+        path.write_bytes(bytes([i]) * 100)
+        key = index.stat_key(os.stat(path))
+        index.track(str(path), key)
+        index.ensure(str(path), key)
+        keys.append(key)
+    count = "SELECT COUNT(*) FROM hashes"
+    assert index.db.execute(count).fetchone()[0] == 0 and len(index.unsaved) == 20
+    commits = []
+    monkeypatch.setattr(index, "db", CountingConnection(index.db, commits))
+    index.flush()
+    assert index.db.execute(count).fetchone()[0] == 20
+
+    for i in range(20):
+        index.untrack(str(tmp_path / f"{i}.mp4"))  # 只改内存
+    assert index.db.execute(count).fetchone()[0] == 20 and index.hashes == {}
+    index.flush()
+    assert index.db.execute(count).fetchone()[0] == 0
+    assert len(commits) == 2
+
+
+class CountingConnection:
+    def __init__(self, db, commits):
+        self.db = db
+        self.commits = commits
+
+    def commit(self):
+        self.commits.append(1)
+        self.db.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def test_versions_are_per_directory(app, tmp_path):
+    index = app.HashIndex(str(tmp_path / "hashes.sqlite"), 1)
+    a, b, c = tmp_path / "a", tmp_path / "b", tmp_path / "c"
+    for d in (a, b, c):
+        d.mkdir()
+    for path in (a / "1.mp4", b / "1.mp4", c / "other.mp4"):
+        path.write_bytes(b"same" if path.name == "1.mp4" else b"different")
+    versions = lambda: [index.dir_version(str(d)) for d in (a, b, c)]
+
+    key = index.stat_key(os.stat(a / "1.mp4"))
+    index.paths[str(a / "1.mp4")] = key
+    index.links[key] = {str(a / "1.mp4")}
+    index.ensure(str(a / "1.mp4"), key, need_full=True)
+    before = versions()
+    assert before[0] > 0 and before[1:] == [0, 0]
+
+    key = index.stat_key(os.stat(b / "1.mp4"))
+    index.paths[str(b / "1.mp4")] = key
+    index.links[key] = {str(b / "1.mp4")}
+    index.ensure(str(b / "1.mp4"), key, need_full=True)  # 与a中的文件重复：两个目录的副本数都变化
+    after = versions()
+    assert after[0] > before[0] and after[1] > 0 and after[2] == 0
+    assert index.flag(str(a / "1.mp4")).startswith("⚠️")
+
+    index.untrack(str(b / "1.mp4"))
+    assert versions()[0] > after[0] and versions()[2] == 0
+
+
+def test_table_version_ignores_other_directories(app):
+    output = app.table_version(app.OUTPUT_ROOTS)
+    with app.THUMBNAILS.lock:
+        app.THUMBNAILS.in_flight += 1
+    future = Future()
+    future.set_result(True)
+    app.THUMBNAILS._on_done(future, "k", os.path.join(app.INPUT_DIR, "x.mp4"))
+    assert app.table_version(app.OUTPUT_ROOTS) == output
+    assert app.THUMBNAILS.dir_version(app.INPUT_DIR) >= 1
+    app.THUMBNAILS.ready.discard("k")
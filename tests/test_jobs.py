@@ -0,0 +1,51 @@
+import os
+import threading
+import time
+
+
+def wait_finished(app, job_ids, timeout=30):
+    deadline = time.time() + timeout
+    while not app.JOBS.summary(job_ids)[1]:
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+def test_outputs_do_not_overwrite(app):
+    src = os.path.join(app.INPUT_DIR, "clip.mp4")
+    with open(src, "wb") as f:
+        f.write(b"new")
+    existing = os.path.join(app.OUTPUT_DIR, "clip.mp4")
+    with open(existing, "wb") as f:
+        f.write(b"old")
+    outputs = []
+    try:
+        app.JOBS.start()  # 界面模式在启动时创建进程池，测试以代理节点模式加载
+        job_ids = app.JOBS.submit([src, src], "copy")
+        wait_finished(app, job_ids)
+        outputs = [app.JOBS.jobs[job_id]["output"] for job_id in job_ids]
+        assert sorted(map(os.path.basename, outputs)) == ["clip_1.mp4", "clip_2.mp4"]
+        with open(existing, "rb") as f:
+            assert f.read() == b"old"
+        for path in outputs:
+            with open(path, "rb") as f:
+                assert f.read() == b"new"
+        assert not [f for f in os.listdir(app.OUTPUT_DIR) if f.endswith(".partial")]
+    finally:
+        for path in [src, existing] + outputs:
+            os.unlink(path)
+            app.FILE_INDEX.apply_event(os.path.dirname(path), os.path.basename(path))
+
+
+def test_pool_is_not_forked_from_request_threads(app):
+    errors = []
+
+    def start():
+        try:
+            app.JobScheduler(1).start()
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=start)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1
@@ -0,0 +1,105 @@
+import io
+import struct
+
+import pytest
+
+
+def box(kind, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def sample_mp4():
+    mvhd = box(b"mvhd", b"\0" * 12 + struct.pack(">II", 1000, 5000) + b"\0" * 80)
+    tkhd = box(b"tkhd", b"\0" * 76 + struct.pack(">II", 1920 << 16, 1080 << 16))
+    hdlr = box(b"hdlr", b"\0" * 8 + b"vide" + b"\0" * 12)
+    stsd = box(b"stsd", b"\0" * 8 + struct.pack(">I", 16) + b"avc1" + b"\0" * 8)
+    trak = box(b"trak", tkhd + box(b"mdia", hdlr + box(b"minf", box(b"stbl", stsd))))
+    return box(b"ftyp", b"isom\0\0\0\0") + box(b"moov", mvhd + trak) + box(b"mdat", b"\0" * 64)
+
+
+def ebml(element_id, data, size=None):
+    """EBML元素：size默认按数据长度编码为8字节变长整数"""
+    size = struct.pack(">Q", len(data) | 1 << 56) if size is None else size
+    return element_id + size + data
+
+
+def sample_mkv():
+    info = ebml(b"\x2a\xd7\xb1", (1000000).to_bytes(3, "big")) + ebml(b"\x44\x89", struct.pack(">d", 5000.0))
+    video = ebml(b"\xb0", (640).to_bytes(2, "big")) + ebml(b"\xba", (360).to_bytes(2, "big"))
+    entry = ebml(b"\x83", b"\x01") + ebml(b"\x86", b"V_VP9") + ebml(b"\xe0", video)
+    segment = (ebml(b"\x15\x49\xa9\x66", info) + ebml(b"\x16\x54\xae\x6b", ebml(b"\xae", entry))
+               + ebml(b"\x1f\x43\xb6\x75", b"\0" * 32))
+    return ebml(b"\x1a\x45\xdf\xa3", b"\x42\x86\x81\x01") + ebml(b"\x18\x53\x80\x67", segment, size=b"\x01" + b"\xff" * 7)
+
+
+def probe(fn, data):
+    return fn(io.BytesIO(data), len(data))
+
+
+def test_probe_mp4(app):
+    assert probe(app.probe_mp4, sample_mp4()) == {"duration": 5.0, "width": 1920, "height": 1080, "codec": "avc1"}
+
+
+def test_probe_mkv(app):
+    assert probe(app.probe_mkv, sample_mkv()) == {"duration": 5.0, "width": 640, "height": 360, "codec": "V_VP9"}
+
+
+@pytest.mark.parametrize("sample, name", [(sample_mp4, "probe_mp4"), (sample_mkv, "probe_mkv")])
+def test_truncated_headers(app, sample, name):
+    """截断在任意位置都只返回已解析到的字段，不抛出异常"""
+    data = sample()
+    for n in range(len(data)):
+        info = probe(getattr(app, name), data[:n])
+        assert isinstance(info, dict)
+        assert info.get("width", 0) in (0, 640, 1920)
+
+
+def test_mp4_box_sizes(app):
+    large = struct.pack(">I4sQ", 1, b"mdat", 16 + 4) + b"data"
+    assert list(app.iter_mp4_boxes(io.BytesIO(large), 0, len(large))) == [(b"mdat", 16, 20)]
+    to_end = struct.pack(">I4s", 0, b"mdat") + b"rest"
+    assert list(app.iter_mp4_boxes(io.BytesIO(to_end), 0, len(to_end))) == [(b"mdat", 8, 12)]
+    too_small = struct.pack(">I4s", 4, b"free") + b"\0" * 8
+    assert list(app.iter_mp4_boxes(io.BytesIO(too_small), 0, len(too_small))) == []
+    overlong = box(b"free", b"\0" * 8)[:10]
+    assert list(app.iter_mp4_boxes(io.BytesIO(overlong), 0, len(overlong))) == [(b"free", 8, 10)]
+    truncated_large = struct.pack(">I4s", 1, b"mdat") + b"\0\0"
+    assert list(app.iter_mp4_boxes(io.BytesIO(truncated_large), 0, len(truncated_large))) == []
+    odd = box(b"free", b"\0" * 3) + box(b"moov")
+    assert [b[0] for b in app.iter_mp4_boxes(io.BytesIO(odd), 0, len(odd))] == [b"free", b"moov"]
+
+
+def test_mp4_odd_sized_children(app):
+    """子box比规定的字段短时忽略该字段"""
+    short = box(b"moov", box(b"mvhd", b"\0" * 4) + box(b"trak", box(b"tkhd", b"\0" * 4) + box(b"hdlr", b"\0" * 2)))
+    assert probe(app.probe_mp4, short) == {}
+    oversized_moov = struct.pack(">I4s", app.METADATA_MAX_MOOV + 100, b"moov")
+    assert probe(app.probe_mp4, oversized_moov + b"\0" * (app.METADATA_MAX_MOOV + 92)) == {}
+
+
+@pytest.mark.parametrize("data, keep_marker, expected", [
+    (b"\x81", False, (1, 1)),
+    (b"\x40\x02", False, (2, 2)),
+    (b"\x1a\x45\xdf\xa3", True, (0x1A45DFA3, 4)),
+    (b"\xff", False, (None, 1)),  # 全为1：未知长度
+    (b"\x01" + b"\xff" * 7, False, (None, 8)),
+    (b"\x01" + b"\xff" * 7, True, ((1 << 57) - 1, 8)),
+])
+def test_read_ebml_vint(app, data, keep_marker, expected):
+    assert app.read_ebml_vint(io.BytesIO(data), keep_marker) == expected
+
+
+@pytest.mark.parametrize("data, error", [(b"", EOFError), (b"\x00", ValueError), (b"\x40", EOFError),
+                                         (b"\x10\x00", EOFError)])
+def test_read_ebml_vint_invalid(app, data, error):
+    with pytest.raises(error):
+        app.read_ebml_vint(io.BytesIO(data))
+
+
+def test_mkv_odd_sized_elements(app):
+    """时长不是4或8字节、数据被截断时跳过该元素"""
+    bad_duration = ebml(b"\x15\x49\xa9\x66", ebml(b"\x44\x89", b"\0\0\0"))
+    data = ebml(b"\x18\x53\x80\x67", bad_duration)
+    assert probe(app.probe_mkv, data) == {}
+    cut = ebml(b"\x18\x53\x80\x67", ebml(b"\x15\x49\xa9\x66", ebml(b"\x44\x89", struct.pack(">d", 1.0))))[:-3]
+    assert probe(app.probe_mkv, cut) == {}
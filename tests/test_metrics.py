@@ -0,0 +1,38 @@
+import os
+import re
+
+from fastapi.testclient import TestClient
+
+from conftest import AGENT_TOKEN
+
+
+def series(text, metric, function):
+    match = re.search(rf'^{metric}{{function="{function}"}} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+def test_byte_counted_paths_are_timed(app):
+    client = TestClient(app.app, headers={"Authorization": f"Bearer {AGENT_TOKEN}"})
+    path = os.path.join(app.OUTPUT_DIR, "metered.mp4")
+    with open(path, "wb") as f:
+        f.write(b"\1" * 4096)
+    try:
+        assert client.get("/preview/output/metered.mp4", headers={"Range": "bytes=0-99"}).status_code == 206
+        upload_id = client.post("/api/upload", json={"filename": "metered.mp4", "size": 3}).json()["upload_id"]
+        assert client.put(f"/api/upload/{upload_id}?offset=0", content=b"abc").status_code == 200
+        client.delete(f"/api/upload/{upload_id}")
+        app.full_hash(path)
+        url, _ = app.register_stream_download([path])
+        assert len(client.get(url).content) > 4096
+    finally:
+        os.unlink(path)
+    app.METRICS.add_io(read=1, name="bytes_only")
+
+    text = client.get("/metrics").text
+    for name in ("preview_stream", "upload_chunk", "hash", "stream_download"):
+        assert series(text, "webui_calls_total", name) >= 1
+        assert series(text, "webui_call_duration_seconds_count", name) >= 1
+        assert series(text, "webui_bytes_read_total", name) or series(text, "webui_bytes_written_total", name)
+    assert series(text, "webui_bytes_read_total", "bytes_only") == 1
+    assert series(text, "webui_calls_total", "bytes_only") is None
+    assert series(text, "webui_call_duration_seconds_count", "bytes_only") is None
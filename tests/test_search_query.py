@@ -0,0 +1,76 @@
+import fnmatch
+import math
+import time
+from datetime import datetime
+
+import pytest
+
+
+NAMES = ["a.mp4", "ab.mp4", "b.mp4", "abc", "a[b.mp4", "]a", "x]y.mkv", "clip.mp4.bak", "*.mp4", "a"]
+
+
+def matches(app, terms, name):
+    blob = "\n" + name + "\n"
+    return all(app.search_pattern(term) in blob for term in terms)
+
+
+@pytest.mark.parametrize("pattern", ["*.mp4", "a*", "a", "*", "a*.mp4", "*b*", "a?.mp4", "[ab].mp4", "[!a]*",
+                                     "[]a]", "x[]]y.mkv", "a[b*", "*[*", "**.mp4", "*.mp4*"])
+def test_glob_terms_agree_with_fnmatch(app, pattern):
+    """条件对所有匹配的文件名都成立；exact为True时条件与通配符完全等价"""
+    terms, exact = app.glob_terms(pattern)
+    for name in NAMES:
+        expected = fnmatch.fnmatchcase(name, pattern)
+        if expected:
+            assert matches(app, terms, name), (pattern, name)
+        if exact:
+            assert matches(app, terms, name) == expected, (pattern, name)
+
+
+def test_glob_terms_kinds(app):
+    assert app.glob_terms("*.mp4") == ([("end", ".mp4")], True)
+    assert app.glob_terms("clip*") == ([("start", "clip")], True)
+    assert app.glob_terms("clip") == ([("eq", "clip")], True)
+    assert app.glob_terms("a*b*c") == ([("start", "a"), ("in", "b"), ("end", "c")], False)
+    assert app.glob_terms("a?c") == ([("start", "a"), ("end", "c")], False)
+    assert app.search_pattern(("eq", "a")) == "\na\n"
+    assert app.search_pattern(("in", "a")) == "a"
+
+
+def test_parse_terms_and_dirs(app):
+    query = app.parse_search_query('Clip "my file.MP4" *.MKV IN:Output')
+    assert query["terms"] == [("in", "clip"), ("in", "my file.mp4"), ("end", ".mkv")]
+    assert query["globs"] == [] and query["dirs"] == app.OUTPUT_ROOTS
+    empty = app.parse_search_query(None)
+    assert empty["terms"] == [] and empty["size"] == [-math.inf, math.inf]
+    assert empty["dirs"] == app.INPUT_ROOTS + app.OUTPUT_ROOTS
+    assert app.parse_search_query("a?.mp4")["globs"][0].match("ab.mp4")
+
+
+def test_parse_size(app):
+    gb = 1024 ** 3
+    assert app.parse_search_query("size>2GB")["size"] == [math.nextafter(2 * gb, math.inf), math.inf]
+    assert app.parse_search_query("SIZE<=1.5k")["size"] == [-math.inf, 1536]
+    assert app.parse_search_query("size=10")["size"] == [10, 10]
+    assert app.parse_search_query("size<10 size>=10")["size"] == [10, math.nextafter(10, -math.inf)]  # 空区间
+
+
+def test_parse_dates(app):
+    day = datetime(2025, 1, 1).timestamp()
+    end = math.nextafter(day + 86400, -math.inf)
+    assert app.parse_search_query("mtime>=2025-01-01")["mtime"] == [day, math.inf]
+    assert app.parse_search_query("mtime<=2025-01-01")["mtime"] == [-math.inf, end]
+    assert app.parse_search_query("mtime=2025-01-01")["mtime"] == [day, end]
+    assert app.parse_search_query("mtime>2025-01-01")["mtime"] == [day + 86400, math.inf]
+    noon = datetime(2025, 1, 1, 12).timestamp()
+    assert app.parse_search_query("mtime<2025-01-01T12:00")["mtime"] == [-math.inf, math.nextafter(noon, -math.inf)]
+    before = time.time()
+    low, high = app.parse_search_query("age<1h")["mtime"]
+    assert before - 3600 < low <= time.time() - 3600 + 1 and high == math.inf
+
+
+@pytest.mark.parametrize("text", ['"unclosed', "in:downloads", "size>abc", "size>2xb", "age=7d", "age<7y",
+                                  "mtime>2025-13-01", "mtime>yesterday"])
+def test_parse_errors(app, text):
+    with pytest.raises(ValueError):
+        app.parse_search_query(text)
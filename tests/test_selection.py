@@ -0,0 +1,38 @@
+import threading
+
+
+def test_readers_get_snapshots(app):
+    store = app.SelectionStore()
+    store.replace("s", "d", [f"{i}.mp4" for i in range(1000)])
+    stop = threading.Event()
+
+    def toggle():
+        i = 0
+        while not stop.is_set():
+            store.toggle("s", "d", f"x{i % 500}.mp4", i % 1000 < 500)
+            if i % 997 == 0:
+                store.replace("s", "d", [f"{n}.mp4" for n in range(1000)])
+            i += 1
+
+    thread = threading.Thread(target=toggle)
+    thread.start()
+    try:
+        for _ in range(300):
+            snapshot = store.get("s", "d")
+            assert len(list(snapshot)) == len(snapshot)  # 遍历期间不会被其它线程修改
+            count, names = store.head("s", "d", 10)
+            assert count >= 1000 and len(names) == 10
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_get_returns_copy(app):
+    store = app.SelectionStore()
+    store.toggle("s", "d", "a.mp4", True)
+    snapshot = store.get("s", "d")
+    store.toggle("s", "d", "b.mp4", True)
+    assert list(snapshot) == ["a.mp4"]
+    assert store.contains("s", "d", "b.mp4") and not store.contains("s", "other", "b.mp4")
+    assert store.get("s", "other") == {} and ("s", "other") not in store.selections
+    assert store.head("s", "d", 1) == (2, ["a.mp4"])
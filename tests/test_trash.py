@@ -0,0 +1,89 @@
+import os
+
+
+def write(path, data=b"x"):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_clear_keeps_running_job_output(app):
+    write(os.path.join(app.OUTPUT_DIR, "old.mp4"))
+    partial = os.path.join(app.OUTPUT_DIR, "clip.mp4.job999.partial")
+    write(partial, b"half")
+    with app.JOBS.lock:
+        app.JOBS.jobs["999"] = {"id": "999", "path": "clip.mp4", "processor": "copy", "priority": 1,
+                                "status": "running", "progress": 0.5, "message": "", "output": None, "tmp": partial}
+    try:
+        assert app.move_to_trash(app.OUTPUT_DIR)
+        assert os.listdir(app.OUTPUT_DIR) == [os.path.basename(partial)]
+    finally:
+        with app.JOBS.lock:
+            del app.JOBS.jobs["999"]
+        os.unlink(partial)
+    app.TRASH_POOL.submit(lambda: None).result()
+
+
+def test_trash_on_same_device(app, monkeypatch):
+    real_stat = os.stat
+    trash_dir = os.path.abspath(app.TRASH_DIR)
+
+    def stat(path, *args, **kwargs):
+        result = real_stat(path, *args, **kwargs)
+        if os.path.abspath(path) == trash_dir:  # 模拟缓存目录在另一个文件系统上
+            fields = list(result)
+            fields[2] += 1
+            return os.stat_result(fields)
+        return result
+
+    monkeypatch.setattr(os, "stat", stat)
+    root = os.path.abspath(app.INPUT_DIR)
+    sibling = app.sibling_trash(root)
+    assert app.trash_dir_for(root) == sibling and os.path.dirname(sibling) == os.path.dirname(root)
+    write(os.path.join(root, "a.mp4"))
+    assert app.move_to_trash(app.INPUT_DIR)
+    assert os.listdir(app.INPUT_DIR) == []
+    monkeypatch.undo()
+    app.TRASH_POOL.submit(lambda: None).result()
+    assert os.listdir(sibling) == []
+
+
+def test_clear_drops_index_entries_in_bulk(app, monkeypatch):
+    for i in range(300):
+        write(os.path.join(app.OUTPUT_DIR, f"{i}.mp4"))
+    app.FILE_INDEX.invalidate(app.OUTPUT_DIR)
+    assert len(app.FILE_INDEX.scan(app.OUTPUT_DIR)) == 300
+    seq = app.FILE_INDEX.seq
+    calls, cleared = [], []
+    monkeypatch.setattr(app.FILE_INDEX, "listeners", [lambda *args: calls.append(args)])
+    monkeypatch.setattr(app.FILE_INDEX, "clear_listeners",
+                        app.FILE_INDEX.clear_listeners + [lambda directory, removed: cleared.append(len(removed))])
+    assert app.move_to_trash(app.OUTPUT_DIR)
+    assert calls == [] and cleared == [300]
+    assert len(app.FILE_INDEX.entries(app.OUTPUT_DIR)) == 0
+    assert app.FILE_INDEX.version(app.OUTPUT_DIR) == app.FILE_INDEX.seq == seq + 300
+    changes = app.FILE_INDEX.changes_since(seq)
+    assert len(changes) == 300 and {c[2] for c in changes} == {"removed"}
+    app.TRASH_POOL.submit(lambda: None).result()
+
+
+def test_ingest_survives_clear(app, tmp_path, monkeypatch):
+    src = tmp_path / "upload.mp4"
+    src.write_bytes(b"content")
+    write_partial = app.write_partial
+    attempts = []
+
+    def clear_midway(*args):
+        method = write_partial(*args)
+        if not attempts:
+            app.move_to_trash(app.INPUT_DIR)  # 放入过程中清空文件夹，.partial被一起移走
+        attempts.append(method)
+        return method
+
+    monkeypatch.setattr(app, "write_partial", clear_midway)
+    dest, _ = app.ingest_file(str(src))
+    assert len(attempts) == 2
+    with open(dest, "rb") as f:
+        assert f.read() == b"content"
+    os.unlink(dest)
+    app.FILE_INDEX.apply_event(app.INPUT_DIR, "upload.mp4")
+    app.TRASH_POOL.submit(lambda: None).result()
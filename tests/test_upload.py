@@ -0,0 +1,29 @@
+import hashlib
+import os
+
+from fastapi.testclient import TestClient
+
+AGENT_TOKEN = "secret"
+
+
+def test_failed_chunk_keeps_digest_in_step(app, monkeypatch):
+    client = TestClient(app.app, headers={"Authorization": f"Bearer {AGENT_TOKEN}"}, raise_server_exceptions=False)
+    data = b"abcdef"
+    created = client.post("/api/upload", json={"filename": "resumed.mp4", "size": len(data),
+                                               "sha256": hashlib.sha256(data).hexdigest()})
+    upload_id = created.json()["upload_id"]
+
+    def write_then_fail(f, hasher, chunk):
+        f.write(chunk[:2])  # 数据已落盘，但哈希尚未更新时出错
+        raise OSError("disk error")
+
+    with monkeypatch.context() as m:
+        m.setattr(app.ChunkedUploads, "write", staticmethod(write_then_fail))
+        assert client.put(f"/api/upload/{upload_id}?offset=0", content=data).status_code == 500
+    offset = client.get(f"/api/upload/{upload_id}").json()["offset"]
+    assert offset == 2
+    assert client.put(f"/api/upload/{upload_id}?offset={offset}", content=data[offset:]).status_code == 200
+    done = client.post(f"/api/upload/{upload_id}/complete")
+    assert done.status_code == 200
+    os.unlink(done.json()["path"])
+    app.FILE_INDEX.apply_event(app.INPUT_DIR, "resumed.mp4")
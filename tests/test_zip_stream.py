@@ -0,0 +1,59 @@
+import os
+import zipfile
+
+
+def stream_to(archive, out_path, sparse=False):
+    """把流式压缩包写入文件；sparse=True时全零的数据块用seek跳过，写出的稀疏文件内容不变但不占磁盘"""
+    pos = 0
+    with open(out_path, "wb") as f:
+        for chunk in archive:
+            if sparse and chunk.count(0) == len(chunk):
+                f.seek(len(chunk), os.SEEK_CUR)
+            else:
+                f.write(chunk)
+            pos += len(chunk)
+        f.truncate()
+    return pos
+
+
+def test_stream_reads_back(app, tmp_path):
+    paths = []
+    for name, data in (("a.mp4", b"hello" * 1000), ("empty.mp4", b""), ("视频.mkv", os.urandom(300000))):
+        (tmp_path / name).write_bytes(data)
+        paths.append(str(tmp_path / name))
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "a.mp4").write_bytes(b"second")
+    paths += [str(tmp_path / "other" / "a.mp4"), str(tmp_path / "missing.mp4")]
+
+    archive = app.ZipStream(paths)
+    out = tmp_path / "out.zip"
+    assert stream_to(archive, out) == archive.content_length() == out.stat().st_size
+    with zipfile.ZipFile(out) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["a.mp4", "empty.mp4", "视频.mkv", "a_1.mp4"]  # 同名文件改名，不存在的文件跳过
+        assert zf.read("a.mp4") == b"hello" * 1000
+        assert zf.read("a_1.mp4") == b"second"
+        assert zf.read("视频.mkv") == (tmp_path / "视频.mkv").read_bytes()
+        assert zf.read("empty.mp4") == b""
+
+
+def test_member_over_4gib(app, tmp_path):
+    big = tmp_path / "big.mp4"
+    size = 4 * 1024 ** 3 + 10
+    with open(big, "wb") as f:
+        f.seek(size - 10)  # 稀疏文件
+        f.write(b"0123456789")
+    small = tmp_path / "small.mp4"
+    small.write_bytes(b"after")
+
+    archive = app.ZipStream([str(big), str(small)])
+    out = tmp_path / "out.zip"
+    assert stream_to(archive, out, sparse=True) == archive.content_length()
+    with zipfile.ZipFile(out) as zf:
+        info = {i.filename: i for i in zf.infolist()}
+        assert info["big.mp4"].file_size == info["big.mp4"].compress_size == size
+        assert info["small.mp4"].header_offset > 0xFFFFFFFF  # 偏移量只能记在ZIP64扩展字段中
+        assert zf.read("small.mp4") == b"after"
+        with zf.open("big.mp4") as member:
+            member.seek(size - 10)
+            assert member.read() == b"0123456789"
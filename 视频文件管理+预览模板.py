@@ -4,25 +4,323 @@ import shutil
 from datetime import datetime
 import zipfile
 import logging
+import logging.handlers
+import queue
+import json
+import time
+import atexit
+import threading
+import select
+import struct
+import ctypes
+import ctypes.util
+import asyncio
+import itertools
+import zlib
+import secrets
+import hashlib
+import heapq
+import re
+import subprocess
+import multiprocessing
+import sqlite3
+import contextlib
+import contextvars
+import functools
+import inspect
+import random
+import io
+import math
+import bisect
+import fnmatch
+import shlex
+import base64
+import tempfile
+import gzip
+try:
+    import fcntl  # 跨进程文件锁（Windows上没有，只使用进程内锁）
+except ImportError:
+    fcntl = None
+from urllib.parse import quote
+from collections import Counter, deque
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.responses import StreamingResponse, FileResponse, Response, PlainTextResponse, JSONResponse
+import httpx
+from starlette.background import BackgroundTask
+from email.utils import formatdate, parsedate_to_datetime
 
-# 创建文件夹
-INPUT_DIR = "input_videos"
-OUTPUT_DIR = "output_videos"
-DOWNLOAD_DIR = "downloads"  # 下载目录
-os.makedirs(INPUT_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 存储位置配置：input/output可以各有多个目录（可以位于不同磁盘），第一个目录接收上传和处理结果
+# 优先读取环境变量WEBUI_INPUT_DIRS / WEBUI_OUTPUT_DIRS（用os.pathsep分隔，每项为"路径"或"名称=路径"），
+# 其次读取WEBUI_ROOTS_FILE指向的JSON：{"input": ["路径", {"path": "路径", "label": "名称"}], "output": [...], "download": "路径"}
+ROOTS_FILE = os.environ.get("WEBUI_ROOTS_FILE", "webui_roots.json")
+
+
+def load_roots(side, default):
+    """读取某一类存储位置，返回[(名称, 路径)]；未命名的第一个目录叫Input/Output，其余用“Input:目录名”"""
+    entries = None
+    if os.environ.get(f"WEBUI_{side.upper()}_DIRS"):
+        entries = [e for e in os.environ[f"WEBUI_{side.upper()}_DIRS"].split(os.pathsep) if e]
+    elif os.path.isfile(ROOTS_FILE):
+        with open(ROOTS_FILE, "r", encoding="utf-8") as f:
+            entries = json.load(f).get(side)
+    roots = []
+    for i, entry in enumerate(entries or [default]):
+        if isinstance(entry, dict):
+            label, path = entry.get("label"), entry["path"]
+        elif "=" in entry:
+            label, path = entry.split("=", 1)
+        else:
+            label, path = None, entry
+        path = os.path.normpath(path)
+        title = side.capitalize()
+        label = label or (title if i == 0 else f"{title}:{os.path.basename(os.path.abspath(path))}")
+        if path not in (p for _, p in roots):
+            roots.append((label, path))
+    return roots
+
+
+def load_download_dir(default):
+    """下载目录：WEBUI_DOWNLOAD_DIR，其次存储位置配置文件中的download"""
+    if os.environ.get("WEBUI_DOWNLOAD_DIR"):
+        return os.environ["WEBUI_DOWNLOAD_DIR"]
+    if os.path.isfile(ROOTS_FILE):
+        with open(ROOTS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get("download") or default
+    return default
+
+
+def load_agents():
+    """代理节点：WEBUI_AGENTS（逗号分隔的"名称=URL"），其次存储位置配置文件中的"agents": {"名称": "URL"}"""
+    if os.environ.get("WEBUI_AGENTS"):
+        agents = dict(e.split("=", 1) for e in os.environ["WEBUI_AGENTS"].split(",") if "=" in e)
+    elif os.path.isfile(ROOTS_FILE):
+        with open(ROOTS_FILE, "r", encoding="utf-8") as f:
+            agents = json.load(f).get("agents") or {}
+    else:
+        agents = {}
+    # 节点名用在远程目录标识和预览URL中，不能包含"/"
+    return {name.strip(): url.strip().rstrip("/") for name, url in agents.items() if name.strip() and "/" not in name}
+
+
+ROOT_CONFIG = {"input": load_roots("input", "input_videos"), "output": load_roots("output", "output_videos")}
+INPUT_ROOTS = [path for _, path in ROOT_CONFIG["input"]]
+OUTPUT_ROOTS = [path for _, path in ROOT_CONFIG["output"]]
+ROOT_LABELS = {}  # 目录 -> 界面上显示的来源名称（同名时追加序号）
+ROOT_KEYS = {}  # 目录 -> 预览接口等URL中使用的标识：input、output、input2 ...
+for _side, _roots in ROOT_CONFIG.items():
+    for _i, (_label, _path) in enumerate(_roots):
+        _name, _n = _label, 2
+        while _name in ROOT_LABELS.values():
+            _name, _n = f"{_label}{_n}", _n + 1
+        ROOT_LABELS[_path] = _name
+        ROOT_KEYS[_path] = _side if _i == 0 else f"{_side}{_i + 1}"
+ROOTS_BY_LABEL = {label: path for path, label in ROOT_LABELS.items()}
+INPUT_DIR = INPUT_ROOTS[0]  # 上传目录
+OUTPUT_DIR = OUTPUT_ROOTS[0]  # 处理结果目录
+DOWNLOAD_DIR = load_download_dir("downloads")  # 下载目录
+CACHE_DIR = ".webui_cache"  # 索引等缓存数据目录
+for _root in INPUT_ROOTS + OUTPUT_ROOTS:
+    os.makedirs(_root, exist_ok=True)
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)  # 确保下载目录存在
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# 支持的视频扩展名
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+# 文件索引配置
+INDEX_FILE = os.path.join(CACHE_DIR, "file_index.json")  # 索引快照文件
+INDEX_VERIFY_INTERVAL = float(os.environ.get("WEBUI_INDEX_VERIFY_INTERVAL", "300"))  # 全量复核间隔（秒）
+INDEX_JOURNAL_SIZE = 10000  # 内存中保留的最近变更条数
+SORT_INCREMENTAL_LIMIT = 256  # 一次变更的文件数超过该值时整体重新排序，不再逐个二分插入
+SORT_DATA_REFRESH = 5.0  # 元数据等额外排序字段变化后，同一目录最多每隔该秒数重新排序一次
+CHANGES_DB = os.path.join(CACHE_DIR, "changes.sqlite")  # 持久化的变更日志，下游按游标增量同步
+CHANGES_KEEP = int(os.environ.get("WEBUI_CHANGES_KEEP", "1000000"))  # 变更日志保留的最近条数
+CHANGES_PAGE_LIMIT = 5000  # /api/changes每页最多返回的条数
+# snapshot：启动时直接显示上次保存的索引快照，端口打开后在后台复核 / empty：先显示空表格 / scan：启动前同步扫描全部目录
+STARTUP_MODE = os.environ.get("WEBUI_STARTUP_MODE", "snapshot")
+
+# 目录监听配置
+WATCH_MODE = os.environ.get("WEBUI_WATCH_MODE", "auto")  # auto / inotify / poll / off
+WATCH_POLL_INTERVAL = 1.0  # 轮询模式的扫描间隔（秒）
+WATCH_PUSH_INTERVAL = 1.0  # 向页面推送变更的间隔（秒）
+
+# 缩略图配置
+THUMB_DIR = os.path.join(CACHE_DIR, "thumbnails")  # 缩略图缓存目录
+THUMB_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))  # 缩略图进程池大小
+THUMB_WIDTH = 160  # 缩略图宽度（像素）
+FFMPEG_PATH = os.environ.get("WEBUI_FFMPEG", "") or shutil.which("ffmpeg")  # 本地ffmpeg，找不到时不生成缩略图
+if FFMPEG_PATH == "off":
+    FFMPEG_PATH = None  # WEBUI_FFMPEG=off：不使用ffmpeg
+os.makedirs(THUMB_DIR, exist_ok=True)
+
+# 预览代理配置（低码率H.264副本，远程预览时代替原始文件）
+PROXY_DIR = os.path.join(CACHE_DIR, "proxies")  # 预览代理缓存目录
+PROXY_MODE = os.environ.get("WEBUI_PROXY_MODE", "lazy")  # lazy：首次预览时生成 / eager：output目录出现新文件时也生成 / off
+PROXY_WORKERS = max(1, min(2, (os.cpu_count() or 2) // 4))  # 同时运行的ffmpeg转码数
+PROXY_HEIGHT = 540  # 代理的最大高度（像素）
+PROXY_MIN_SIZE = 32 * 1024 * 1024  # 小于该大小的文件直接播放原文件
+PROXY_QUOTA_BYTES = int(os.environ.get("WEBUI_PROXY_QUOTA_BYTES", 10 * 1024 ** 3))  # 代理缓存上限，超出后淘汰最久未预览的
+os.makedirs(PROXY_DIR, exist_ok=True)
+
+# 处理任务配置
+AVAILABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+JOB_WORKERS = int(os.environ.get("WEBUI_JOB_WORKERS", "0")) or AVAILABLE_CPUS  # 处理进程数，默认等于可用CPU核数
+JOB_DIR = os.path.join(CACHE_DIR, "jobs")  # 任务取消标记文件目录
+JOB_HISTORY = 200  # 保留的已结束任务数
+JOB_PRIORITIES = [("高", 0), ("普通", 1), ("低", 2)]
+os.makedirs(JOB_DIR, exist_ok=True)
+
+# 文件表格配置
+TABLE_HEADERS = ["选择", "文件名", "来源", "路径", "大小", "修改时间", "缩略图", "时长", "分辨率", "编码", "码率", "重复"]
+TABLE_DATATYPES = ["bool", "str", "str", "str", "str", "str", "markdown", "str", "str", "str", "str", "str"]
+
+# 媒体元数据配置
+METADATA_DB = os.path.join(CACHE_DIR, "metadata.sqlite")  # 元数据索引（与文件索引放在一起）
+METADATA_WORKERS = 4  # 读取文件头的线程数
+METADATA_MAX_MOOV = 64 * 1024 * 1024  # 读取moov box的字节上限
+METADATA_COMMIT_ROWS = 500  # 元数据攒够该条数（或队列已空、距上次提交超过2秒）才提交一次数据库
+
+# 内容去重配置
+HASH_DB = os.path.join(CACHE_DIR, "hashes.sqlite")  # 内容哈希缓存，按(设备号, inode, 大小, 修改时间)保存
+HASH_WORKERS = 2  # 每个磁盘上后台计算哈希的线程数
+HASH_SAMPLE_BYTES = 64 * 1024  # 抽样哈希读取的文件头、尾字节数
+HASH_CHUNK_SIZE = 1024 * 1024  # 计算完整哈希时每次读取的字节数
+DEDUP_UPLOAD_MODE = os.environ.get("WEBUI_DEDUP_UPLOAD", "link")  # link：内容已存在时硬链接到已有文件 / reject：跳过 / off
+
+# 文件表格分页配置
+PAGE_SIZES = [50, 100, 200, 500]
+SORT_OPTIONS = [("名称", "name"), ("大小", "size"), ("修改时间", "mtime"),
+                ("时长", "duration"), ("分辨率", "resolution"), ("码率", "bitrate")]
+DEFAULT_VIEW = {"page": 1, "page_size": 100, "sort": "name", "descending": False, "filter": ""}
+SELECTION_DISPLAY_LIMIT = 50  # "已选中文件"列表中最多显示的文件名数
+PREVIEW_CHOICES_LIMIT = 100  # 预览下拉框中最多列出的文件数
+
+# 搜索配置
+SEARCH_DISPLAY_LIMIT = 200  # 搜索结果表格中最多显示的文件数（选中、下载、删除作用于全部结果）
+SEARCH_SCAN_RATIO = 0.05  # 子串命中数超过文件数的该比例时，改为逐个扫描文件名而不是逐个定位
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "kb": 1024, "m": 1024 ** 2, "mb": 1024 ** 2,
+              "g": 1024 ** 3, "gb": 1024 ** 3, "t": 1024 ** 4, "tb": 1024 ** 4}
+AGE_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+# 下载配置
+STREAM_DOWNLOAD_TTL = 3600  # 流式下载链接的有效期（秒）
+STREAM_CHUNK_SIZE = 1024 * 1024  # 流式下载每次读取的字节数
+PREVIEW_ROOTS = {**{key: path for path, key in ROOT_KEYS.items()}, "proxy": PROXY_DIR}  # 预览接口可访问的目录
+DOWNLOAD_QUOTA_BYTES = int(os.environ.get("WEBUI_DOWNLOAD_QUOTA_BYTES", str(20 * 1024 ** 3)))  # 压缩包缓存容量上限
+ARCHIVE_CACHE_FILE = os.path.join(DOWNLOAD_DIR, ".archive_cache.json")  # 压缩包缓存清单
+
+# 上传配置
+UPLOAD_SESSIONS_FILE = os.path.join(CACHE_DIR, "upload_sessions.json")  # 分块上传会话（用于重启后续传）
+UPLOAD_WORKERS = 4  # 多文件上传时并行处理的文件数
+
+# 删除配置
+DELETE_WORKERS = 8  # 批量删除时并行删除的线程数
+TRASH_DIR = os.path.join(CACHE_DIR, "trash")  # 清空文件夹时先把整个目录改名到这里，再在后台删除
+TRASH_SIBLING = ".{}.webui_trash"  # 存储位置与缓存目录不在同一文件系统时，改用存储位置旁边的这个隐藏目录
+os.makedirs(TRASH_DIR, exist_ok=True)
+
+# 并发配置
+QUEUE_CONCURRENCY = int(os.environ.get("WEBUI_QUEUE_CONCURRENCY", "8"))  # Gradio队列同时处理的事件数
+LOCK_DIR = os.path.join(CACHE_DIR, "locks")  # 建议锁文件目录
+LOCK_STRIPES = 256  # 路径按哈希分到固定数量的锁上，锁文件数量不随文件数增长
+SCAN_WORKERS = int(os.environ.get("WEBUI_SCAN_WORKERS", "1"))  # 每个磁盘上同时扫描的目录数（不同磁盘并行扫描）
+ARCHIVE_WORKERS = 2  # 每个磁盘上同时为打包预读文件的线程数
+ARCHIVE_READ_AHEAD = 8  # 打包时每个文件预读的数据块数（每块STREAM_CHUNK_SIZE字节）
+os.makedirs(LOCK_DIR, exist_ok=True)
+
+# 多机汇总配置：各台机器以代理节点模式运行本脚本，主界面并发拉取各节点的文件列表并入input/output表格
+SERVER_MODE = os.environ.get("WEBUI_MODE", "ui")  # ui：完整界面 / agent：代理节点，只提供HTTP接口
+SERVER_HOST = os.environ.get("WEBUI_HOST", "127.0.0.1")  # 监听地址（代理节点供其它机器访问时设为0.0.0.0）
+SERVER_PORT = int(os.environ.get("WEBUI_PORT", "7860"))
+AGENTS = load_agents()  # 节点名 -> 基础URL
+AGENT_TOKEN = os.environ.get("WEBUI_AGENT_TOKEN", "")  # 节点接口的共享令牌，为空时不校验
+AGENT_TTL = float(os.environ.get("WEBUI_AGENT_TTL", "3"))  # 节点文件列表的缓存有效期（秒）
+AGENT_TIMEOUT = 5.0  # 请求节点的超时（秒）
+AGENT_CONNECTIONS = 8  # 每个节点保持的keep-alive连接数
+REMOTE_PREFIX = "remote://"  # 节点上存储位置的目录标识：remote://节点名/存储位置标识
+MEDIA_FIELDS = ("duration", "width", "height", "codec", "bitrate")  # 节点文件列表中元数据列的顺序
+
+# 性能统计配置
+SLOW_CALL_SECONDS = float(os.environ.get("WEBUI_SLOW_CALL_SECONDS", "1.0"))  # 超过该耗时的调用记为慢调用
+PROFILE_SAMPLE_RATE = float(os.environ.get("WEBUI_PROFILE_SAMPLE_RATE", "0.05"))  # 用cProfile采样的调用比例
+PROFILE_TOP = 15  # 慢调用日志中列出的函数数
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # 延迟直方图上界（秒）
+
+# 日志配置
+LOG_FILE = os.environ.get("WEBUI_LOG_FILE", os.path.join("logs", "webui.log"))  # 日志文件，设为空字符串则只输出到控制台
+LOG_MAX_BYTES = int(os.environ.get("WEBUI_LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # 单个日志文件的大小上限
+LOG_BACKUPS = 5  # 保留的历史日志文件数
+LOG_FORMAT = os.environ.get("WEBUI_LOG_FORMAT", "text")  # text / json（每行一个JSON对象）
+LOG_SUMMARY_INTERVAL = 5.0  # 批量操作中同类日志的最短输出间隔（秒）
+
+
+class BatchFlushMixin:
+    """写入每条记录后不立即flush，由日志线程在一批记录写完后统一flush"""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        logging.StreamHandler.flush(self)
+
+
+class BatchedStreamHandler(BatchFlushMixin, logging.StreamHandler):
+    """批量flush的控制台日志"""
+
+
+class BatchedRotatingFileHandler(BatchFlushMixin, logging.handlers.RotatingFileHandler):
+    """批量flush、按大小轮转的文件日志"""
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """后台日志线程：队列取空时才flush，突发的大量日志合并成一次写入"""
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush_batch()
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化日志：每条记录输出为一行JSON"""
+
+    def format(self, record):
+        data = {"time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"), "level": record.levelname,
+                "logger": record.name, "thread": record.threadName, "message": record.getMessage()}
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_logging():
+    """日志只在调用线程中放入队列，格式化和写文件都在后台线程完成"""
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    handlers = [BatchedStreamHandler()]
+    if LOG_FILE:
+        os.makedirs(os.path.dirname(LOG_FILE) or ".", exist_ok=True)
+        handlers.append(BatchedRotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                                                   backupCount=LOG_BACKUPS, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    listener = BatchingQueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # 最先注册、最后执行，其它退出处理函数的日志也能写出
 
-# 初始化文件状态跟踪变量
-last_input_files = []
-last_output_files = []
 
 # 配置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+setup_logging()
 
 def log_info(message):
     """记录INFO级别日志"""
@@ -32,596 +330,5183 @@ def log_error(message):
     """记录ERROR级别日志"""
     logging.error(message)
 
-def list_files(directory):
-    """列出目录中的所有视频文件"""
-    files = []
-    for f in os.listdir(directory):
-        if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm')):
-            path = os.path.join(directory, f)
-            size = f"{os.path.getsize(path) / 1024 / 1024:.2f} MB"
-            mtime = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M')
-            # 修改：返回列表而不是元组
-            files.append([False, f, path, size, mtime])  # 使用方括号创建列表
-    log_info(f"列出目录 {directory} 中的文件，找到 {len(files)} 个视频文件")
-    return files
 
+class LogSummary:
+    """批量操作的汇总日志：同一类消息在间隔内只输出一次，并附带期间被合并的条数"""
 
-# 修改刷新函数 - 仅当文件实际变化时刷新
-def refresh_files_only():
-    """仅当文件变化时刷新文件列表，保留当前选中状态"""
-    global last_input_files, last_output_files
-    
-    # 获取当前文件列表
-    current_input = list_files(INPUT_DIR)
-    current_output = list_files(OUTPUT_DIR)
-    
-    # 检查文件是否有变化
-    input_changed = current_input != last_input_files
-    output_changed = current_output != last_output_files
-    
-    # 更新最后已知状态
-    if input_changed:
-        last_input_files = current_input
-        log_info(f"检测到input目录文件变化，已更新文件列表，当前文件数: {len(current_input)}")
-    if output_changed:
-        last_output_files = current_output
-        log_info(f"检测到output目录文件变化，已更新文件列表，当前文件数: {len(current_output)}")
-    
-    # 只有变化时才返回新列表
-    if input_changed or output_changed:
-        return current_input, current_output
-    else:
-        # 没有变化时返回gr.update()以保持当前状态
-        log_info("文件未发生变化，保持当前状态")
-        return gr.update(), gr.update()
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> [被合并的条数, 上次输出时间]
 
+    def __call__(self, key, message, error=False):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.setdefault(key, [0, -self.interval])
+            if now - entry[1] < self.interval:
+                entry[0] += 1
+                return
+            suppressed, entry[0], entry[1] = entry[0], 0, now
+        if suppressed:
+            message += f"（此前 {self.interval:.0f} 秒内另有 {suppressed} 条同类日志已合并）"
+        (log_error if error else log_info)(message)
 
-# 完整刷新函数 - 用于上传/删除等操作
-def full_refresh():
-    """完全刷新文件列表并清空选中状态"""
-    global last_input_files, last_output_files
-    
-    input_list = list_files(INPUT_DIR)
-    output_list = list_files(OUTPUT_DIR)
-    
-    # 更新最后已知状态
-    last_input_files = input_list
-    last_output_files = output_list
-    
-    log_info(f"执行完整刷新，input文件数: {len(input_list)}, output文件数: {len(output_list)}")
-    return input_list, output_list, [], []
 
+# 全局汇总日志
+log_summary = LogSummary(LOG_SUMMARY_INTERVAL)
 
-def upload_file(file):
-    """上传文件到input目录"""
-    if file:
-        filename = os.path.basename(file.name)
-        dest = os.path.join(INPUT_DIR, filename)
-        shutil.copy(file.name, dest)
-        log_info(f"上传文件: {filename} 到 {INPUT_DIR} 目录")
-    else:
-        log_info("未选择文件进行上传")
-    return full_refresh()
+class Metrics:
+    """调用统计 - 次数、错误数、延迟直方图和读写字节数，以Prometheus文本格式输出"""
 
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> {"calls", "errors", "seconds", "buckets", "bytes_read", "bytes_written"}
+        self.stats = {}
+        # 当前上下文中正在执行的被统计函数，读写字节数记到它名下
+        self.current = contextvars.ContextVar("metrics_current", default=None)
+        self.profiling = contextvars.ContextVar("metrics_profiling", default=False)
 
-def delete_files(file_paths):
-    """批量删除文件"""
-    if not file_paths:
-        log_info("删除请求中未选择文件")
-        return full_refresh()
-        
-    deleted_count = 0
-    for path in file_paths:
-        if os.path.exists(path):
+    def _entry(self, name):
+        """返回统计条目（调用方需持有锁）"""
+        entry = self.stats.get(name)
+        if entry is None:
+            entry = self.stats[name] = {"calls": 0, "errors": 0, "seconds": 0.0,
+                                        "buckets": [0] * len(LATENCY_BUCKETS), "bytes_read": 0, "bytes_written": 0}
+        return entry
+
+    def observe(self, name, seconds, error=False):
+        """记录一次调用"""
+        with self.lock:
+            entry = self._entry(name)
+            entry["calls"] += 1
+            entry["errors"] += bool(error)
+            entry["seconds"] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+                    break
+
+    def add_io(self, read=0, written=0, name=None):
+        """记录读写字节数，未指定name时记到当前正在执行的被统计函数"""
+        name = name or self.current.get() or "other"
+        with self.lock:
+            entry = self._entry(name)
+            entry["bytes_read"] += read
+            entry["bytes_written"] += written
+
+    @contextlib.contextmanager
+    def track(self, name):
+        """统计一段代码；按采样率用cProfile记录，慢调用时把最耗时的函数写入日志"""
+        profiler = None
+        if not self.profiling.get() and random.random() < PROFILE_SAMPLE_RATE:
+            import cProfile  # 只在采样到的调用中用到，延迟导入以加快启动
+            profiler = cProfile.Profile()
             try:
-                os.remove(path)
-                log_info(f"删除文件: {path}")
-                deleted_count += 1
-            except Exception as e:
-                log_error(f"删除文件失败: {path}, 错误: {str(e)}")
-        else:
-            log_error(f"尝试删除不存在的文件: {path}")
-    
-    log_info(f"批量删除完成，成功删除 {deleted_count} 个文件")
-    return full_refresh()
+                profiler.enable()
+            except ValueError:
+                profiler = None  # 已有其它分析器在运行
+        token = self.current.set(name)
+        profiling_token = self.profiling.set(self.profiling.get() or profiler is not None)
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+            self.profiling.reset(profiling_token)
+            self.current.reset(token)
+            self.observe(name, elapsed, error)
+            if elapsed >= SLOW_CALL_SECONDS:
+                message = f"慢调用: {name} 耗时 {elapsed:.2f} 秒"
+                if profiler is not None:
+                    import pstats
+                    out = io.StringIO()
+                    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+                    message += "\n" + out.getvalue()
+                logging.warning(message)
 
+    def render(self):
+        """Prometheus文本格式"""
+        with self.lock:
+            stats = {name: {**entry, "buckets": list(entry["buckets"])} for name, entry in self.stats.items()}
+        lines = []
 
-def download_files(file_paths):
-    """批量下载文件 - 创建ZIP压缩包"""
-    if not file_paths:
-        log_info("下载请求中未选择文件")
-        return None, "📥 请先选择要下载的文件！"  # 添加错误提示
-    
-    # 确定来源文件夹名称 (input/output)
-    source_dir = "input" if file_paths and file_paths[0].startswith(INPUT_DIR) else "output"
-    
-    # 获取文件名（不带扩展名）
-    if len(file_paths) == 1:
-        base_name = os.path.splitext(os.path.basename(file_paths[0]))[0]
-        zip_name = f"{source_dir}_{base_name}.zip"
-    else:
-        zip_name = f"{source_dir}_多个文件.zip"
-    
-    zip_path = os.path.join(DOWNLOAD_DIR, zip_name)
-    
+        def label(name):
+            return name.replace("\\", "\\\\").replace('"', '\\"')
+
+        # 只记录过字节数、从未计时的名称（如"other"）不输出调用次数和耗时序列
+        timed = {name: entry for name, entry in stats.items() if entry["calls"]}
+        for metric, key, kind, help_text, series in (
+                ("webui_calls_total", "calls", "counter", "调用次数", timed),
+                ("webui_errors_total", "errors", "counter", "抛出异常的调用次数", timed),
+                ("webui_bytes_read_total", "bytes_read", "counter", "读取的字节数", stats),
+                ("webui_bytes_written_total", "bytes_written", "counter", "写入的字节数", stats)):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            lines += [f'{metric}{{function="{label(name)}"}} {entry[key]}' for name, entry in sorted(series.items())]
+        metric = "webui_call_duration_seconds"
+        lines += [f"# HELP {metric} 调用耗时", f"# TYPE {metric} histogram"]
+        for name, entry in sorted(timed.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, entry["buckets"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{function="{label(name)}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{function="{label(name)}",le="+Inf"}} {entry["calls"]}')
+            lines.append(f'{metric}_sum{{function="{label(name)}"}} {entry["seconds"]:.6f}')
+            lines.append(f'{metric}_count{{function="{label(name)}"}} {entry["calls"]}')
+        return "\n".join(lines) + "\n"
+
+
+# 全局调用统计
+METRICS = Metrics()
+
+
+def instrument(name=None):
+    """统计函数的调用次数、耗时和异常；生成器和协程函数按整个执行过程计时（不做采样分析）"""
+    def decorator(fn):
+        metric_name = name or fn.__name__
+        if inspect.isgeneratorfunction(fn):
+            # 生成器的每一步可能在不同线程/上下文中执行，不能使用上下文变量
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                error = False
+                try:
+                    yield from fn(*args, **kwargs)
+                except GeneratorExit:
+                    raise
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    METRICS.observe(metric_name, time.perf_counter() - started, error)
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            # 协程等待期间事件循环会执行其它任务，不能在其中开启cProfile
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                error = False
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    METRICS.observe(metric_name, time.perf_counter() - started, error)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with METRICS.track(metric_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class PathLocks:
+    """按路径的建议锁 - 进程内用线程锁，跨进程（多个服务实例或外部脚本）再加fcntl.flock"""
+
+    def __init__(self, lock_dir, stripes):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    @contextlib.contextmanager
+    def hold(self, path):
+        """独占持有path对应的锁（同一线程不可重入，持有期间不要再获取其它路径的锁）"""
+        key = os.path.abspath(path).encode("utf-8")
+        stripe = int.from_bytes(hashlib.sha1(key).digest()[:4], "big") % self.stripes
+        with self.locks[stripe], flock_file(os.path.join(self.lock_dir, f"{stripe:03d}.lock")):
+            yield
+
+
+@contextlib.contextmanager
+def flock_file(lock_path):
+    """对锁文件加跨进程的独占flock（没有fcntl时直接返回）"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
     try:
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for path in file_paths:
-                if os.path.exists(path):
-                    zipf.write(path, os.path.basename(path))
-                    log_info(f"添加文件到压缩包: {path}")
-                else:
-                    log_error(f"尝试添加不存在的文件到压缩包: {path}")
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # 关闭文件描述符即释放flock
 
-        log_info(f"下载文件准备完成: {zip_path}")
-        return zip_path, "📥 下载文件已准备好！"  # 添加成功提示
-    except Exception as e:
-        log_error(f"创建下载文件失败: {str(e)}")
-        return None, "📥 下载文件准备失败！"
 
+class KeyLocks:
+    """按键的互斥锁 - 用于耗时很长的操作（例如生成压缩包），与PATH_LOCKS的条带分开，
+    不会让恰好落在同一条带上的上传、删除等待；只为正在使用的键保留线程锁，跨进程再对<前缀><键>.lock加flock"""
 
-def preview_file(file_path):
-    """预览单个视频文件"""
-    if file_path and os.path.exists(file_path):
-        log_info(f"预览文件: {file_path}")
-        return file_path
-    else:
-        log_info(f"尝试预览不存在的文件: {file_path}")
+    def __init__(self, lock_dir, prefix):
+        self.lock_dir = lock_dir
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.locks = {}  # 键 -> [线程锁, 等待或持有的线程数]
+
+    def path_for(self, key):
+        return os.path.join(self.lock_dir, f"{self.prefix}{key}.lock")
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        """独占持有key对应的锁"""
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0], flock_file(self.path_for(key)):
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
+
+    def discard(self, key):
+        """删除不再使用的键的锁文件"""
+        with contextlib.suppress(OSError):
+            os.unlink(self.path_for(key))
+
+
+# 全局路径锁：写入、改名和删除文件时持有
+PATH_LOCKS = PathLocks(LOCK_DIR, LOCK_STRIPES)
+# 压缩包生成锁：同一内容的压缩包同时只由一个请求生成
+ARCHIVE_LOCKS = KeyLocks(LOCK_DIR, "archive-")
+
+
+class DevicePools:
+    """按磁盘（st_dev）划分的线程池 - 每个磁盘的IO在自己的池中排队，慢盘上的任务不会拖住其它磁盘"""
+
+    def __init__(self, workers, name):
+        self.workers = workers
+        self.name = name
+        self.lock = threading.Lock()
+        self.devices = {}  # 目录 -> st_dev
+        self.pools = {}  # st_dev -> ThreadPoolExecutor
+
+    def device(self, directory):
+        """目录所在的设备号（目录不存在时归入同一个池；代理节点上的目录按节点划分）"""
+        if directory.startswith(REMOTE_PREFIX):
+            return directory[len(REMOTE_PREFIX):].split("/", 1)[0]
+        with self.lock:
+            dev = self.devices.get(directory)
+        if dev is None:
+            try:
+                dev = os.stat(directory or ".").st_dev
+            except OSError:
+                return None
+            with self.lock:
+                self.devices[directory] = dev
+        return dev
+
+    def submit(self, directory, fn, *args):
+        """在directory所在磁盘的线程池中执行fn(*args)"""
+        dev = self.device(directory)
+        with self.lock:
+            pool = self.pools.get(dev)
+            if pool is None:
+                pool = self.pools[dev] = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=f"{self.name}-{len(self.pools)}")
+        return pool.submit(fn, *args)
+
+    def count(self):
+        """已创建的线程池数（即涉及的磁盘数）"""
+        with self.lock:
+            return len(self.pools)
+
+
+# 扫描目录、为打包预读文件的按磁盘线程池（内容哈希的线程池在HashIndex中）
+SCAN_POOLS = DevicePools(SCAN_WORKERS, "scan")
+ARCHIVE_POOLS = DevicePools(ARCHIVE_WORKERS, "archive")
+
+
+class FileTable:
+    """紧凑的目录条目表 - 大小、修改时间、inode按列存放在array中，每个文件只占一个文件名对象和三个定长数值
+
+    对外表现为只读的 {name: (size, mtime, ino)} 映射，条目元组在访问时才生成；
+    显示用的字符串只在渲染当前页时格式化，排序缓存和选中集合都直接引用这里的文件名对象。
+    """
+
+    __slots__ = ("rows", "names", "sizes", "mtimes", "inos")
+
+    def __init__(self, items=()):
+        self.rows = {}  # name -> 行号
+        self.names = []
+        self.sizes = array("q")
+        self.mtimes = array("d")  # 与os.stat的st_mtime一致，缩略图、元数据等缓存键都以它为准
+        self.inos = array("Q")
+        for name, entry in items:
+            self[name] = entry
+
+    @classmethod
+    def from_columns(cls, data):
+        """从快照中的按列数据恢复"""
+        table = cls()
+        table.names = data["names"]
+        table.sizes = array("q", data["sizes"])
+        table.mtimes = array("d", data["mtimes"])
+        table.inos = array("Q", data["inos"])
+        table.rows = {name: i for i, name in enumerate(table.names)}
+        return table
+
+    def to_columns(self):
+        """按列导出，用于写入快照"""
+        return {"names": self.names, "sizes": self.sizes.tolist(),
+                "mtimes": self.mtimes.tolist(), "inos": self.inos.tolist()}
+
+    def copy(self):
+        table = FileTable()
+        table.rows = dict(self.rows)
+        table.names = list(self.names)
+        table.sizes = array("q", self.sizes)
+        table.mtimes = array("d", self.mtimes)
+        table.inos = array("Q", self.inos)
+        return table
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, name):
+        i = self.rows[name]
+        return self.sizes[i], self.mtimes[i], self.inos[i]
+
+    def get(self, name, default=None):
+        i = self.rows.get(name)
+        return default if i is None else (self.sizes[i], self.mtimes[i], self.inos[i])
+
+    def items(self):
+        for name, i in self.rows.items():
+            yield name, (self.sizes[i], self.mtimes[i], self.inos[i])
+
+    def __setitem__(self, name, entry):
+        size, mtime, ino = entry
+        i = self.rows.get(name)
+        if i is None:
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+            self.sizes.append(size)
+            self.mtimes.append(mtime)
+            self.inos.append(ino)
+        else:
+            self.sizes[i], self.mtimes[i], self.inos[i] = size, mtime, ino
+
+    def __delitem__(self, name):
+        """删除一行：把最后一行移到被删除的位置，各列保持紧凑"""
+        i = self.rows.pop(name)
+        last = len(self.names) - 1
+        if i != last:
+            moved = self.names[last]
+            self.names[i] = moved
+            self.sizes[i], self.mtimes[i], self.inos[i] = self.sizes[last], self.mtimes[last], self.inos[last]
+            self.rows[moved] = i
+        self.names.pop()
+        self.sizes.pop()
+        self.mtimes.pop()
+        self.inos.pop()
+
+    def __eq__(self, other):
+        if len(self) != len(other):
+            return False
+        return all(other.get(name) == entry for name, entry in self.items())
+
+
+class ChangeJournal:
+    """持久化的变更日志 - 文件索引记录的每条新增/修改/删除按单调递增的seq写入SQLite（重启后继续编号），
+    下游按游标读取变更即可同步，不必重新列出整个目录"""
+
+    def __init__(self, db_path, keep):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY, time REAL, directory TEXT, kind TEXT, name TEXT, size INTEGER, mtime REAL)""")
+        self.db.commit()
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.pending = deque()  # 尚未写入数据库的变更（在持有文件索引锁时追加，由flush批量写入）
+        self.last_seq = self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def append(self, seq, directory, kind, name, entry):
+        """登记一条变更（只追加到内存队列）"""
+        self.pending.append((seq, time.time(), directory, kind, name, entry[0], entry[1]))
+
+    def flush(self):
+        """把队列中的变更批量写入数据库，并删除超出保留条数的旧记录"""
+        with self.lock:
+            rows = [self.pending.popleft() for _ in range(len(self.pending))]
+            if not rows:
+                return
+            try:
+                self.db.executemany("INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self.db.execute("DELETE FROM changes WHERE seq <= ?", (rows[-1][0] - self.keep,))
+                self.db.commit()
+            except sqlite3.Error as e:
+                log_error(f"写入变更日志失败: {e}")
+                return
+            self.last_seq = rows[-1][0]
+
+    def since(self, seq, limit, directories=None):
+        """返回(seq之后的最多limit条变更, 日志中最早的seq, 已写入的最新seq)；directories限定目录"""
+        self.flush()
+        with self.lock:
+            head = self.last_seq
+            first = self.db.execute("SELECT MIN(seq) FROM changes").fetchone()[0] or head + 1
+            sql, params = "SELECT * FROM changes WHERE seq > ? AND seq <= ?", [seq, head]
+            if directories is not None:
+                sql += f" AND directory IN ({','.join('?' * len(directories))})"
+                params += directories
+            rows = self.db.execute(sql + " ORDER BY seq LIMIT ?", params + [limit]).fetchall()
+        return rows, first, head
+
+
+class SortOrder:
+    """一个目录按某个字段排好序的文件名，以及与之对应的排序值（按名称排序时为None）；
+    目录中的增删改按二分查找就地插入、删除，不重新排序整个目录"""
+
+    __slots__ = ("names", "values", "version", "data", "built")
+
+    def __init__(self, names, values, version, data, built):
+        self.names = names
+        self.values = values  # array("d")，与names一一对应
+        self.version = version  # 已反映到的目录版本
+        self.data = data  # 排序时额外排序字段的数据版本
+        self.built = built  # 整体排序的时间（time.monotonic）
+
+    def key(self, i):
+        return self.names[i] if self.values is None else (self.values[i], self.names[i])
+
+    def insert(self, name, value):
+        i = bisect.bisect_left(range(len(self.names)), name if self.values is None else (value, name), key=self.key)
+        self.names.insert(i, name)
+        if self.values is not None:
+            self.values.insert(i, value)
+
+    def remove(self, name, value):
+        """删除一个文件名；排序后额外排序字段的数据有变化、二分定位不到时退回线性查找"""
+        names = self.names
+        i = bisect.bisect_left(range(len(names)), name if self.values is None else (value, name), key=self.key)
+        if i >= len(names) or names[i] != name:
+            try:
+                i = names.index(name)
+            except ValueError:
+                return
+        del names[i]
+        if self.values is not None:
+            del self.values[i]
+
+
+class FileIndex:
+    """持久化的增量文件索引 - 目录未变化时不再逐个stat文件"""
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.lock = threading.RLock()
+        # directory -> {"sig": [dev, ino, mtime_ns], "verified": 时间戳, "entries": FileTable}
+        self.dirs = {}
+        self.dirty = False
+        # 变更日志：(seq, directory, kind, name, entry)，kind为added/removed/modified
+        self.seq = 0
+        self.versions = {}  # directory -> 最近一次变更的seq
+        self.journal = deque(maxlen=INDEX_JOURNAL_SIZE)
+        # 预计算的排序索引：directory -> {sort_key: SortOrder}，随变更增量更新
+        self.orders = {}
+        self.sort_locks = {}  # (directory, sort_key) -> 整体排序锁：重新排序期间其它线程继续使用旧顺序
+        # 最近的过滤结果：(directory, sort_key, filter) -> (version, names)
+        self.filter_cache = {}
+        # 多个目录合并后的顺序：(directories, sort_key, filter) -> (versions, 目录序号数组, names)
+        self.merge_cache = {}
+        # 额外的排序字段：sort_key -> (返回目录数据版本的函数(directory), 排序键函数(directory, name, entry))
+        self.sort_providers = {}
+        # 变更监听函数：listener(directory, kind, name, entry)，在持有锁时调用，必须只做轻量操作
+        self.listeners = []
+        # 整个目录被清空时的监听函数：listener(directory, removed)，removed为被删除的全部条目，每次清空只调用一次
+        self.clear_listeners = []
+        # 代理节点上的目录：变更照常记录，但文件不在本机，不通知缩略图、元数据等监听函数
+        self.external = set()
+        self.change_log = None  # 持久化的变更日志（ChangeJournal），每条变更都会写入
+
+    def _record(self, directory, kind, name, entry, old=None):
+        """记录一条变更，并增量更新该目录已有的排序索引（调用方需持有锁）；
+        kind为removed时entry为被删除的条目，modified时old为修改前的条目"""
+        previous = self.versions.get(directory, 0)
+        self.seq += 1
+        self.versions[directory] = self.seq
+        orders = self.orders.get(directory)
+        if orders:
+            for sort_key, order in list(orders.items()):
+                if order.version != previous:
+                    del orders[sort_key]  # 已错过变更的排序不再可信
+                    continue
+                self._reorder(order, directory, sort_key, kind, name, entry, old)
+                order.version = self.seq
+        self.journal.append((self.seq, directory, kind, name, entry))
+        if self.change_log is not None:
+            self.change_log.append(self.seq, directory, kind, name, entry)
+        if directory in self.external:
+            return
+        for listener in self.listeners:
+            try:
+                listener(directory, kind, name, entry)
+            except Exception as e:
+                log_error(f"文件变更监听函数出错: {e}")
+
+    def _record_diff(self, directory, old_entries, entries):
+        """对比新旧条目并记录差异，返回是否有变化（调用方需持有锁）"""
+        changes = []  # (kind, name, entry, old)
+        kept = 0  # 新条目中在旧条目里也存在的文件数
+        for name, entry in entries.items():
+            old = old_entries.get(name)
+            if old is None:
+                changes.append(("added", name, entry, None))
+                continue
+            kept += 1
+            if old != entry:
+                changes.append(("modified", name, entry, old))
+        if kept < len(old_entries):  # 只有存在被删除的文件时才需要再遍历旧条目
+            changes += [("removed", name, entry, None) for name, entry in old_entries.items() if name not in entries]
+        if len(changes) > SORT_INCREMENTAL_LIMIT:
+            self.orders.pop(directory, None)  # 变化很多时下次整体排序更快
+        for kind, name, entry, old in changes:
+            self._record(directory, kind, name, entry, old)
+        return bool(changes)
+
+    def changes_since(self, seq):
+        """返回seq之后的变更列表；日志已被截断时返回None，调用方应整体重载"""
+        with self.lock:
+            if seq >= self.seq:
+                return []
+            if not self.journal or self.journal[0][0] > seq + 1:
+                return None
+            return [c for c in self.journal if c[0] > seq]
+
+    def durable_seq(self):
+        """对外公布的变更序号：先把此前的变更写入持久化的变更日志，异常退出重启后该序号不会被其它变更重复使用"""
+        with self.lock:
+            if self.change_log is None:
+                return self.seq
+            self.change_log.flush()
+            return self.change_log.last_seq
+
+    def version(self, directory):
+        """目录当前的版本号（最近一次变更的seq）"""
+        return self.versions.get(directory, 0)
+
+    def indexed(self, directory):
+        """目录是否已有索引（包括启动时载入的快照）"""
+        with self.lock:
+            return directory in self.dirs
+
+    def entries(self, directory):
+        """直接读取索引中的条目，不访问磁盘；目录尚未索引时才扫描"""
+        with self.lock:
+            state = self.dirs.get(directory)
+            if state is not None:
+                return state["entries"]
+        return self.scan(directory)
+
+    def _data_version(self, directory, sort_key):
+        """额外排序字段在该目录中的数据版本（size、mtime、name为0）"""
+        provider = self.sort_providers.get(sort_key)
+        return provider[0](directory) if provider else 0
+
+    def _sort_version(self, directory, sort_key):
+        """排序结果的版本：目录版本，加上排序索引所依据的额外排序字段数据版本"""
+        order = self.orders.get(directory, {}).get(sort_key)
+        return self.version(directory), order.data if order else self._data_version(directory, sort_key)
+
+    def _entry_value(self, directory, sort_key, name, entry):
+        """条目在排序字段下的值（按名称排序时为None）"""
+        if sort_key == "size":
+            return entry[0]
+        if sort_key == "mtime":
+            return entry[1]
+        if sort_key in self.sort_providers:
+            return self.sort_providers[sort_key][1](directory, name, entry)
         return None
 
+    def _reorder(self, order, directory, sort_key, kind, name, entry, old):
+        """把一条变更应用到排序索引：删除旧位置、按新值二分插入（调用方需持有锁）"""
+        if kind == "removed":
+            order.remove(name, self._entry_value(directory, sort_key, name, entry))
+        elif sort_key != "name" or kind == "added":
+            if old is not None:
+                order.remove(name, self._entry_value(directory, sort_key, name, old))
+            order.insert(name, self._entry_value(directory, sort_key, name, entry))
 
-def list_downloads():
-    """列出下载目录中的所有文件"""
-    downloads = [os.path.join(DOWNLOAD_DIR, f) for f in os.listdir(DOWNLOAD_DIR) 
-                 if os.path.isfile(os.path.join(DOWNLOAD_DIR, f))]
-    log_info(f"列出下载目录文件，当前有 {len(downloads)} 个下载文件")
-    return downloads
+    def _order(self, directory, sort_key, stale_data=False):
+        """已反映目录当前状态的排序索引，没有时返回None（调用方需持有锁）；额外排序字段的数据变化后，
+        整体排序不到SORT_DATA_REFRESH秒时继续使用旧顺序，stale_data=True时不论多久都使用"""
+        order = self.orders.get(directory, {}).get(sort_key)
+        if order is None or order.version != self.version(directory):
+            return None
+        if (not stale_data and order.data != self._data_version(directory, sort_key)
+                and time.monotonic() - order.built >= SORT_DATA_REFRESH):
+            return None
+        return order
 
+    def _sort(self, directory, sort_key, entries):
+        """整体排序（不持有锁）：返回(文件名列表, 排序值数组或None)"""
+        names = entries.names
+        if sort_key == "name":
+            return sorted(names), None
+        if sort_key in ("size", "mtime"):
+            values = entries.sizes if sort_key == "size" else entries.mtimes
+        else:
+            key_fn = self.sort_providers[sort_key][1]
+            values = [key_fn(directory, name, entries[name]) for name in names]
+        order = sorted(range(len(names)), key=lambda i: (values[i], names[i]))
+        return [names[i] for i in order], array("d", (values[i] for i in order))
 
-def clear_downloads():
-    """清除下载目录中的所有文件"""
-    cleared_count = 0
-    for f in os.listdir(DOWNLOAD_DIR):
-        file_path = os.path.join(DOWNLOAD_DIR, f)
+    def sorted_names(self, directory, sort_key="name"):
+        """返回按指定字段排序的文件名列表（索引中的列表会被就地增量更新，在锁外遍历时应先复制）
+        只在首次使用或一次变化很多时整体排序：排序在锁外进行，期间记录的变更排好后再补上"""
+        with self.lock:
+            order = self._order(directory, sort_key)
+            if order is not None:
+                return order.names
+            stale = self._order(directory, sort_key, stale_data=True)
+            building = self.sort_locks.setdefault((directory, sort_key), threading.Lock())
+        # 不等待其它线程的整体排序（调用方可能持有self.lock）：有旧顺序时先使用旧顺序，否则自己排序
+        acquired = building.acquire(blocking=False)
+        if not acquired and stale is not None:
+            return stale.names
         try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-                log_info(f"清除下载文件: {file_path}")
-                cleared_count += 1
+            with self.lock:
+                order = self._order(directory, sort_key)
+                if order is not None:
+                    return order.names
+                entries = self.entries(directory).copy()
+                start, data, built = self.seq, self._data_version(directory, sort_key), time.monotonic()
+            names, values = self._sort(directory, sort_key, entries)
+            with self.lock:
+                changes = [c for c in self.journal if c[0] > start and c[1] == directory]
+                if (self.seq > start and self.journal[0][0] > start + 1) or len(changes) > SORT_INCREMENTAL_LIMIT:
+                    return names  # 排序期间变化太多，不缓存，下次重新排序
+                order = SortOrder(names, values, 0, data, built)
+                latest = {}  # 补上变更时每个文件的上一个条目
+                for _, _, kind, name, entry in changes:
+                    old = latest[name] if name in latest else entries.get(name)
+                    self._reorder(order, directory, sort_key, kind, name, entry, old)
+                    latest[name] = None if kind == "removed" else entry
+                order.version = self.version(directory)
+                self.orders.setdefault(directory, {})[sort_key] = order
+                return names
+        finally:
+            if acquired:
+                building.release()
+
+    def query(self, directory, sort_key="name", filter_text=""):
+        """按排序索引返回（可选按文件名过滤的）文件名列表"""
+        names = self.sorted_names(directory, sort_key)
+        needle = filter_text.strip().lower()
+        if not needle:
+            return names
+        with self.lock:
+            version = self._sort_version(directory, sort_key)
+            cache_key = (directory, sort_key, needle)
+            cached = self.filter_cache.get(cache_key)
+            if cached and cached[0] == version:
+                return cached[1]
+            filtered = [n for n in names if needle in n.lower()]
+            if len(self.filter_cache) >= 32:
+                self.filter_cache.clear()
+            self.filter_cache[cache_key] = (version, filtered)
+            return filtered
+
+    def merged(self, directories, sort_key="name", filter_text=""):
+        """多个目录按同一排序合并：返回(每行的目录序号数组, 文件名列表)，任一目录变化后才重新合并"""
+        lists = [self.query(directory, sort_key, filter_text) for directory in directories]
+        with self.lock:
+            version = tuple(self._sort_version(directory, sort_key) for directory in directories)
+            cache_key = (tuple(directories), sort_key, filter_text.strip().lower())
+            cached = self.merge_cache.get(cache_key)
+            if cached and cached[0] == version:
+                return cached[1]
+            tables = [self.entries(directory) for directory in directories]
+            if sort_key in ("size", "mtime"):
+                columns = [t.sizes if sort_key == "size" else t.mtimes for t in tables]
+                key = lambda item: (columns[item[0]][tables[item[0]].rows[item[1]]], item[1])
+            elif sort_key in self.sort_providers:
+                key_fn = self.sort_providers[sort_key][1]
+                key = lambda item: (key_fn(directories[item[0]], item[1], tables[item[0]][item[1]]), item[1])
+            else:
+                key = lambda item: item[1]
+            # 每个目录的列表已按同一键排好序，归并即可
+            streams = [zip(itertools.repeat(i), names) for i, names in enumerate(lists)]
+            order, names = array("H"), []
+            for i, name in heapq.merge(*streams, key=key):
+                order.append(i)
+                names.append(name)
+            if len(self.merge_cache) >= 8:
+                self.merge_cache.clear()
+            self.merge_cache[cache_key] = (version, (order, names))
+            return order, names
+
+    def page_roots(self, directories, view):
+        """多个目录合并后的当前页：返回[(目录, 文件名)]、总数、页码和总页数"""
+        if len(directories) == 1:
+            names, total, page, page_count = self.page(directories[0], view)
+            return [(directories[0], n) for n in names], total, page, page_count
+        order, names = self.merged(directories, view["sort"], view["filter"])
+        total = len(names)
+        page_size = max(1, int(view["page_size"]))
+        page_count = max(1, (total + page_size - 1) // page_size)
+        page = min(max(1, int(view["page"])), page_count)
+        start, end = (page - 1) * page_size, min(page * page_size, total)
+        rows = range(total - start - 1, total - end - 1, -1) if view["descending"] else range(start, end)
+        return [(directories[order[i]], names[i]) for i in rows], total, page, page_count
+
+    def sort_value(self, directory, name, sort_key):
+        """文件在排序字段下的值（与sorted_names、merged使用的顺序一致，按名称排序时为空串）"""
+        value = self._entry_value(directory, sort_key, name, self.entries(directory)[name])
+        return "" if value is None else value
+
+    def page_after(self, directories, sort_key, filter_text, cursor, limit, descending=False):
+        """游标分页：返回排在cursor之后的最多limit个(目录序号, 文件名)、最后一行的游标和总数
+        游标为(排序值, 文件名, 目录序号)，按排序键二分定位，翻页期间有文件增删也不会跳过或重复"""
+        for directory in directories:
+            self.sorted_names(directory, sort_key)  # 需要整体排序时先在锁外完成
+        with self.lock:
+            if len(directories) == 1:
+                order, names = None, self.query(directories[0], sort_key, filter_text)
+            else:
+                order, names = self.merged(directories, sort_key, filter_text)
+
+            def key(i):
+                d = order[i] if order is not None else 0
+                return self.sort_value(directories[d], names[i], sort_key), names[i], d
+
+            total = len(names)
+            if descending:
+                end = total if cursor is None else bisect.bisect_left(range(total), tuple(cursor), key=key)
+                rows = range(end - 1, max(end - limit, 0) - 1, -1)
+            else:
+                start = 0 if cursor is None else bisect.bisect_right(range(total), tuple(cursor), key=key)
+                rows = range(start, min(start + limit, total))
+            items = [(order[i] if order is not None else 0, names[i]) for i in rows]
+            return items, key(rows[-1]) if rows else None, total
+
+    def page(self, directory, view):
+        """返回当前页的文件名、总数、页码和总页数"""
+        names = self.query(directory, view["sort"], view["filter"])
+        total = len(names)
+        page_size = max(1, int(view["page_size"]))
+        page_count = max(1, (total + page_size - 1) // page_size)
+        page = min(max(1, int(view["page"])), page_count)
+        start, end = (page - 1) * page_size, min(page * page_size, total)
+        if view["descending"]:
+            # 倒序时直接从排序索引尾部切片，避免复制整个列表
+            page_names = names[total - end:total - start][::-1]
+        else:
+            page_names = names[start:end]
+        return page_names, total, page, page_count
+
+    def load(self):
+        """从磁盘载入上次保存的索引快照"""
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            dirs = data.get("dirs", {})
+            for state in dirs.values():
+                entries = state["entries"]
+                # 兼容旧版快照中的 {name: [size, mtime, ino]} 格式
+                state["entries"] = (FileTable.from_columns(entries) if "names" in entries
+                                    else FileTable(entries.items()))
+                # 重启后的快照一律视为待复核，避免沿用过期的文件信息
+                state["verified"] = 0
+            with self.lock:
+                self.dirs = dirs
+            log_info(f"载入文件索引快照: {self.index_file}，目录数: {len(self.dirs)}")
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            log_error(f"删除下载文件失败: {file_path} - {e}")
-    
-    log_info(f"下载目录清理完成，共清除 {cleared_count} 个文件")
-    return "📥 下载文件已清除！", list_downloads()
+            log_error(f"载入文件索引快照失败: {e}")
 
+    def save(self):
+        """将索引原子地写回磁盘（仅在有变化时）；先写变更日志，快照中的变化一定已记录在日志里"""
+        if self.change_log is not None:
+            self.change_log.flush()
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps({"dirs": {d: {**state, "entries": state["entries"].to_columns()}
+                                        for d, state in self.dirs.items()}}, ensure_ascii=False)
+            self.dirty = False
+        tmp_path = f"{self.index_file}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.index_file)
+        except Exception as e:
+            log_error(f"保存文件索引快照失败: {e}")
 
-# 文件选择处理函数
-def update_selections(input_df, output_df, input_selected, output_selected):
-    """更新选中的文件并返回完整表格数据"""
-    try:
-        # 处理Input选择
-        input_paths = [row[2] for row in input_df] if input_df else []
-        output_paths = [row[2] for row in output_df] if output_df else []
-
-        # 直接使用表格中的选中状态
-        new_input_selected = [path for i, path in enumerate(input_paths) 
-                            if i < len(input_df) and input_df[i][0]]
-      
-        new_output_selected = [path for i, path in enumerate(output_paths) 
-                             if i < len(output_df) and output_df[i][0]]
-
-        # 更新计数显示
-        input_count = len(new_input_selected)
-        output_count = len(new_output_selected)
-      
-        # 更新表格显示状态
-        updated_input_df = []
-        for i, row in enumerate(input_df):
-            updated_row = list(row)
-            if i < len(input_paths):
-                updated_row[0] = input_paths[i] in new_input_selected
-            updated_input_df.append(updated_row)
-      
-        updated_output_df = []
-        for i, row in enumerate(output_df):
-            updated_row = list(row)
-            if i < len(output_paths):
-                updated_row[0] = output_paths[i] in new_output_selected
-            updated_output_df.append(updated_row)
-      
-        log_info(f"更新选择状态 - Input选中: {input_count}, Output选中: {output_count}")
-        return (
-            new_input_selected,  # 更新选中文件路径
-            new_output_selected,  # 更新选中文件路径
-            str(input_count),
-            "\n".join([f"• {os.path.basename(p)}" for p in new_input_selected]) or "暂无选中文件",
-            str(output_count),
-            "\n".join([f"• {os.path.basename(p)}" for p in new_output_selected]) or "暂无选中文件",
-            updated_input_df,  # 返回带有正确选中状态的表格数据
-            updated_output_df   # 返回带有正确选中状态的表格数据
-        )
-    except Exception as e:
-        log_error(f"更新选择时出错: {e}")
-        return input_selected, output_selected, "0", "暂无选中文件", "0", "暂无选中文件", input_df, output_df
+    def scan(self, directory):
+        """返回目录的索引条目，只对新增或inode变化的文件执行stat"""
+        with self.lock:
+            st = os.stat(directory)
+            sig = [st.st_dev, st.st_ino, st.st_mtime_ns]
+            now = time.time()
+            state = self.dirs.get(directory)
 
+            # 目录签名未变化且未到复核时间，直接使用缓存
+            if (state and state["sig"] == sig
+                    and now - state["verified"] < INDEX_VERIFY_INTERVAL):
+                return state["entries"]
 
-# 创建安全更新函数，只返回选择状态
-def safe_update_selections(input_df, output_df, input_selected, output_selected):
-    """安全地更新选择状态（不在UI上刷新文件列表）"""
-    # 只返回选择相关的状态
-    result = update_selections(input_df, output_df, input_selected, output_selected)
-    # 返回：selected_input, selected_output, input_count, input_display, output_count, output_display
-    log_info(f"安全更新选择状态 - Input选中: {len(result[0])}, Output选中: {len(result[1])}")
-    return result[0:6]
+            # 到了复核时间（或首次扫描）则全部重新stat，以发现原地修改的文件
+            full_verify = not state or now - state["verified"] >= INDEX_VERIFY_INTERVAL
+            old_entries = state["entries"].copy() if state else FileTable()
+            start_seq = self.seq
 
+        # 逐个stat时不持有锁（启动时复核大目录可能很久），期间界面仍可读取旧索引
+        entries = FileTable()
+        restat_count = 0
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                ino = entry.inode()  # 来自目录项，无需额外系统调用
+                old = old_entries.get(entry.name)
+                if old and old[2] == ino and not full_verify:
+                    entries[entry.name] = old
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    est = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries[entry.name] = (est.st_size, est.st_mtime, ino)
+                restat_count += 1
 
-def select_all_files(df, is_input=True):
-    """全选当前文件夹的文件"""
-    folder_name = "Input" if is_input else "Output"
-    log_info(f"执行全选操作 - {folder_name}文件夹")
-    
-    if not df:
-        log_info(f"{folder_name}文件夹为空，无可选文件")
-        return [], "0", "暂无选中文件", df
-    
-    # 获取所有文件路径
-    all_paths = [row[2] for row in df]
-    
-    # 更新表格数据，将所有选择列设为True
-    updated_df = []
-    for row in df:
-        new_row = list(row)
-        new_row[0] = True  # 选中状态
-        updated_df.append(new_row)
-    
-    # 更新选中状态
-    count = len(all_paths)
-    display = "\n".join([f"• {os.path.basename(p)}" for p in all_paths]) or "暂无选中文件"
-    
-    log_info(f"全选完成 - {folder_name}文件夹，选中文件数: {count}")
-    return all_paths, str(count), display, updated_df
+        # 目录在本次扫描的时间粒度内被修改过时，签名不可信，下次仍需重扫
+        if time.time_ns() - st.st_mtime_ns < 2_000_000_000:
+            sig = None
+        with self.lock:
+            # 扫描期间已由文件事件更新过的文件，以扫描结束后重新stat的结果为准
+            touched = {c[3] for c in self.journal if c[0] > start_seq and c[1] == directory}
+            state = self.dirs.get(directory)
+            current = state["entries"] if state else FileTable()
+            changed = self._record_diff(directory, current, entries)
+            verified = now if full_verify or not state else state["verified"]
+            self.dirs[directory] = {"sig": sig, "verified": verified, "entries": entries}
+            if changed or not state or state["sig"] != sig:
+                self.dirty = True
+            for name in touched:
+                self.apply_event(directory, name)
+            entries = self.dirs[directory]["entries"]
+            log_info(f"增量扫描目录 {directory}，重新stat {restat_count} 个文件，共 {len(entries)} 个视频文件")
+        if changed:
+            self.save()
+        return entries
 
+    def replace(self, directory, entries):
+        """用外部提供的完整条目（代理节点的文件列表）替换目录索引，记录差异并返回是否有变化"""
+        with self.lock:
+            state = self.dirs.get(directory)
+            changed = self._record_diff(directory, state["entries"] if state else FileTable(), entries)
+            self.dirs[directory] = {"sig": None, "verified": time.time(), "entries": entries}
+            if changed or not state:
+                self.dirty = True
+            return changed
 
-def clear_selection_files(df, is_input=True):
-    """清空当前文件夹的文件选择"""
-    folder_name = "Input" if is_input else "Output"
-    log_info(f"执行清空选择操作 - {folder_name}文件夹")
-    
-    if not df:
-        log_info(f"{folder_name}文件夹为空，无文件可取消选择")
-        return [], "0", "暂无选中文件", df
-    
-    # 更新表格数据，将所有选择列设为False
-    updated_df = []
-    for row in df:
-        new_row = list(row)
-        new_row[0] = False  # 取消选中状态
-        updated_df.append(new_row)
-    
-    # 更新选中状态
-    count = 0
-    display = "暂无选中文件"
-    
-    log_info(f"清空选择完成 - {folder_name}文件夹")
-    return [], str(count), display, updated_df
+    def apply_event(self, directory, name):
+        """根据文件系统事件更新单个条目，只stat这一个文件"""
+        with self.lock:
+            state = self.dirs.get(directory)
+            if state is None:
+                self.scan(directory)
+                return
+            entries = state["entries"]
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+                new = (st.st_size, st.st_mtime, st.st_ino) if os.path.isfile(path) else None
+            except FileNotFoundError:
+                new = None
+            old = entries.get(name)
+            if new is None:
+                if old is not None:
+                    del entries[name]
+                    self._record(directory, "removed", name, old)
+            elif old != new:
+                entries[name] = new
+                self._record(directory, "added" if old is None else "modified", name, new, old)
+            # 监听器会收到后续所有事件，因此可以直接信任当前目录签名，避免整目录重扫
+            try:
+                dst = os.stat(directory)
+                state["sig"] = [dst.st_dev, dst.st_ino, dst.st_mtime_ns]
+            except FileNotFoundError:
+                state["sig"] = None
+            self.dirty = True
 
+    def apply_batch(self, paths):
+        """把一批文件的变化在一次加锁中写入索引（批量操作的事务：读者要么看到整批结果，要么都看不到），
+        只stat这些文件；返回本批记录的变更数"""
+        with self.lock:
+            start = self.seq
+            counts = Counter(os.path.dirname(path) for path in paths)
+            for directory, count in counts.items():
+                if count > SORT_INCREMENTAL_LIMIT:
+                    self.orders.pop(directory, None)  # 整批变化很多时下次整体排序更快
+            for path in paths:
+                directory, name = os.path.split(path)
+                if directory in self.dirs and directory not in self.external:
+                    self.apply_event(directory, name)
+            count = self.seq - start
+        if count:
+            self.save()
+        return count
 
-def update_preview_selector(input_selected, output_selected):
-    """更新预览选择器的选项"""
-    # 合并输入和输出文件夹的选中文件
-    all_selected_files = []
-    
-    # 添加Input文件夹选中的文件
-    if input_selected:
-        for file_path in input_selected:
-            file_name = os.path.basename(file_path)
-            all_selected_files.append((f"[Input] {file_name}", file_path))
-    
-    # 添加Output文件夹选中的文件
-    if output_selected:
-        for file_path in output_selected:
-            file_name = os.path.basename(file_path)
-            all_selected_files.append((f"[Output] {file_name}", file_path))
-    
-    log_info(f"更新预览选择器选项，共有 {len(all_selected_files)} 个选中文件")
-    # 返回选项列表和默认选中值（第一个文件）
-    if all_selected_files:
-        return gr.update(choices=all_selected_files, value=all_selected_files[0][1])
-    else:
-        return gr.update(choices=[], value=None)
+    def refresh_hot(self, directory, window=60):
+        """重新stat最近修改过的文件，用于轮询模式下发现正在写入的文件"""
+        with self.lock:
+            state = self.dirs.get(directory)
+            if state is None:
+                return
+            cutoff = time.time() - window
+            table = state["entries"]
+            hot = [table.names[i] for i, mtime in enumerate(table.mtimes) if mtime >= cutoff]
+            for name in hot:
+                self.apply_event(directory, name)
 
+    def clear(self, directory):
+        """目录已被整体移走（清空文件夹）：一次性删除全部条目，目录版本只变化一次，
+        每个监听函数只收到一次通知；变更日志中仍逐个记录删除，供增量同步使用"""
+        with self.lock:
+            state = self.dirs.get(directory)
+            if state is None:
+                return
+            removed, state["entries"], state["sig"] = state["entries"], FileTable(), None
+            if not len(removed):
+                return
+            self.orders.pop(directory, None)
+            for name, entry in removed.items():
+                self.seq += 1
+                self.journal.append((self.seq, directory, "removed", name, entry))
+                if self.change_log is not None:
+                    self.change_log.append(self.seq, directory, "removed", name, entry)
+            self.versions[directory] = self.seq
+            self.dirty = True
+            if directory in self.external:
+                return
+            for listener in self.clear_listeners:
+                try:
+                    listener(directory, removed)
+                except Exception as e:
+                    log_error(f"文件变更监听函数出错: {e}")
 
-# 创建Gradio界面
-with gr.Blocks(title="视频文件管理预览系统") as demo:
-    gr.Markdown("## 🎥 视频文件管理预览系统")
-    gr.Markdown("上传视频到input目录，处理后的视频保存到output目录")
-
-    # 存储选中的文件路径
-    selected_input_files = gr.State([])
-    selected_output_files = gr.State([])
-
-    with gr.Row():
-        with gr.Column():
-            gr.Markdown("### 📤 Input文件夹")
-            # 初始化时使用完整刷新函数获取文件列表
-            initial_input, initial_output, _, _ = full_refresh()
-            
-            input_files = gr.DataFrame(
-                headers=["选择", "文件名", "路径", "大小", "修改时间"],
-                datatype=["bool", "str", "str", "str", "str"],
-                interactive=True,
-                type="array",
-                value=initial_input  # 设置初始值
-            )
+    def invalidate(self, directory):
+        """标记目录需要在下次访问时重新扫描"""
+        with self.lock:
+            state = self.dirs.get(directory)
+            if state is not None:
+                state["sig"] = None
 
-            with gr.Row():
-                # 移除全选复选框，改为全选按钮
-                select_all_input_btn = gr.Button("✅ 全选", size="sm")
-                clear_selection_input_btn = gr.Button("⭕ 清空选择", size="sm")
-                refresh_input_btn = gr.Button("🔄 刷新", size="sm")
-                upload_btn = gr.UploadButton("⬆️ 上传视频", file_types=["video"], size="sm")
-            with gr.Row():
-                with gr.Column(scale=1):
-                    gr.Markdown("**已选中文件:**")
-                    input_selected_count = gr.Textbox("0", label="数量")
-                    input_selected_display = gr.Textbox("暂无选中文件", label="文件列表", lines=4, interactive=False)
-
-            with gr.Row():
-                download_selected_input = gr.Button("📥 下载选中文件", size="sm")
-                delete_selected_input = gr.Button("🗑️ 删除选中文件", variant="stop", size="sm")
-                clear_input_btn = gr.Button("🧹 清空文件夹", variant="stop", size="sm")
-                download_all_input = gr.Button("📦 下载全部", size="sm")
-
-        with gr.Column():
-            gr.Markdown("### 📥 Output文件夹")
-            output_files = gr.DataFrame(
-                headers=["选择", "文件名", "路径", "大小", "修改时间"],
-                datatype=["bool", "str", "str", "str", "str"],
-                interactive=True,
-                type="array",
-                value=initial_output  # 设置初始值
-            )
 
-            with gr.Row():
-                # 移除全选复选框，改为全选按钮
-                select_all_output_btn = gr.Button("✅ 全选", size="sm")
-                clear_selection_output_btn = gr.Button("⭕ 清空选择", size="sm")
-                refresh_output_btn = gr.Button("🔄 刷新", size="sm")
-
-            with gr.Row():
-                with gr.Column(scale=1):
-                    gr.Markdown("**已选中文件:**")
-                    output_selected_count = gr.Textbox("0", label="数量")
-                    output_selected_display = gr.Textbox("暂无选中文件", label="文件列表", lines=4, interactive=False)
-
-            with gr.Row():
-                download_selected_output = gr.Button("📥 下载选中文件", size="sm")
-                delete_selected_output = gr.Button("🗑️ 删除选中文件", variant="stop", size="sm")
-                clear_output_btn = gr.Button("🧹 清空文件夹", variant="stop", size="sm")
-                download_all_output = gr.Button("📦 下载全部", size="sm")
-
-    with gr.Row():
-        with gr.Column(scale=1):
-            gr.Markdown("### 📺 视频预览")
-            # 添加下拉框用于选择预览视频
-            preview_selector = gr.Dropdown(choices=[], label="选择预览视频", interactive=True)
-            video_preview = gr.Video(height=300, interactive=False)
-
-            with gr.Row():
-                preview_btn = gr.Button("👁️ 预览选中视频")
-                clear_preview_btn = gr.Button("🧹 清除预览", size="sm")
-            
-            # 添加预览下拉框到状态管理
-            selected_preview_file = gr.State(None)
-            # 下载组件
-            download_comp = gr.File(label="下载文件", value=list_downloads())  # 初始化时列出已有下载
-            
-            # 添加清除下载按钮
-            with gr.Row():
-                clear_downloads_btn = gr.Button("🗑️ 清除所有下载文件", size="sm", variant="stop")
-
-    # 状态区域
-    status = gr.Textbox(label="操作状态", interactive=False)
-
-    # 删除之前的初始化调用（已移到组件创建时）
-    # initial_input, initial_output, _, _ = full_refresh()
-
-
-    # 绑定事件 - 只选择状态更新
-    input_files.change(
-        fn=safe_update_selections,
-        inputs=[input_files, output_files, selected_input_files, selected_output_files],
-        outputs=[
-            selected_input_files,
-            selected_output_files,
-            input_selected_count,
-            input_selected_display,
-            output_selected_count,
-            output_selected_display
-        ]
-    )
-
-    output_files.change(
-        fn=safe_update_selections,
-        inputs=[input_files, output_files, selected_input_files, selected_output_files],
-        outputs=[
-            selected_input_files,
-            selected_output_files,
-            input_selected_count,
-            input_selected_display,
-            output_selected_count,
-            output_selected_display
-        ]
-    )
-    
-    # 更新预览选择器选项当选择状态变化时
-    selected_input_files.change(
-        fn=update_preview_selector,
-        inputs=[selected_input_files, selected_output_files],
-        outputs=preview_selector
-    )
-    
-    selected_output_files.change(
-        fn=update_preview_selector,
-        inputs=[selected_input_files, selected_output_files],
-        outputs=preview_selector
-    )
-    
-    # 当预览选择器变更时自动预览选中的视频
-    preview_selector.change(
-        fn=preview_file,
-        inputs=preview_selector,
-        outputs=video_preview
-    )
-    
-    # 刷新功能 - 仅刷新文件列表
-    refresh_input_btn.click(
-        fn=lambda: [log_info("点击刷新Input文件夹"), refresh_files_only()][1],
-        outputs=[input_files, output_files]
-    )
-
-    refresh_output_btn.click(
-        fn=lambda: [log_info("点击刷新Output文件夹"), refresh_files_only()][1],
-        outputs=[input_files, output_files]
-    )
-
-    # 上传功能 - 完全刷新
-    upload_btn.upload(
-        fn=upload_file,
-        inputs=upload_btn,
-        outputs=[input_files, output_files, selected_input_files, selected_output_files]
-    )
-
-    # 预览功能 - 支持从下拉框选择或默认选择第一个
-    preview_btn.click(
-        fn=lambda input_selected, output_selected, selected_preview: preview_file(
-            selected_preview if selected_preview else (
-                input_selected[0] if input_selected else (
-                    output_selected[0] if output_selected else None
-                )
-            )
-        ),
-        inputs=[selected_input_files, selected_output_files, preview_selector],
-        outputs=video_preview
-    )
-
-    clear_preview_btn.click(
-        fn=lambda: [log_info("清除视频预览"), None], 
-        outputs=video_preview
-    )
-
-    # 删除功能 - 选中文件
-    delete_selected_input.click(
-        fn=delete_files,
-        inputs=selected_input_files,
-        outputs=[input_files, output_files, selected_input_files, selected_output_files]
-    )
-
-    delete_selected_output.click(
-        fn=delete_files,
-        inputs=selected_output_files,
-        outputs=[input_files, output_files, selected_input_files, selected_output_files]
-    )
-
-    # 下载功能 - 选中文件
-    def download_and_refresh(file_paths):
-        zip_path, msg = download_files(file_paths)
-        return zip_path, msg, list_downloads()
-    
-    download_selected_input.click(
-        fn=download_and_refresh,
-        inputs=selected_input_files,
-        outputs=[download_comp, status, download_comp]  # 更新两次以刷新列表
-    )
-
-    download_selected_output.click(
-        fn=download_and_refresh,
-        inputs=selected_output_files,
-        outputs=[download_comp, status, download_comp]  # 更新两次以刷新列表
-    )
-
-    # 下载全部文件
-    download_all_input.click(
-        fn=lambda: download_and_refresh([os.path.join(INPUT_DIR, f) for f in os.listdir(INPUT_DIR) if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm'))]),
-        outputs=[download_comp, status, download_comp]
-    )
-
-    download_all_output.click(
-        fn=lambda: download_and_refresh([os.path.join(OUTPUT_DIR, f) for f in os.listdir(OUTPUT_DIR) if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm'))]),
-        outputs=[download_comp, status, download_comp]
-    )
-
-    # 清空文件夹
-    clear_input_btn.click(
-        fn=lambda: [log_info("清空Input文件夹"), delete_files([os.path.join(INPUT_DIR, f) for f in os.listdir(INPUT_DIR)])][1:],
-        outputs=[input_files, output_files, selected_input_files, selected_output_files]
-    )
-
-    clear_output_btn.click(
-        fn=lambda: [log_info("清空Output文件夹"), delete_files([os.path.join(OUTPUT_DIR, f) for f in os.listdir(OUTPUT_DIR)])][1:],
-        outputs=[input_files, output_files, selected_input_files, selected_output_files]
-    )
-    
-    # 绑定清除下载事件
-    clear_downloads_btn.click(
-        fn=clear_downloads,
-        outputs=[status, download_comp]  # 更新状态和下载组件
-    )
-    
-    # 全选按钮功能 - Input文件夹
-    select_all_input_btn.click(
-        fn=lambda df: select_all_files(df, True),
-        inputs=input_files,
-        outputs=[
-            selected_input_files,
-            input_selected_count,
-            input_selected_display,
-            input_files
-        ]
-    )
-
-    # 全选按钮功能 - Output文件夹
-    select_all_output_btn.click(
-        fn=lambda df: select_all_files(df, False),
-        inputs=output_files,
-        outputs=[
-            selected_output_files,
-            output_selected_count,
-            output_selected_display,
-            output_files
-        ]
-    )
-    
-    # 清空选择按钮功能 - Input文件夹
-    clear_selection_input_btn.click(
-        fn=lambda df: clear_selection_files(df, True),
-        inputs=input_files,
-        outputs=[
-            selected_input_files,
-            input_selected_count,
-            input_selected_display,
-            input_files
-        ]
-    )
-
-    # 清空选择按钮功能 - Output文件夹
-    clear_selection_output_btn.click(
-        fn=lambda df: clear_selection_files(df, False),
-        inputs=output_files,
-        outputs=[
-            selected_output_files,
-            output_selected_count,
-            output_selected_display,
-            output_files
-        ]
-    )
+# 全局文件索引（启动时载入快照，退出时保存）
+FILE_INDEX = FileIndex(INDEX_FILE)
+FILE_INDEX.load()
+FILE_INDEX.change_log = ChangeJournal(CHANGES_DB, CHANGES_KEEP)
+FILE_INDEX.seq = FILE_INDEX.change_log.last_seq  # 变更序号跨重启单调递增
+atexit.register(FILE_INDEX.save)
 
-# 启动应用
-if __name__ == "__main__":
-    log_info("启动视频文件管理预览系统")
-    demo.launch(
-        server_port=7860,
-        share=False,
-        inbrowser=True
-    )
+
+def scan_roots(directories, scan=None):
+    """在各目录所在磁盘的线程池中并行扫描，等待全部完成；单个目录失败只记录日志
+    代理节点上的目录不扫描，改为（在本机目录扫描的同时）拉取缓存已过期的节点文件列表"""
+    scan = scan or FILE_INDEX.scan
+    futures = {SCAN_POOLS.submit(directory, scan, directory): directory
+               for directory in directories if not is_remote(directory)}
+    if any(map(is_remote, directories)):
+        REMOTE.refresh()
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            log_error(f"扫描目录失败: {futures[future]}, 错误: {e}")
+
+
+def is_remote(path):
+    """路径（或目录）是否位于代理节点上"""
+    return path.startswith(REMOTE_PREFIX)
+
+
+def local_roots():
+    """本机的全部input/output存储位置（不含代理节点）"""
+    return [d for d in INPUT_ROOTS + OUTPUT_ROOTS if not is_remote(d)]
+
+
+class RemoteFile:
+    """把流式HTTP响应包装成只读文件对象，供打包和流式下载按块读取"""
+
+    def __init__(self, response):
+        self.response = response
+        self.chunks = response.iter_bytes()
+        self.pending = b""
+
+    def read(self, size=-1):
+        """返回不超过size字节的数据，读完时返回空字节串"""
+        try:
+            while not self.pending:
+                self.pending = next(self.chunks, None)
+                if self.pending is None:
+                    self.pending = b""
+                    return b""
+        except httpx.HTTPError as e:
+            raise OSError(f"读取远程文件失败: {e}") from e
+        if size < 0 or size >= len(self.pending):
+            chunk, self.pending = self.pending, b""
+        else:
+            chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+    def close(self):
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RemoteAgents:
+    """代理节点客户端 - 通过keep-alive连接池并发请求各节点，文件列表短期缓存（过期后带ETag重新验证），
+    每个节点的每个存储位置作为一个remote://目录并入文件索引和input/output表格"""
+
+    def __init__(self, agents, ttl, timeout, token, connections):
+        self.agents = agents
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # 节点名 -> {"lock": 拉取锁, "etag": 上次列表的ETag, "fetched": 上次拉取时间, "up": 是否可用}
+        self.state = {name: {"lock": threading.Lock(), "etag": None, "fetched": 0, "up": None} for name in agents}
+        self.roots = {}  # 远程目录 -> (节点名, 节点上的存储位置标识)
+        self.media = {}  # 远程目录 -> (FileTable, 与其行号对应的元数据列表)
+        self.client = self.pool = None
+        if agents:
+            limits = httpx.Limits(max_connections=connections * len(agents),
+                                  max_keepalive_connections=connections * len(agents))
+            self.client = httpx.Client(timeout=timeout, limits=limits,
+                                       headers={"Authorization": f"Bearer {token}"} if token else {})
+            self.pool = ThreadPoolExecutor(max_workers=len(agents), thread_name_prefix="agent")
+        self.stop_event = threading.Event()
+
+    def start(self):
+        """后台按缓存有效期定时拉取，发现节点上的存储位置并保持列表更新"""
+        if self.agents:
+            threading.Thread(target=self._refresh_loop, name="agent-refresh", daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh()
+            if self.stop_event.wait(self.ttl):
+                return
+
+    def refresh(self):
+        """并发拉取缓存已过期的节点，等待全部完成（节点不可用时继续使用上次的列表）"""
+        now = time.time()
+        stale = [name for name, state in self.state.items() if now - state["fetched"] >= self.ttl]
+        for future in [self.pool.submit(self._fetch, name) for name in stale]:
+            future.result()
+
+    def invalidate(self, name):
+        """节点上的文件有变动（例如刚删除），下次访问时重新拉取"""
+        self.state[name]["fetched"] = 0
+
+    def _fetch(self, name):
+        state = self.state[name]
+        with state["lock"]:
+            if time.time() - state["fetched"] < self.ttl:
+                return  # 等锁期间已由其它线程拉取
+            headers = {"If-None-Match": state["etag"]} if state["etag"] else {}
+            try:
+                resp = self.client.get(f"{self.agents[name]}/agent/files", headers=headers)
+                if resp.status_code != 304:
+                    resp.raise_for_status()
+                    self._apply(name, resp.json())
+                    state["etag"] = resp.headers.get("etag")
+                if state["up"] is False:
+                    log_info(f"代理节点 {name} 已恢复")
+                state["up"] = True
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                if state["up"] is not False:
+                    log_error(f"代理节点 {name} 不可用，继续显示上次的文件列表: {e}")
+                state["up"] = False
+            # 失败后同样等一个缓存周期再重试，避免每次刷新都卡在超时上
+            state["fetched"] = time.time()
+
+    def _apply(self, name, data):
+        """把节点返回的文件列表写入文件索引，首次出现的存储位置登记到input/output面板"""
+        seen = set()
+        media_changed = set()
+        for root in data["roots"]:
+            directory = f"{REMOTE_PREFIX}{name}/{root['key']}"
+            seen.add(directory)
+            table = FileTable.from_columns(root["files"])
+            media = root.get("media") or [None] * len(table)
+            old = self.media.get(directory)
+            if old is None or old[1] != media or old[0].names != table.names:
+                media_changed.add(directory)
+            with self.lock:
+                FILE_INDEX.external.add(directory)
+                self.media[directory] = (table, media)
+                FILE_INDEX.replace(directory, table)
+                if directory not in self.roots:
+                    self._register(name, directory, root)
+        for directory in [d for d, (agent, _) in self.roots.items() if agent == name and d not in seen]:
+            FILE_INDEX.replace(directory, FileTable())  # 节点上已不再配置该存储位置
+        if media_changed:
+            # 元数据排序和表格版本都以METADATA的目录版本为准
+            with METADATA.lock:
+                METADATA.touch(media_changed)
+
+    def _register(self, name, directory, root):
+        """登记节点上的一个存储位置（调用方需持有锁）"""
+        self.roots[directory] = (name, root["key"])
+        label = f"{name}:{root['label']}"
+        ROOT_LABELS[directory] = label
+        ROOTS_BY_LABEL[label] = directory
+        ROOT_KEYS[directory] = f"{name}-{root['key']}"
+        # 面板的事件处理函数直接引用这两个列表，原地追加即可生效
+        (INPUT_ROOTS if root["side"] == "input" else OUTPUT_ROOTS).append(directory)
+        log_info(f"发现代理节点 {name} 上的存储位置: {label}（{root['side']}）")
+
+    def locate(self, path):
+        """远程路径 -> (节点名, 存储位置标识, 文件名)"""
+        directory, name = os.path.split(path)
+        if directory not in self.roots:
+            raise FileNotFoundError(path)
+        return (*self.roots[directory], name)
+
+    def url(self, path):
+        """文件在节点上的预览地址（支持Range）"""
+        agent, key, name = self.locate(path)
+        return f"{self.agents[agent]}/preview/{key}/{quote(name)}"
+
+    def stat(self, path):
+        """根据缓存的文件列表构造stat结果，文件不在列表中时抛出FileNotFoundError"""
+        directory, name = os.path.split(path)
+        entry = FILE_INDEX.entries(directory).get(name) if directory in self.roots else None
+        if entry is None:
+            raise FileNotFoundError(path)
+        size, mtime, ino = entry
+        return os.stat_result((0o100644, ino, 0, 1, 0, 0, size, int(mtime), int(mtime), int(mtime)),
+                              {"st_atime": mtime, "st_mtime": mtime, "st_ctime": mtime,
+                               "st_mtime_ns": int(mtime * 1e9)})
+
+    def info(self, path):
+        """节点列表中附带的元数据，没有时返回None"""
+        directory, name = os.path.split(path)
+        table, media = self.media.get(directory, (None, None))
+        i = table.rows.get(name) if table else None
+        row = media[i] if i is not None else None
+        return dict(zip(MEDIA_FIELDS, row)) if row else None
+
+    def open(self, path):
+        """流式读取节点上的文件，返回(文件对象, stat结果)"""
+        st = self.stat(path)
+        try:
+            resp = self.client.send(self.client.build_request("GET", self.url(path)), stream=True)
+        except httpx.HTTPError as e:
+            raise OSError(f"无法连接代理节点: {e}") from e
+        if resp.status_code != 200:
+            resp.close()
+            if resp.status_code == 404:
+                raise FileNotFoundError(path)
+            raise OSError(f"代理节点返回 HTTP {resp.status_code}: {path}")
+        # 以实际返回的长度为准（文件在列表缓存期间可能已变化）
+        size = int(resp.headers.get("content-length", st.st_size))
+        st = os.stat_result((st.st_mode, st.st_ino, 0, 1, 0, 0, size, *st[7:10]),
+                            {"st_atime": st.st_atime, "st_mtime": st.st_mtime, "st_ctime": st.st_ctime,
+                             "st_mtime_ns": st.st_mtime_ns})
+        return RemoteFile(resp), st
+
+    def delete(self, path):
+        """在节点上删除文件，返回None表示成功，否则返回失败原因"""
+        try:
+            agent, key, name = self.locate(path)
+        except FileNotFoundError:
+            return "文件不存在"
+        try:
+            resp = self.client.delete(f"{self.agents[agent]}/agent/files/{key}/{quote(name)}")
+        except httpx.HTTPError as e:
+            return str(e)
+        self.invalidate(agent)
+        if resp.status_code == 404:
+            return "文件不存在"
+        if resp.status_code >= 400:
+            return resp.text or f"HTTP {resp.status_code}"
+        return None
+
+    def status(self):
+        """节点名 -> 是否可用（尚未拉取过时为None）"""
+        return {name: state["up"] for name, state in self.state.items()}
+
+
+# 全局代理节点客户端（未配置节点时不发出任何请求）；httpx默认为每个请求记一条INFO日志，只保留警告
+logging.getLogger("httpx").setLevel(logging.WARNING)
+REMOTE = RemoteAgents(AGENTS, AGENT_TTL, AGENT_TIMEOUT, AGENT_TOKEN, AGENT_CONNECTIONS)
+atexit.register(REMOTE.stop)
+
+
+def source_stat(path):
+    """源文件的stat结果（代理节点上的文件取自缓存的文件列表）"""
+    return REMOTE.stat(path) if is_remote(path) else os.stat(path)
+
+
+def open_source(path):
+    """打开要打包或下载的源文件，返回(文件对象, stat结果)；代理节点上的文件通过HTTP流式读取"""
+    if is_remote(path):
+        return REMOTE.open(path)
+    f = open(path, "rb")
+    return f, os.fstat(f.fileno())
+
+
+class DirectoryWatcher:
+    """目录监听器 - 优先使用inotify，不可用时退回轮询，把变更实时写入文件索引"""
+
+    # inotify事件掩码
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+                  | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, directories, mode="auto"):
+        self.directories = list(directories)
+        self.mode = mode
+        self.fd = None
+        self.wd_to_dir = {}
+        self.libc = None
+        self.rewatch_needed = set()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """启动后台监听线程"""
+        if self.mode == "off":
+            log_info("目录监听已关闭")
+            return
+        if self.mode in ("auto", "inotify") and self._init_inotify():
+            target = self._inotify_loop
+            self.mode = "inotify"
+        else:
+            target = self._poll_loop
+            self.mode = "poll"
+        self.thread = threading.Thread(target=target, name="directory-watcher", daemon=True)
+        self.thread.start()
+        log_info(f"目录监听已启动，模式: {self.mode}，目录: {', '.join(self.directories)}")
+
+    def stop(self):
+        """停止监听线程"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def rewatch(self, directory):
+        """目录被替换（如重命名后重建）时重新挂载监听"""
+        self.rewatch_needed.add(directory)
+
+    def _init_inotify(self):
+        """通过ctypes初始化inotify，失败返回False"""
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+            self.fd = fd
+            for directory in self.directories:
+                self._add_watch(directory)
+            return True
+        except (OSError, AttributeError) as e:
+            log_info(f"inotify不可用，改用轮询模式: {e}")
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            return False
+
+    def _add_watch(self, directory):
+        """为目录添加inotify监听"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监听目录 {directory}")
+        self.wd_to_dir = {k: v for k, v in self.wd_to_dir.items() if v != directory}
+        self.wd_to_dir[wd] = directory
+
+    def _inotify_loop(self):
+        """inotify事件循环：收集事件并按短窗口批量写入索引"""
+        pending = {}  # directory -> set(name)
+        last_save = time.time()
+        while not self.stop_event.is_set():
+            for directory in list(self.rewatch_needed):
+                self.rewatch_needed.discard(directory)
+                try:
+                    self._add_watch(directory)
+                    FILE_INDEX.invalidate(directory)
+                    FILE_INDEX.scan(directory)
+                except OSError as e:
+                    log_error(f"重新监听目录失败: {directory}, 错误: {e}")
+            readable, _, _ = select.select([self.fd], [], [], 0.2)
+            if readable:
+                try:
+                    data = os.read(self.fd, 65536)
+                except BlockingIOError:
+                    data = b""
+                self._parse_events(data, pending)
+                # 留出短暂窗口合并同一文件的连续写入事件
+                continue_until = time.time() + 0.2
+                while time.time() < continue_until:
+                    if not select.select([self.fd], [], [], 0.05)[0]:
+                        continue
+                    try:
+                        self._parse_events(os.read(self.fd, 65536), pending)
+                    except BlockingIOError:
+                        pass
+            for directory, names in pending.items():
+                for name in names:
+                    try:
+                        FILE_INDEX.apply_event(directory, name)
+                    except Exception as e:
+                        log_error(f"处理文件事件失败: {directory}/{name}, 错误: {e}")
+            pending.clear()
+            if time.time() - last_save > 5:
+                FILE_INDEX.save()
+                last_save = time.time()
+
+    def _parse_events(self, data, pending):
+        """解析inotify事件缓冲区"""
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            if mask & self.IN_Q_OVERFLOW:
+                # 事件队列溢出，无法得知丢失了哪些事件，只能重扫全部目录
+                log_error("inotify事件队列溢出，重新扫描所有目录")
+                for directory in self.directories:
+                    FILE_INDEX.invalidate(directory)
+                    FILE_INDEX.scan(directory)
+                continue
+            directory = self.wd_to_dir.get(wd)
+            if directory is None:
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                self.rewatch(directory)
+                continue
+            if name and name.lower().endswith(VIDEO_EXTENSIONS):
+                pending.setdefault(directory, set()).add(name)
+
+    def _poll_directory(self, directory):
+        """增量扫描一个目录并复查最近写入的文件"""
+        FILE_INDEX.scan(directory)
+        FILE_INDEX.refresh_hot(directory)
+
+    def _poll_loop(self):
+        """轮询模式：目录签名变化时增量扫描，并复查最近写入的文件"""
+        last_save = time.time()
+        while not self.stop_event.wait(WATCH_POLL_INTERVAL):
+            scan_roots(self.directories, self._poll_directory)
+            if time.time() - last_save > 5:
+                FILE_INDEX.save()
+                last_save = time.time()
+
+
+# 全局目录监听器
+WATCHER = DirectoryWatcher(INPUT_ROOTS + OUTPUT_ROOTS, WATCH_MODE)
+WATCHER.start()
+atexit.register(WATCHER.stop)
+
+
+def generate_thumbnail(ffmpeg, src_path, dest_path, width):
+    """在子进程中用ffmpeg截取一帧作为缩略图（进程池中执行）"""
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp.jpg"
+    # 先尝试第1秒的画面，过短的视频退回第一帧
+    for seek in ("1", "0"):
+        cmd = [ffmpeg, "-nostdin", "-loglevel", "error", "-ss", seek, "-i", src_path,
+               "-frames:v", "1", "-vf", f"scale={width}:-2", "-y", tmp_path]
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        except subprocess.TimeoutExpired:
+            continue
+        if result.returncode == 0 and os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+            os.replace(tmp_path, dest_path)
+            return True
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+    return False
+
+
+class ThumbnailService:
+    """后台缩略图生成 - 进程池执行ffmpeg，按(路径, 大小, 修改时间)缓存，优先处理页面上可见的文件"""
+
+    PRIORITY_VISIBLE = 0
+    PRIORITY_BACKGROUND = 1
+
+    def __init__(self, thumb_dir, ffmpeg, workers):
+        self.thumb_dir = thumb_dir
+        self.ffmpeg = ffmpeg
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.queue = []  # 优先队列：(priority, seq, key, path)
+        self.queued = {}  # key -> 已排队的最高优先级
+        self.ready = {os.path.splitext(f)[0] for f in os.listdir(thumb_dir) if f.endswith(".jpg")}
+        self.failed = set()
+        self.in_flight = 0
+        self.seq = 0
+        self.version = 0  # 每生成一张缩略图加一
+        self.versions = {}  # directory -> 该目录生成的缩略图数，页面只在自己的目录有新缩略图时刷新当前页
+        self.pool = None
+        self.thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.ffmpeg)
+
+    def start(self):
+        """创建进程池并启动调度线程"""
+        if not self.enabled:
+            log_info("未找到ffmpeg，缩略图生成已关闭")
+            return
+        # 在主线程中使用fork预先创建全部子进程：既避免子进程重新执行本脚本的界面构建代码，
+        # 也避免在其它线程中fork时子进程继承到被占用的导入锁
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self.pool.submit(os.getpid).result()
+        self.thread = threading.Thread(target=self._dispatch_loop, name="thumbnail-dispatcher", daemon=True)
+        self.thread.start()
+        log_info(f"缩略图服务已启动，进程数: {self.workers}")
+
+    def stop(self):
+        """关闭进程池"""
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def dir_version(self, directory):
+        return self.versions.get(directory, 0)
+
+    @staticmethod
+    def key_for(path, size, mtime):
+        """缩略图缓存键"""
+        return hashlib.sha1(f"{os.path.abspath(path)}|{size}|{mtime}".encode("utf-8")).hexdigest()
+
+    def cell(self, path, size, mtime, enqueue=True, priority=PRIORITY_VISIBLE):
+        """返回表格中缩略图单元格的内容；未生成时按需排队，不会阻塞"""
+        if not self.enabled:
+            return ""
+        key = self.key_for(path, size, mtime)
+        if key in self.ready:
+            return f"![](/thumbnails/{key}.jpg)"
+        if key in self.failed:
+            return "—"
+        if enqueue:
+            self.request(key, path, priority)
+            return "⏳"
+        return ""
+
+    def request(self, key, path, priority=PRIORITY_VISIBLE):
+        """把缩略图加入队列；已排队时只在优先级更高时重新排队"""
+        with self.lock:
+            if key in self.ready or self.queued.get(key, priority + 1) <= priority:
+                return
+            self.queued[key] = priority
+            self.seq += 1
+            heapq.heappush(self.queue, (priority, self.seq, key, path))
+            self.wakeup.notify()
+
+    def _dispatch_loop(self):
+        """调度线程：同时最多提交workers个任务，实现节流"""
+        while True:
+            with self.lock:
+                while not self.queue or self.in_flight >= self.workers:
+                    self.wakeup.wait()
+                priority, _, key, path = heapq.heappop(self.queue)
+                if self.queued.get(key) != priority or key in self.ready:
+                    continue  # 已被更高优先级的条目取代或已生成
+                del self.queued[key]
+                self.in_flight += 1
+            dest = os.path.join(self.thumb_dir, f"{key}.jpg")
+            try:
+                future = self.pool.submit(generate_thumbnail, self.ffmpeg, path, dest, THUMB_WIDTH)
+            except RuntimeError:
+                return  # 进程池已关闭（程序正在退出）
+            future.add_done_callback(lambda f, key=key, path=path: self._on_done(f, key, path))
+
+    def _on_done(self, future, key, path):
+        """缩略图任务完成回调"""
+        try:
+            ok = future.result()
+        except Exception as e:
+            log_summary("thumbnail-error", f"生成缩略图失败: {path}, 错误: {e}", error=True)
+            ok = False
+        with self.lock:
+            self.in_flight -= 1
+            if ok:
+                self.ready.add(key)
+            else:
+                self.failed.add(key)
+            self.version += 1
+            directory = os.path.dirname(path)
+            self.versions[directory] = self.versions.get(directory, 0) + 1
+            self.wakeup.notify()
+
+
+# 全局缩略图服务
+THUMBNAILS = ThumbnailService(THUMB_DIR, FFMPEG_PATH if SERVER_MODE != "agent" else None, THUMB_WORKERS)
+if SERVER_MODE != "agent":  # 代理节点不显示缩略图，不创建进程池
+    THUMBNAILS.start()
+atexit.register(THUMBNAILS.stop)
+
+
+def iter_mp4_boxes(f, start, end):
+    """遍历[start, end)范围内的MP4 box，返回(类型, 数据起始位置, 数据结束位置)"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                return  # 64位长度字段被截断
+            size = struct.unpack(">Q", large)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            return
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def probe_mp4(f, file_size):
+    """解析MP4/MOV的moov box（只读取头部数据，mdat通过seek跳过）"""
+    moov = None
+    for box_type, start, end in iter_mp4_boxes(f, 0, file_size):
+        if box_type == b"moov":
+            if end - start > METADATA_MAX_MOOV:
+                return {}
+            f.seek(start)
+            moov = f.read(end - start)
+            break
+    if moov is None:
+        return {}
+
+    def children(data, start, end):
+        pos = start
+        while pos + 8 <= end:
+            size, box_type = struct.unpack_from(">I4s", data, pos)
+            header_size = 8
+            if size == 1:
+                if pos + 16 > end:
+                    return
+                size = struct.unpack_from(">Q", data, pos + 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = end - pos
+            if size < header_size:
+                return
+            yield box_type, pos + header_size, min(pos + size, end)
+            pos += size
+
+    # 截断的文件或长度不对的box中，字段超出box范围时忽略该字段
+    info = {}
+    for box_type, start, end in children(moov, 0, len(moov)):
+        if box_type == b"mvhd" and end - start >= 20:
+            if moov[start] == 1:
+                timescale, duration = struct.unpack_from(">IQ", moov, start + 20) if end - start >= 32 else (0, 0)
+            else:
+                timescale, duration = struct.unpack_from(">II", moov, start + 12)
+            if timescale:
+                info["duration"] = duration / timescale
+        elif box_type == b"trak":
+            track = {}
+            stack = [(start, end)]
+            while stack:
+                s_start, s_end = stack.pop()
+                for child, c_start, c_end in children(moov, s_start, s_end):
+                    if child in (b"mdia", b"minf", b"stbl"):
+                        stack.append((c_start, c_end))
+                    elif child == b"tkhd" and c_end - c_start >= 8:
+                        # 宽高为tkhd末尾的两个16.16定点数
+                        width, height = struct.unpack_from(">II", moov, c_end - 8)
+                        track["width"], track["height"] = width >> 16, height >> 16
+                    elif child == b"hdlr" and c_end - c_start >= 12:
+                        track["handler"] = moov[c_start + 8:c_start + 12]
+                    elif child == b"stsd" and c_end - c_start >= 16:
+                        track["codec"] = moov[c_start + 12:c_start + 16].decode("latin-1").strip()
+            if track.get("handler") == b"vide" and "codec" not in info:
+                info["width"], info["height"] = track.get("width", 0), track.get("height", 0)
+                info["codec"] = track.get("codec", "")
+    return info
+
+
+def read_ebml_vint(f, keep_marker=False):
+    """读取EBML变长整数，返回(值, 字节数)；值全为1表示未知长度，返回None"""
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    b = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not b & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("无效的EBML变长整数")
+    value = b if keep_marker else b & (mask - 1)
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        raise EOFError
+    for byte in rest:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def probe_mkv(f, file_size):
+    """解析MKV/WebM的EBML头部（Segment Info与Tracks），遇到Cluster即停止"""
+    SEGMENT, INFO, TRACKS, TRACK_ENTRY, VIDEO, CLUSTER = 0x18538067, 0x1549A966, 0x1654AE6B, 0xAE, 0xE0, 0x1F43B675
+    TIMECODE_SCALE, DURATION, TRACK_TYPE, CODEC_ID = 0x2AD7B1, 0x4489, 0x83, 0x86
+    PIXEL_WIDTH, PIXEL_HEIGHT = 0xB0, 0xBA
+    CONTAINERS = {SEGMENT, INFO, TRACKS, TRACK_ENTRY, VIDEO}
+
+    info = {}
+    timecode_scale = 1000000
+    raw_duration = None
+    track = {}
+    track_end = None
+
+    def finish_track():
+        if track.get("type") == 1 and "codec" not in info:
+            info["codec"] = track.get("codec", "")
+            info["width"], info["height"] = track.get("width", 0), track.get("height", 0)
+
+    pos = 0
+    f.seek(0)
+    while pos < file_size:
+        if track_end is not None and pos >= track_end:
+            finish_track()
+            track, track_end = {}, None
+        f.seek(pos)
+        try:
+            element_id, id_len = read_ebml_vint(f, keep_marker=True)
+            size, size_len = read_ebml_vint(f)
+        except (EOFError, ValueError):
+            break
+        data_start = pos + id_len + size_len
+        if element_id == CLUSTER:
+            break
+        if element_id in CONTAINERS:
+            if element_id == TRACK_ENTRY:
+                track, track_end = {}, data_start + (size or 0)
+            pos = data_start  # 进入容器元素内部
+            continue
+        if size is None:
+            break
+        if element_id in (TIMECODE_SCALE, DURATION, TRACK_TYPE, CODEC_ID, PIXEL_WIDTH, PIXEL_HEIGHT) and size <= 64:
+            data = f.read(size)
+            if len(data) < size:
+                break  # 文件被截断
+            if element_id == DURATION:
+                if size in (4, 8):
+                    raw_duration = struct.unpack(">f" if size == 4 else ">d", data)[0]
+            elif element_id == CODEC_ID:
+                track["codec"] = data.rstrip(b"\0").decode("ascii", "replace")
+            else:
+                value = int.from_bytes(data, "big")
+                if element_id == TIMECODE_SCALE:
+                    timecode_scale = value
+                elif element_id == TRACK_TYPE:
+                    track["type"] = value
+                elif element_id == PIXEL_WIDTH:
+                    track["width"] = value
+                else:
+                    track["height"] = value
+        pos = data_start + size
+    finish_track()
+    if raw_duration is not None:
+        info["duration"] = raw_duration * timecode_scale / 1e9
+    return info
+
+
+def probe_media(path):
+    """读取视频容器头部，返回时长、分辨率、编码和码率（不支持的格式返回空字典，文件不存在返回None）"""
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            magic = f.read(12)
+            if magic[:4] == b"\x1a\x45\xdf\xa3":
+                info = probe_mkv(f, file_size)
+            elif magic[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+                info = probe_mp4(f, file_size)
+            else:
+                info = {}
+    except FileNotFoundError:
+        return None  # 排队期间文件已被删除
+    except Exception as e:
+        log_summary("metadata-error", f"读取视频元数据失败: {path}, 错误: {e}", error=True)
+        return {}
+    if info.get("duration"):
+        info["bitrate"] = int(file_size * 8 / info["duration"])
+    return info
+
+
+class MetadataIndex:
+    """媒体元数据索引 - 线程池读取文件头，结果按(路径, 大小, 修改时间)持久化到SQLite"""
+
+    def __init__(self, db_path, workers):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS media (
+            path TEXT PRIMARY KEY, size INTEGER, mtime REAL,
+            duration REAL, width INTEGER, height INTEGER, codec TEXT, bitrate INTEGER)""")
+        self.db.commit()
+        self.lock = threading.Lock()
+        # 内存缓存：path -> (size, mtime, info)，界面只读内存，不访问数据库；启动后由load()在后台填充
+        self.cache = {}
+        self.pending = set()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metadata")
+        self.version = 0  # 每写入一条元数据加一
+        self.versions = {}  # directory -> 该目录的元数据版本，按元数据排序时只看所在目录
+        self.tasks = 0  # 已排队、尚未完成的读取和删除
+        self.uncommitted = 0  # 已写入、尚未提交的数据库行数
+        self.committed = time.monotonic()
+
+    def dir_version(self, directory):
+        return self.versions.get(directory, 0)
+
+    def touch(self, directories):
+        """登记这些目录中的元数据有变化（调用方需持有锁）"""
+        self.version += 1
+        for directory in directories:
+            self.versions[directory] = self.versions.get(directory, 0) + 1
+
+    def _written(self):
+        """登记一次数据库写入，攒够一批、队列已空或距上次提交超过2秒时才提交（调用方需持有锁）"""
+        self.tasks -= 1
+        self.uncommitted += 1
+        if self.uncommitted >= METADATA_COMMIT_ROWS or not self.tasks or time.monotonic() - self.committed >= 2:
+            self._commit()
+
+    def _commit(self):
+        if self.uncommitted:
+            self.db.commit()
+            self.uncommitted = 0
+        self.committed = time.monotonic()
+
+    def flush(self):
+        """提交尚未提交的写入（退出时调用）"""
+        with self.lock:
+            self._commit()
+
+    def load(self):
+        """把数据库中的元数据读入内存缓存（不覆盖启动后新读取的结果）"""
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM media").fetchall()
+            for path, size, mtime, duration, width, height, codec, bitrate in rows:
+                self.cache.setdefault(path, (size, mtime, {"duration": duration, "width": width, "height": height,
+                                                           "codec": codec, "bitrate": bitrate}))
+            self.touch({os.path.dirname(row[0]) for row in rows})
+        log_info(f"载入视频元数据: {len(rows)} 条")
+
+    def get(self, path, size, mtime):
+        """返回已缓存的元数据，文件已变化或尚未读取时返回None（代理节点上的文件使用节点列表中附带的元数据）"""
+        if path.startswith(REMOTE_PREFIX):
+            return REMOTE.info(path)
+        cached = self.cache.get(path)
+        if cached and cached[0] == size and cached[1] == mtime:
+            return cached[2]
+        return None
+
+    def on_file_change(self, directory, kind, name, entry):
+        """文件索引变更监听：新增/修改时排队读取，删除时移除记录"""
+        path = os.path.join(directory, name)
+        if kind == "removed":
+            with self.lock:
+                self.tasks += 1
+            self.pool.submit(self._forget, path)
+        else:
+            self.request(path, entry[0], entry[1])
+
+    def on_dir_cleared(self, directory, removed):
+        """文件索引清空目录的监听：一个任务删除全部记录"""
+        with self.lock:
+            self.tasks += 1
+        self.pool.submit(self._forget_many, [os.path.join(directory, name) for name in removed.names])
+
+    def request(self, path, size, mtime):
+        """排队读取一个文件的元数据"""
+        with self.lock:
+            if path in self.pending or self.get(path, size, mtime) is not None:
+                return
+            self.pending.add(path)
+            self.tasks += 1
+        self.pool.submit(self._probe, path, size, mtime)
+
+    def sync(self, directory):
+        """为目录中还没有元数据的文件排队（启动时在后台调用）"""
+        with FILE_INDEX.lock:
+            items = list(FILE_INDEX.entries(directory).items())
+        for name, entry in items:
+            self.request(os.path.join(directory, name), entry[0], entry[1])
+
+    def _probe(self, path, size, mtime):
+        info = probe_media(path)
+        if info is None:
+            with self.lock:
+                self.pending.discard(path)
+                self.tasks -= 1
+                if not self.tasks:
+                    self._commit()
+            return
+        row = {"duration": info.get("duration"), "width": info.get("width"), "height": info.get("height"),
+               "codec": info.get("codec"), "bitrate": info.get("bitrate")}
+        with self.lock:
+            self.pending.discard(path)
+            self.cache[path] = (size, mtime, row)
+            self.db.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (path, size, mtime, row["duration"], row["width"], row["height"],
+                             row["codec"], row["bitrate"]))
+            self._written()
+            self.touch([os.path.dirname(path)])
+
+    def _forget(self, path):
+        self._forget_many([path])
+
+    def _forget_many(self, paths):
+        with self.lock:
+            for path in paths:
+                self.cache.pop(path, None)
+            self.db.executemany("DELETE FROM media WHERE path = ?", ((path,) for path in paths))
+            self._written()
+            self.touch({os.path.dirname(path) for path in paths})
+
+    def sort_key(self, field):
+        """生成FileIndex使用的排序键函数（没有元数据的文件排在最前）"""
+        def key(directory, name, entry):
+            info = self.get(os.path.join(directory, name), entry[0], entry[1]) or {}
+            if field == "resolution":
+                return (info.get("width") or 0) * (info.get("height") or 0)
+            return info.get(field) or 0
+        return key
+
+
+def format_duration(seconds):
+    """把秒数格式化为H:MM:SS"""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+# 全局元数据索引：注册为文件索引的监听函数和额外排序字段（缓存载入和补齐已有文件见reconcile_index）
+METADATA = MetadataIndex(METADATA_DB, METADATA_WORKERS)
+FILE_INDEX.listeners.append(METADATA.on_file_change)
+FILE_INDEX.clear_listeners.append(METADATA.on_dir_cleared)
+for _field in ("duration", "resolution", "bitrate"):
+    FILE_INDEX.sort_providers[_field] = (METADATA.dir_version, METADATA.sort_key(_field))
+atexit.register(METADATA.flush)
+
+
+def sample_hash(path, size):
+    """抽样哈希：文件大小加上头、尾各HASH_SAMPLE_BYTES字节，只用来筛选可能重复的文件"""
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(HASH_SAMPLE_BYTES))
+        if size > HASH_SAMPLE_BYTES:
+            f.seek(max(HASH_SAMPLE_BYTES, size - HASH_SAMPLE_BYTES))
+            h.update(f.read(HASH_SAMPLE_BYTES))
+    return h.hexdigest()
+
+
+def full_hash(path):
+    """完整内容的SHA-256（与分块上传接口使用的校验值相同）"""
+    started = time.perf_counter()
+    h = hashlib.sha256()
+    read = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+            read += len(chunk)
+    METRICS.add_io(read=read, name="hash")
+    METRICS.observe("hash", time.perf_counter() - started)  # 大文件本来就慢，不经过track以免写慢调用日志
+    return h.hexdigest()
+
+
+class DuplicateContent(Exception):
+    """上传的内容与已有文件相同（DEDUP_UPLOAD_MODE为reject时）"""
+
+    def __init__(self, path):
+        super().__init__(f"内容与已有文件相同: {path}")
+        self.path = path
+
+
+class HashIndex:
+    """内容哈希索引 - 先算抽样哈希，只有抽样哈希相同的文件才计算完整SHA-256；
+    结果按(设备号, inode, 大小, 修改时间)缓存到SQLite（不同磁盘上的inode号可能相同）"""
+
+    def __init__(self, db_path, workers):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(hashes)")]
+        if columns and "dev" not in columns:
+            self.db.execute("DROP TABLE hashes")  # 旧版缓存的键中没有设备号，丢弃后重新计算
+        self.db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+            dev INTEGER, ino INTEGER, size INTEGER, mtime REAL, sample TEXT, full TEXT,
+            PRIMARY KEY (dev, ino, size, mtime))""")
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.hashes = {}  # (dev, ino, size, mtime) -> (抽样哈希, 完整哈希或None)
+        self.paths = {}  # 正在跟踪的文件：path -> (dev, ino, size, mtime)
+        self.links = {}  # (dev, ino, size, mtime) -> {path}，同一inode的多个路径即硬链接
+        self.by_sample = {}  # 抽样哈希 -> {path}
+        self.by_full = {}  # 完整哈希 -> {path}
+        self.pending = set()  # 已排队计算的键
+        self.pool = DevicePools(workers, "hash")  # 每个磁盘各自的哈希线程
+        self.version = 0  # 重复标记可能变化时加一
+        self.versions = {}  # directory -> 该目录中文件的重复标记可能变化的次数
+        # 尚未写入数据库的变化：key -> (抽样哈希, 完整哈希)，None表示删除；由写入线程在锁外一次事务写入
+        self.unsaved = {}
+        self.db_lock = threading.Lock()  # 数据库连接在写入线程、启动载入和退出时共用
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hash-db")
+        self.write_queued = False
+
+    def load(self):
+        """把数据库中的哈希读入内存（启动后在后台调用）"""
+        with self.db_lock:
+            rows = self.db.execute("SELECT * FROM hashes").fetchall()
+        with self.lock:
+            for dev, ino, size, mtime, sample, full in rows:
+                key = (dev, ino, size, mtime)
+                if key not in self.unsaved:  # 启动后已有新结果或已删除
+                    self.hashes.setdefault(key, (sample, full))
+        log_info(f"载入内容哈希: {len(rows)} 条")
+
+    def _save_later(self, key, cached):
+        """登记一条待写入的变化，由写入线程批量提交（调用方需持有锁）；
+        写入线程提交期间到达的变化会并入下一次事务，逐个删除n个文件时不会有n次提交"""
+        self.unsaved[key] = cached
+        if not self.write_queued:
+            self.write_queued = True
+            self.writer.submit(self.flush)
+
+    def flush(self):
+        """把待写入的变化在一次事务中写入数据库（写入线程和退出时调用，只在取出变化时短暂持有self.lock）"""
+        with self.db_lock:  # 先取数据库锁，两次写入按取出变化的顺序进行
+            with self.lock:
+                rows, self.unsaved = self.unsaved, {}
+                self.write_queued = False
+            if not rows:
+                return
+            self.db.executemany("DELETE FROM hashes WHERE dev = ? AND ino = ? AND size = ? AND mtime = ?",
+                                [key for key, cached in rows.items() if cached is None])
+            self.db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                                [(*key, *cached) for key, cached in rows.items() if cached is not None])
+            self.db.commit()
+
+    @staticmethod
+    def stat_key(st):
+        """由stat结果得到缓存键"""
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime
+
+    def entry_key(self, directory, entry):
+        """由文件索引条目得到缓存键：条目中没有设备号，取所在目录的设备号（按目录缓存，无需逐个文件stat）"""
+        size, mtime, ino = entry
+        return self.pool.device(directory), ino, size, mtime
+
+    def on_file_change(self, directory, kind, name, entry):
+        """文件索引变更监听：新增/修改时开始跟踪，删除时移除"""
+        path = os.path.join(directory, name)
+        if kind == "removed":
+            self.untrack(path)
+        else:
+            self.track(path, self.entry_key(directory, entry))
+
+    def sync(self, directory):
+        """跟踪目录中的全部文件（启动时在后台调用）"""
+        with FILE_INDEX.lock:
+            items = list(FILE_INDEX.entries(directory).items())
+        for name, entry in items:
+            self.track(os.path.join(directory, name), self.entry_key(directory, entry))
+
+    def sync_paths(self, root, paths):
+        """让root下被跟踪的文件与paths一致（用于不在文件索引中的下载目录）"""
+        paths = set(paths)
+        with self.lock:
+            gone = [p for p in self.paths if p.startswith(root + os.sep) and p not in paths]
+        for path in gone:
+            self.untrack(path)
+        for path in paths - set(self.paths):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            self.track(path, self.stat_key(st))
+
+    def track(self, path, key):
+        """登记一个文件：已有缓存时直接建立索引，否则排队计算"""
+        with self.lock:
+            if self.paths.get(path) == key:
+                return
+            self._unindex(path)
+            self.paths[path] = key
+            self.links.setdefault(key, set()).add(path)
+            cached = self.hashes.get(key)
+            if cached:
+                self._index(path, cached)
+            else:
+                self._submit(path, key)
+
+    def digests(self, keys):
+        """批量查询已缓存的(抽样哈希, 完整SHA-256)，尚未计算的为(None, None)"""
+        with self.lock:
+            return [self.hashes.get(key) or (None, None) for key in keys]
+
+    def untrack(self, path):
+        """停止跟踪一个文件；没有其它路径（硬链接）引用同一内容时删除缓存的哈希
+        （作为文件索引监听函数在持有索引锁时调用，只改内存，数据库删除交给写入线程）"""
+        with self.lock:
+            self._untrack(path)
+
+    def on_dir_cleared(self, directory, removed):
+        """文件索引清空目录的监听：一次加锁移除全部文件"""
+        with self.lock:
+            for name in removed.names:
+                self._untrack(os.path.join(directory, name))
+
+    def _untrack(self, path):
+        """（调用方需持有锁）"""
+        key = self._unindex(path)
+        if key in self.hashes and key not in self.links:
+            del self.hashes[key]
+            self._save_later(key, None)
+
+    def _submit(self, path, key):
+        """排队计算（调用方需持有锁）"""
+        if key not in self.pending:
+            self.pending.add(key)
+            self.pool.submit(os.path.dirname(path), self._hash, path, key)
+
+    def dir_version(self, directory):
+        return self.versions.get(directory, 0)
+
+    def _touch(self, paths):
+        """这些文件的重复标记可能变化（调用方需持有锁）"""
+        self.version += 1
+        for directory in {os.path.dirname(p) for p in paths}:
+            self.versions[directory] = self.versions.get(directory, 0) + 1
+
+    def _index(self, path, cached):
+        """把文件加入哈希索引；抽样哈希与其它inode相同时，为还没有完整哈希的文件排队（调用方需持有锁）"""
+        sample, full = cached
+        group = self.by_sample.setdefault(sample, set())
+        group.add(path)
+        if full:
+            self.by_full.setdefault(full, set()).add(path)
+        if len({self.paths[p] for p in group}) > 1:
+            for other in group:
+                key = self.paths[other]
+                if self.hashes.get(key, (None, None))[1] is None:
+                    self._submit(other, key)
+        # 完整哈希相同的其它文件显示的副本数也随之变化
+        self._touch(self.by_full[full] if full else [path])
+
+    def _unindex(self, path):
+        """从哈希索引中移除，返回原来的键（调用方需持有锁）"""
+        key = self.paths.pop(path, None)
+        if key is not None:
+            paths = self.links[key]
+            paths.discard(path)
+            if not paths:
+                del self.links[key]
+        cached = self.hashes.get(key)
+        if cached:
+            for table, digest in ((self.by_sample, cached[0]), (self.by_full, cached[1])):
+                group = table.get(digest)
+                if group is not None:
+                    group.discard(path)
+                    if not group:
+                        del table[digest]
+            self._touch([path, *self.by_full.get(cached[1], ())])
+        return key
+
+    def _hash(self, path, key):
+        try:
+            self.ensure(path, key)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_summary("hash-error", f"计算内容哈希失败: {path}, 错误: {e}", error=True)
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def ensure(self, path, key, need_full=False):
+        """计算并缓存文件的哈希：先算抽样哈希，需要时再算完整哈希，返回(抽样哈希, 完整哈希)"""
+        st = os.stat(path)
+        if self.stat_key(st) != key:
+            raise FileNotFoundError(path)  # 文件已变化，新的变更事件会重新排队
+        with self.lock:
+            sample, full = self.hashes.get(key, (None, None))
+        if sample is None:
+            sample = sample_hash(path, key[2])
+        if full is None and not need_full:
+            with self.lock:
+                need_full = len({self.paths.get(p) for p in self.by_sample.get(sample, ())} - {key}) > 0
+        if full is None and need_full:
+            full = full_hash(path)
+        with self.lock:
+            if self.hashes.get(key) != (sample, full):
+                # 同一inode可能有多个路径（硬链接），全部按新结果重新建立索引
+                linked = list(self.links.get(key, ()))
+                for p in linked:
+                    self._unindex(p)
+                self.hashes[key] = (sample, full)
+                self._save_later(key, (sample, full))
+                for p in linked:
+                    self.paths[p] = key
+                    self.links.setdefault(key, set()).add(p)
+                    self._index(p, (sample, full))
+        return sample, full
+
+    def find_duplicate(self, path, digest=None, extra=()):
+        """查找与path内容完全相同的已跟踪文件（或extra中的文件）：先比抽样哈希，命中后才比完整哈希"""
+        size = os.path.getsize(path)
+        sample = sample_hash(path, size)
+        with self.lock:
+            candidates = [(p, self.paths[p]) for p in self.by_sample.get(sample, ()) if p != path]
+        for other in extra:
+            try:
+                st = os.stat(other)
+            except FileNotFoundError:
+                continue
+            if st.st_size == size and other != path:
+                candidates.append((other, self.stat_key(st)))
+        for other, key in candidates:
+            try:
+                other_sample, other_full = self.ensure(other, key, need_full=True)
+            except OSError:
+                continue
+            if other_sample == sample:
+                digest = digest or full_hash(path)
+                if other_full == digest:
+                    return other
+        return None
+
+    def flag(self, path):
+        """表格"重复"列的内容：内容相同的其它文件数（同一inode的硬链接不占用额外空间，单独标出）"""
+        with self.lock:
+            cached = self.hashes.get(self.paths.get(path))
+            group = self.by_full.get(cached[1]) if cached and cached[1] else None
+            if not group or len(group) < 2:
+                return ""
+            inodes = {self.paths[p][:2] for p in group}
+        if len(inodes) > 1:
+            return f"⚠️ {len(group) - 1} 个副本"
+        return f"🔗 {len(group) - 1} 个硬链接"
+
+
+# 全局内容哈希索引：跟踪input/output目录（通过文件索引监听）和下载目录（见list_downloads）
+HASHES = HashIndex(HASH_DB, HASH_WORKERS)
+FILE_INDEX.listeners.append(HASHES.on_file_change)
+FILE_INDEX.clear_listeners.append(HASHES.on_dir_cleared)
+atexit.register(HASHES.flush)
+
+
+def generate_proxy(ffmpeg, src_path, dest_path, height):
+    """用ffmpeg把视频转成低码率H.264预览代理（faststart，便于边下边播）"""
+    tmp_path = f"{dest_path}.tmp.mp4"
+    cmd = [ffmpeg, "-nostdin", "-loglevel", "error", "-i", src_path,
+           "-vf", f"scale=-2:'min({height},ih)'", "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+           "-maxrate", "1500k", "-bufsize", "3000k", "-c:a", "aac", "-b:a", "96k", "-ac", "2",
+           "-movflags", "+faststart", "-y", tmp_path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=6 * 3600)
+    except subprocess.TimeoutExpired:
+        result = None
+    if result is not None and result.returncode == 0 and os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+        os.replace(tmp_path, dest_path)
+        return True
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+    if result is not None and result.stderr:
+        log_error(f"生成预览代理失败: {src_path}, ffmpeg: {result.stderr.decode('utf-8', 'replace').strip()[-300:]}")
+    return False
+
+
+class ProxyService:
+    """预览代理 - 有限的线程池调用ffmpeg转码，按(路径, 大小, 修改时间)缓存，超出配额时淘汰最久未预览的代理"""
+
+    def __init__(self, proxy_dir, ffmpeg, workers, mode, quota_bytes):
+        self.proxy_dir = proxy_dir
+        self.ffmpeg = ffmpeg
+        self.mode = mode if ffmpeg else "off"
+        self.quota_bytes = quota_bytes
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.failed = set()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="proxy")
+        for f in os.listdir(proxy_dir):
+            if f.endswith(".tmp.mp4"):
+                os.unlink(os.path.join(proxy_dir, f))  # 上次退出时未完成的转码
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def path_for(self, path, size, mtime):
+        """代理文件路径（缓存键与缩略图相同）"""
+        return os.path.join(self.proxy_dir, f"{ThumbnailService.key_for(path, size, mtime)}.mp4")
+
+    def lookup(self, path, enqueue=True):
+        """返回已生成的代理路径并更新其访问时间；未生成时按需排队，返回None"""
+        if not self.enabled:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size < PROXY_MIN_SIZE:
+            return None
+        proxy = self.path_for(path, st.st_size, st.st_mtime)
+        if os.path.exists(proxy):
+            os.utime(proxy)  # 用修改时间记录最近一次预览，供淘汰使用
+            return proxy
+        if enqueue:
+            self.request(path, proxy)
+        return None
+
+    def status(self, path):
+        """代理状态：pending / failed / None"""
+        with self.lock:
+            if path in self.pending:
+                return "pending"
+            if path in self.failed:
+                return "failed"
+        return None
+
+    def request(self, path, proxy):
+        """排队转码一个文件"""
+        with self.lock:
+            if path in self.pending or path in self.failed:
+                return
+            self.pending.add(path)
+        self.pool.submit(self._transcode, path, proxy)
+
+    def on_file_change(self, directory, kind, name, entry):
+        """文件索引变更监听：eager模式下output目录出现新文件时立即生成代理"""
+        if self.mode != "eager" or kind == "removed" or directory not in OUTPUT_ROOTS or entry[0] < PROXY_MIN_SIZE:
+            return
+        path = os.path.join(directory, name)
+        self.failed.discard(path)
+        self.request(path, self.path_for(path, entry[0], entry[1]))
+
+    def _transcode(self, path, proxy):
+        log_info(f"开始生成预览代理: {path}")
+        started = time.time()
+        try:
+            ok = generate_proxy(self.ffmpeg, path, proxy, PROXY_HEIGHT)
+        except Exception as e:
+            log_error(f"生成预览代理失败: {path}, 错误: {e}")
+            ok = False
+        with self.lock:
+            self.pending.discard(path)
+            if not ok:
+                self.failed.add(path)
+        if ok:
+            log_info(f"预览代理已生成: {path}，耗时 {time.time() - started:.1f} 秒，"
+                     f"大小 {os.path.getsize(proxy) / (1024 * 1024):.2f} MB")
+            self.evict()
+
+    def evict(self):
+        """超出配额时按最近预览时间淘汰代理"""
+        proxies = []
+        for f in os.listdir(self.proxy_dir):
+            if f.endswith(".mp4") and not f.endswith(".tmp.mp4"):
+                try:
+                    st = os.stat(os.path.join(self.proxy_dir, f))
+                except OSError:
+                    continue
+                proxies.append((st.st_mtime, st.st_size, f))
+        total = sum(size for _, size, _ in proxies)
+        for _, size, f in sorted(proxies):
+            if total <= self.quota_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.proxy_dir, f))
+                total -= size
+                log_info(f"淘汰预览代理: {f}，释放 {size / (1024 * 1024):.2f} MB")
+            except OSError as e:
+                log_error(f"删除预览代理失败: {f}, 错误: {e}")
+
+    def stop(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局预览代理服务
+PROXIES = ProxyService(PROXY_DIR, FFMPEG_PATH, PROXY_WORKERS, PROXY_MODE if SERVER_MODE != "agent" else "off",
+                       PROXY_QUOTA_BYTES)
+FILE_INDEX.listeners.append(PROXIES.on_file_change)
+atexit.register(PROXIES.stop)
+
+
+class JobCancelled(Exception):
+    """处理任务被取消"""
+
+
+# 已注册的处理器：名称 -> (显示名, 处理函数, 输出文件名后缀)
+PROCESSORS = {}
+
+
+def register_processor(name, label, suffix=None):
+    """注册处理器：fn(src_path, tmp_path, report)在子进程中把结果写到tmp_path；
+    report(0~1的进度)在任务被取消时抛出JobCancelled。suffix为None时输出文件与输入同名"""
+    def decorator(fn):
+        PROCESSORS[name] = (label, fn, suffix)
+        return fn
+    return decorator
+
+
+@register_processor("copy", "复制到输出目录")
+def process_copy(src_path, tmp_path, report):
+    """示例处理器：原样复制"""
+    total = os.path.getsize(src_path) or 1
+    done = 0
+    with open(src_path, "rb") as src, open(tmp_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(STREAM_CHUNK_SIZE), b""):
+            dst.write(chunk)
+            done += len(chunk)
+            report(done / total)
+
+
+@register_processor("h264", "H.264转码（ffmpeg）", suffix="_h264.mp4")
+def process_h264(src_path, tmp_path, report):
+    """用ffmpeg转码为H.264/AAC，通过-progress输出计算进度"""
+    if not FFMPEG_PATH:
+        raise RuntimeError("未找到ffmpeg")
+    duration = (probe_media(src_path) or {}).get("duration") or 0
+    cmd = [FFMPEG_PATH, "-nostdin", "-loglevel", "error", "-progress", "pipe:1", "-i", src_path,
+           "-c:v", "libx264", "-preset", "medium", "-crf", "23", "-c:a", "aac", "-b:a", "128k",
+           "-movflags", "+faststart", "-f", "mp4", "-y", tmp_path]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for line in proc.stdout:
+            key, _, value = line.decode("ascii", "replace").strip().partition("=")
+            # out_time_ms实际单位也是微秒
+            if key in ("out_time_us", "out_time_ms") and duration and value.isdigit():
+                report(int(value) / 1e6 / duration)
+        stderr = proc.communicate()[1]
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg退出码 {proc.returncode}: {stderr.decode('utf-8', 'replace').strip()[-300:]}")
+
+
+# 子进程中的进度队列（进程池初始化时通过继承传入）
+job_progress_queue = None
+
+
+def init_job_worker(queue, log_queue):
+    """处理进程初始化：fork继承来的日志队列在子进程中没有后台线程读取，改为经进程间队列交回主进程写出"""
+    global job_progress_queue
+    job_progress_queue = queue
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def run_job(job_id, processor, src_path, tmp_path):
+    """在子进程中执行一个处理任务，进度每0.5秒通过队列回报一次"""
+    cancel_flag = os.path.join(JOB_DIR, f"{job_id}.cancel")
+    last_report = [0.0]
+
+    def report(fraction):
+        now = time.time()
+        if now - last_report[0] < 0.5 and fraction < 1:
+            return
+        last_report[0] = now
+        job_progress_queue.put((job_id, min(max(fraction, 0.0), 1.0)))
+        if os.path.exists(cancel_flag):
+            raise JobCancelled()
+
+    PROCESSORS[processor][1](src_path, tmp_path, report)
+
+
+class JobScheduler:
+    """处理任务调度 - 进程池大小等于可用CPU核数，按优先级调度，支持取消，结果直接写入output索引"""
+
+    STATUS_LABELS = {"queued": "排队中", "running": "运行中", "done": "已完成", "failed": "失败", "cancelled": "已取消"}
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.jobs = {}  # job_id -> 任务信息
+        self.queue = []  # 优先队列：(priority, seq, job_id)
+        self.seq = 0
+        self.running = 0
+        self.version = 0  # 任务状态每变化一次加一
+        self.pool = None
+        self.progress_queue = None
+        self.log_listener = None
+        self.output_lock = threading.Lock()  # 输出改名到位与清空文件夹互斥
+
+    def cleanup(self):
+        """删除上次退出时留下的取消标记和未完成的输出"""
+        for f in os.listdir(JOB_DIR):
+            os.unlink(os.path.join(JOB_DIR, f))
+        for f in os.listdir(OUTPUT_DIR):
+            if re.search(r"\.job\d+\.partial$", f):
+                os.unlink(os.path.join(OUTPUT_DIR, f))
+
+    def start(self):
+        """创建进程池并启动调度线程"""
+        if self.pool is not None:
+            return
+        # 与缩略图服务相同，在主线程中启动时fork出全部子进程：请求处理线程中fork，子进程可能继承到被其它线程占用的锁
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("任务进程池必须在主线程中创建")
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        self.progress_queue = context.Queue()
+        log_queue = context.Queue()
+        self.log_listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers)
+        self.log_listener.start()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                        initializer=init_job_worker, initargs=(self.progress_queue, log_queue))
+        self.pool.submit(os.getpid).result()
+        threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True).start()
+        threading.Thread(target=self._progress_loop, name="job-progress", daemon=True).start()
+        log_info(f"任务调度已启动，进程数: {self.workers}")
+
+    def stop(self):
+        """关闭进程池"""
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.log_listener:
+            self.log_listener.stop()
+
+    def submit(self, paths, processor, priority=1):
+        """为每个文件创建一个任务，返回任务ID列表"""
+        if processor not in PROCESSORS:
+            raise ValueError(f"未知的处理器: {processor}")
+        if self.pool is None:
+            raise RuntimeError("任务调度未启动")
+        job_ids = []
+        with self.lock:
+            for path in paths:
+                self.seq += 1
+                job_id = str(self.seq)
+                self.jobs[job_id] = {"id": job_id, "path": path, "processor": processor, "priority": priority,
+                                     "status": "queued", "progress": 0.0, "message": "", "output": None}
+                heapq.heappush(self.queue, (priority, self.seq, job_id))
+                job_ids.append(job_id)
+            self.version += 1
+            self.wakeup.notify()
+        log_info(f"提交处理任务 {len(job_ids)} 个，处理器: {PROCESSORS[processor][0]}，优先级: {priority}")
+        return job_ids
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接移除，运行中的通知子进程在下次回报进度时停止"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job["status"] not in ("queued", "running"):
+                return False
+            if job["status"] == "queued":
+                job["status"] = "cancelled"  # 队列中的条目在出队时跳过
+            else:
+                open(os.path.join(JOB_DIR, f"{job_id}.cancel"), "w").close()
+                job["message"] = "正在取消"
+            self.version += 1
+        log_info(f"取消处理任务: {job_id}")
+        return True
+
+    def partials(self):
+        """运行中的任务正在写入的.partial文件"""
+        with self.lock:
+            return [job["tmp"] for job in self.jobs.values() if job["status"] == "running" and job.get("tmp")]
+
+    def active_ids(self):
+        """排队中和运行中的任务ID"""
+        with self.lock:
+            return [job_id for job_id, job in self.jobs.items() if job["status"] in ("queued", "running")]
+
+    def _dispatch_loop(self):
+        """调度线程：同时最多提交workers个任务"""
+        while True:
+            with self.lock:
+                while not self.queue or self.running >= self.workers:
+                    self.wakeup.wait()
+                _, _, job_id = heapq.heappop(self.queue)
+                job = self.jobs.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                job["status"] = "running"
+                self.running += 1
+                self.version += 1
+            suffix = PROCESSORS[job["processor"]][2]
+            name = os.path.basename(job["path"])
+            if suffix:
+                name = os.path.splitext(name)[0] + suffix
+            tmp = os.path.join(OUTPUT_DIR, f"{name}.job{job_id}.partial")
+            job["tmp"] = tmp
+            try:
+                future = self.pool.submit(run_job, job_id, job["processor"], job["path"], tmp)
+            except RuntimeError:
+                return  # 进程池已关闭（程序正在退出）
+            future.add_done_callback(lambda f, job_id=job_id, tmp=tmp, name=name: self._on_done(f, job_id, tmp, name))
+
+    def _on_done(self, future, job_id, tmp, name):
+        """任务结束：把输出改名到位（已有同名文件时追加序号，不覆盖）并直接更新output索引，无需重新扫描"""
+        status, message = "done", ""
+        dest = os.path.join(OUTPUT_DIR, name)
+        try:
+            future.result()
+            with PATH_LOCKS.hold(dest), self.output_lock:
+                dest = os.path.join(OUTPUT_DIR, unique_name(OUTPUT_DIR, name))
+                os.replace(tmp, dest)
+                FILE_INDEX.apply_event(OUTPUT_DIR, os.path.basename(dest))
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            status, message = "failed", str(e)
+        if status != "done" and os.path.exists(tmp):
+            os.unlink(tmp)
+        cancel_flag = os.path.join(JOB_DIR, f"{job_id}.cancel")
+        if os.path.exists(cancel_flag):
+            os.unlink(cancel_flag)
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(status=status, message=message, output=dest if status == "done" else None)
+            if status == "done":
+                job["progress"] = 1.0
+            self.running -= 1
+            self.version += 1
+            finished = [k for k, v in self.jobs.items() if v["status"] in ("done", "failed", "cancelled")]
+            for k in finished[:max(0, len(finished) - JOB_HISTORY)]:
+                del self.jobs[k]
+            self.wakeup.notify()
+        if status == "failed":
+            log_error(f"处理任务失败: {job_id} {os.path.basename(dest)}, 错误: {message}")
+        else:
+            log_info(f"处理任务{self.STATUS_LABELS[status]}: {job_id} {os.path.basename(dest)}")
+
+    def _progress_loop(self):
+        """接收子进程回报的进度"""
+        while True:
+            job_id, fraction = self.progress_queue.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job and job["status"] == "running":
+                    job["progress"] = fraction
+                    self.version += 1
+
+    def rows(self, limit=50):
+        """任务表格的行（最新的在前）"""
+        with self.lock:
+            jobs = list(self.jobs.values())[-limit:]
+        return [[job["id"], os.path.basename(job["path"]), PROCESSORS[job["processor"]][0],
+                 self.STATUS_LABELS[job["status"]], f"{job['progress']:.0%}", job["message"]]
+                for job in reversed(jobs)]
+
+    def summary(self, job_ids):
+        """一组任务的进度摘要，返回(文本, 是否全部结束)"""
+        with self.lock:
+            jobs = [self.jobs[job_id] for job_id in job_ids if job_id in self.jobs]
+        counts = {status: 0 for status in self.STATUS_LABELS}
+        for job in jobs:
+            counts[job["status"]] += 1
+        lines = [f"处理进度：已完成 {counts['done']}/{len(jobs)}，运行中 {counts['running']}，排队 {counts['queued']}，"
+                 f"失败 {counts['failed']}，取消 {counts['cancelled']}"]
+        lines += [f"  [{job['id']}] {os.path.basename(job['path'])}: {job['progress']:.0%}"
+                  for job in jobs if job["status"] == "running"]
+        lines += [f"  [{job['id']}] {os.path.basename(job['path'])} 失败: {job['message']}"
+                  for job in jobs if job["status"] == "failed"][:10]
+        return "\n".join(lines), counts["queued"] + counts["running"] == 0
+
+
+# 全局任务调度器
+JOBS = JobScheduler(JOB_WORKERS)
+JOBS.cleanup()
+if SERVER_MODE != "agent":  # 代理节点不处理任务，不创建进程池
+    JOBS.start()
+atexit.register(JOBS.stop)
+
+
+def format_row(directory, name, entry, selected=False, thumbnail=False):
+    """把索引条目格式化为表格行（thumbnail=True时为缺失的缩略图排队生成）"""
+    size_bytes, mtime_ts, _ = entry
+    path = os.path.join(directory, name)
+    size = f"{size_bytes / 1024 / 1024:.2f} MB"
+    mtime = datetime.fromtimestamp(mtime_ts).strftime('%Y-%m-%d %H:%M')
+    # 代理节点上的文件不在本机生成缩略图
+    thumb = "" if is_remote(path) else THUMBNAILS.cell(path, size_bytes, mtime_ts, enqueue=thumbnail)
+    info = METADATA.get(path, size_bytes, mtime_ts)
+    if info is None:
+        media = ["…", "…", "…", "…"]  # 元数据尚在后台读取
+    else:
+        media = [format_duration(info["duration"]) if info.get("duration") else "",
+                 f"{info['width']}x{info['height']}" if info.get("width") else "",
+                 info.get("codec") or "",
+                 f"{info['bitrate'] / 1e6:.2f} Mbps" if info.get("bitrate") else ""]
+    # 修改：返回列表而不是元组
+    source = ROOT_LABELS.get(directory, directory)
+    return [selected, name, source, path, size, mtime, thumb, *media, HASHES.flag(path)]  # 使用方括号创建列表
+
+
+def as_roots(directory):
+    """面板对应的目录列表：传入单个目录时视为只有一个存储位置"""
+    return [directory] if isinstance(directory, str) else list(directory)
+
+
+def panel_roots(is_input):
+    """Input或Output面板的全部存储位置"""
+    return INPUT_ROOTS if is_input else OUTPUT_ROOTS
+
+
+def table_version(directory):
+    """表格内容的版本：各存储位置的文件索引版本 + 缩略图版本 + 元数据版本 + 重复标记版本（都只看这些存储位置，
+    其它目录在后台生成缩略图或计算哈希时，各会话的表格版本不变，不会整页重发）"""
+    roots = as_roots(directory)
+    return tuple((FILE_INDEX.version(d), THUMBNAILS.dir_version(d), METADATA.dir_version(d), HASHES.dir_version(d))
+                 for d in roots)
+
+
+@instrument()
+def list_files(directory, rescan=True, selected=None):
+    """列出目录中的所有视频文件（rescan=False时只读索引，不访问磁盘）"""
+    entries = FILE_INDEX.scan(directory) if rescan else FILE_INDEX.entries(directory)
+    selected = set(selected or ())
+    with FILE_INDEX.lock:
+        files = [format_row(directory, f, entries[f], f in selected)
+                 for f in sorted(entries)]
+    log_info(f"列出目录 {directory} 中的文件，找到 {len(files)} 个视频文件")
+    return files
+
+
+def render_page(directory, view=None, session=None):
+    """渲染表格的当前页 - 只序列化可见的一页数据；多个存储位置时按同一排序合并显示"""
+    roots = as_roots(directory)
+    view = {**DEFAULT_VIEW, **(view or {})}
+    items, total, page, page_count = FILE_INDEX.page_roots(roots, view)
+    # 只检查当前页的文件，不复制整个选中集合
+    selected = {(d, n) for d, n in items if session and SELECTIONS.contains(session, d, n)}
+    with FILE_INDEX.lock:
+        tables = {d: FILE_INDEX.entries(d) for d in roots}
+        # 只为当前页（即页面上可见的文件）排队生成缩略图
+        rows = [format_row(d, n, tables[d][n], (d, n) in selected, thumbnail=True)
+                for d, n in items if n in tables[d]]
+    label = f"第 {page}/{page_count} 页，共 {total} 个文件"
+    return gr.update(value=rows, label=label)
+
+
+def change_view(view, directory, session=None, **changes):
+    """修改分页/排序/过滤设置，返回新的视图状态、表格页和页码"""
+    view = {**DEFAULT_VIEW, **(view or {}), **changes}
+    if "page" not in changes:
+        view["page"] = 1  # 排序或过滤条件变化后回到第一页
+    _, _, view["page"], _ = FILE_INDEX.page_roots(as_roots(directory), view)
+    return view, render_page(directory, view, session), view["page"]
+
+
+def list_video_paths(directory):
+    """返回（各存储位置中）所有视频文件的路径（直接读取索引，不构造表格行）"""
+    roots = as_roots(directory)
+    scan_roots(roots)
+    with FILE_INDEX.lock:
+        return [os.path.join(d, f) for d in roots for f in sorted(FILE_INDEX.entries(d))]
+
+
+# 文件名条件：(类型, 小写文本)，类型为包含/开头/结尾/相等
+NAME_CHECKS = {"in": lambda low, text: text in low, "start": str.startswith, "end": str.endswith, "eq": str.__eq__}
+
+
+def search_pattern(term):
+    """文件名条件在换行分隔的拼接串中对应的子串"""
+    kind, text = term
+    return ("\n" if kind in ("start", "eq") else "") + text + ("\n" if kind in ("end", "eq") else "")
+
+
+def glob_terms(pattern):
+    """把通配符拆成必须满足的文件名条件；只含一段文字和*时这些条件与通配符完全等价"""
+    wildcard = r"\[!?\]?[^\]]*\]|[*?]"  # 与fnmatch一致：[]a]、[!]a]中紧跟的]属于字符集，不成对的[按普通字符处理
+    pieces = re.split(wildcard, pattern)
+    terms = []
+    for i, piece in enumerate(pieces):
+        if piece:
+            first, last = i == 0, i == len(pieces) - 1
+            terms.append(("eq" if first and last else "start" if first else "end" if last else "in", piece))
+    return terms, len(terms) <= 1 and not re.search(r"\?|\[!?\]?[^\]]*\]", pattern)
+
+
+def parse_search_query(text):
+    """解析搜索语法：普通词为文件名子串，含*?[的词为通配符，size>2GB为大小范围，
+    age<7d为修改时间距今范围（单位m/h/d/w），mtime>=2025-01-01为修改日期范围，in:input/in:output限定目录"""
+    query = {"terms": [], "globs": [], "size": [float("-inf"), float("inf")],
+             "mtime": [float("-inf"), float("inf")], "dirs": INPUT_ROOTS + OUTPUT_ROOTS}
+    try:
+        tokens = shlex.split(text or "")
+    except ValueError as e:
+        raise ValueError(f"无法解析: {e}")
+    now = time.time()
+    for token in tokens:
+        lowered = token.lower()
+        if lowered.startswith("in:"):
+            if lowered[3:] not in ("input", "output"):
+                raise ValueError(f"in:后只能是input或output: {token}")
+            query["dirs"] = list(INPUT_ROOTS if lowered[3:] == "input" else OUTPUT_ROOTS)
+            continue
+        m = re.fullmatch(r"(size|age|mtime)(>=|<=|>|<|=)(.+)", lowered)
+        if not m:
+            if any(c in token for c in "*?["):
+                terms, exact = glob_terms(lowered)
+                query["terms"].extend(terms)
+                if not exact:
+                    query["globs"].append(re.compile(fnmatch.translate(lowered)))
+            elif lowered:
+                query["terms"].append(("in", lowered))
+            continue
+        field, op, value = m.groups()
+        if field == "size":
+            vm = re.fullmatch(r"([\d.]+)\s*([kmgt]?b?)", value)
+            if not vm:
+                raise ValueError(f"无法解析: {token}（例如 size>2GB）")
+            lo = hi = float(vm.group(1)) * SIZE_UNITS[vm.group(2)]
+        elif field == "age":
+            vm = re.fullmatch(r"([\d.]+)\s*([mhdw])", value)
+            if not vm or op == "=":
+                raise ValueError(f"无法解析: {token}（例如 age<7d）")
+            # 距今越近修改时间越大：age<7d 即 mtime>现在-7天
+            lo = hi = now - float(vm.group(1)) * AGE_UNITS[vm.group(2)]
+            op = {">": "<", "<": ">", ">=": "<=", "<=": ">="}[op]
+            field = "mtime"
+        else:
+            try:
+                lo = hi = datetime.fromisoformat(value).timestamp()
+            except ValueError:
+                raise ValueError(f"无法解析: {token}（例如 mtime>=2025-01-01）")
+            if len(value) <= 10:
+                hi = math.nextafter(lo + 86400, float("-inf"))  # 只写日期时表示当天整天
+        # [lo, hi]为该值覆盖的区间：>取区间之后，>=从区间起点，<取区间之前，<=到区间终点
+        bounds = query[field]
+        if op == ">":
+            bounds[0] = max(bounds[0], math.nextafter(hi, float("inf")))
+        elif op == ">=":
+            bounds[0] = max(bounds[0], lo)
+        elif op == "<":
+            bounds[1] = min(bounds[1], math.nextafter(lo, float("-inf")))
+        elif op == "<=":
+            bounds[1] = min(bounds[1], hi)
+        else:
+            bounds[0], bounds[1] = max(bounds[0], lo), min(bounds[1], hi)
+    return query
+
+
+class SearchIndex:
+    """文件搜索索引 - 与排序缓存一样按目录版本懒重建
+
+    文件名：按文件名排序的小写文件名拼接成一个以换行分隔的字符串，子串、前缀、后缀都可以先用
+    str.count在C层面得到命中数，命中少时逐个定位，命中多时逐个扫描；
+    大小、修改时间：复用FileIndex的排序索引，配合同序的数值数组二分得到范围。
+    查询时先用命中数最少的条件得到候选，再用其余条件逐步过滤。
+    """
+
+    def __init__(self, file_index):
+        self.file_index = file_index
+        self.lock = threading.Lock()
+        self.cache = {}  # (directory, part) -> (version, data)
+
+    def _cached(self, directory, part, build):
+        version = self.file_index.version(directory)
+        with self.lock:
+            cached = self.cache.get((directory, part))
+            if cached and cached[0] == version:
+                return cached[1]
+        data = build(directory)
+        with self.lock:
+            self.cache[(directory, part)] = (version, data)
+        return data
+
+    def _build_names(self, directory):
+        """按文件名排序的文件名、对应的小写文件名（本身是小写时共用同一对象）、拼接串和每行起始位置"""
+        self.file_index.sorted_names(directory, "name")
+        with self.file_index.lock:
+            names = list(self.file_index.sorted_names(directory, "name"))  # 索引中的列表会被就地更新
+        lower = []
+        for name in names:
+            lowered = name.lower()
+            lower.append(name if lowered == name else lowered)
+        blob = "\n" + "\n".join(lower) + "\n"
+        # 第k行从offsets[k]开始，末尾多一个哨兵等于拼接串长度
+        offsets = array("q", itertools.accumulate((len(n) + 1 for n in lower), initial=1))
+        return names, lower, blob, offsets
+
+    def _build_size(self, directory):
+        return self._build_column(directory, "size")
+
+    def _build_mtime(self, directory):
+        return self._build_column(directory, "mtime")
+
+    def _build_column(self, directory, column):
+        """按size/mtime排序的文件名和同序的数值数组（只按数值排序，结果最后会按文件名重排）"""
+        with self.file_index.lock:
+            table = self.file_index.entries(directory)
+            values = table.sizes if column == "size" else table.mtimes
+            order = sorted(range(len(values)), key=values.__getitem__)
+            return [table.names[i] for i in order], array(values.typecode, map(values.__getitem__, order))
+
+    def _find(self, lower, blob, offsets, term, count):
+        """满足文件名条件的行号：命中少时在拼接串中逐个定位，命中多时逐个扫描"""
+        kind, text = term
+        if count > len(lower) * SEARCH_SCAN_RATIO:
+            check = NAME_CHECKS[kind]
+            return [row for row, low in enumerate(lower) if check(low, text)]
+        pattern = search_pattern(term)
+        shift = pattern.startswith("\n")  # 以换行开头时命中位置在行首之前
+        found = []
+        pos = blob.find(pattern)
+        while pos >= 0:
+            row = bisect.bisect_right(offsets, pos + shift) - 1
+            found.append(row)
+            pos = blob.find(pattern, offsets[row + 1] - 1)  # 同一行只记一次
+        return found
+
+    def search(self, directory, query):
+        """返回目录中满足查询的文件名列表（按文件名排序）"""
+        names, lower, blob, offsets = self._cached(directory, "names", self._build_names)
+        drivers = []  # (命中数, 条件, 生成候选的函数)；文件名条件生成行号，范围条件生成文件名
+        for column, build in (("size", self._build_size), ("mtime", self._build_mtime)):
+            lo, hi = query[column]
+            if lo == float("-inf") and hi == float("inf"):
+                continue
+            by_value, values = self._cached(directory, column, build)
+            i, j = bisect.bisect_left(values, lo), bisect.bisect_right(values, hi)
+            drivers.append((j - i, column, lambda by_value=by_value, i=i, j=j: by_value[i:j]))
+        for term in query["terms"]:
+            count = blob.count(search_pattern(term))
+            drivers.append((count, term, lambda term=term, count=count: self._find(lower, blob, offsets, term, count)))
+        if not drivers:
+            rows = range(len(names))
+            remaining = []
+        else:
+            drivers.sort(key=lambda d: d[0])
+            _, first, produce = drivers[0]
+            remaining = [d[1] for d in drivers[1:]]
+            if first in ("size", "mtime"):
+                # 范围条件得到的是按数值排序的文件名，先按其余条件过滤，最后再按文件名排序
+                return sorted(self._filter_names(directory, produce(), remaining, query, query["globs"]))
+            rows = produce()
+        # 行号按文件名排序，文件名条件直接检查对应的小写文件名
+        for term in [t for t in remaining if t not in ("size", "mtime")]:
+            check, text = NAME_CHECKS[term[0]], term[1]
+            rows = [row for row in rows if check(lower[row], text)]
+        if query["globs"]:
+            rows = [row for row in rows if all(g.match(lower[row]) for g in query["globs"])]
+        return self._filter_names(directory, [names[row] for row in rows],
+                                  [t for t in remaining if t in ("size", "mtime")], query, ())
+
+    def _filter_names(self, directory, candidates, conditions, query, globs):
+        """按剩余的范围和文件名条件过滤文件名列表"""
+        for condition in conditions:
+            if condition in ("size", "mtime"):
+                lo, hi = query[condition]
+                with self.file_index.lock:
+                    table = self.file_index.entries(directory)
+                    rows, values = table.rows, table.sizes if condition == "size" else table.mtimes
+                    candidates = [n for n in candidates if n in rows and lo <= values[rows[n]] <= hi]
+            else:
+                check, text = NAME_CHECKS[condition[0]], condition[1]
+                candidates = [n for n in candidates if check(n.lower(), text)]
+        if globs:
+            candidates = [n for n in candidates if all(g.match(n.lower()) for g in globs)]
+        return candidates
+
+
+SEARCH = SearchIndex(FILE_INDEX)
+
+
+@instrument()
+def search_files(text):
+    """在input和output目录中搜索，返回 {目录: [文件名]}"""
+    query = parse_search_query(text)
+    return {directory: SEARCH.search(directory, query) for directory in query["dirs"]}
+
+
+# 修改刷新函数 - 仅当文件实际变化时刷新
+def refresh_files_only(input_version=None, output_version=None, input_view=None, output_view=None, session="default"):
+    """仅当文件变化时刷新文件列表，保留当前选中状态（与该页面上次看到的版本比较，各会话互不影响）"""
+    # 增量扫描（目录未变化时不访问文件，不同磁盘并行），再用索引版本号判断是否有变化
+    scan_roots(INPUT_ROOTS + OUTPUT_ROOTS)
+    input_result, output_result, current_input, current_output = poll_file_changes(
+        input_version, output_version, input_view, output_view, session)
+
+    if current_input != input_version:
+        log_info(f"检测到input目录文件变化，已更新文件列表，当前版本: {current_input}")
+    if current_output != output_version:
+        log_info(f"检测到output目录文件变化，已更新文件列表，当前版本: {current_output}")
+    if current_input == input_version and current_output == output_version:
+        # 没有变化时返回gr.update()以保持当前状态
+        log_info("文件未发生变化，保持当前状态")
+    return input_result, output_result, current_input, current_output
+
+
+def poll_file_changes(input_version, output_version, input_view=None, output_view=None, session="default"):
+    """定时推送：只读取监听器维护的索引，目录有变更时才把当前页发给页面"""
+    input_result, output_result = gr.update(), gr.update()
+    current_input = table_version(INPUT_ROOTS)
+    current_output = table_version(OUTPUT_ROOTS)
+    if current_input != input_version:
+        input_result = render_page(INPUT_ROOTS, input_view, session)
+    if current_output != output_version:
+        output_result = render_page(OUTPUT_ROOTS, output_view, session)
+    return input_result, output_result, current_input, current_output
+
+
+# 完整刷新函数 - 用于上传/删除等操作
+def full_refresh(input_view=None, output_view=None, session="default"):
+    """完全刷新文件列表并清空选中状态"""
+    scan_roots(INPUT_ROOTS + OUTPUT_ROOTS)
+    # 先取版本号再渲染：渲染期间若有新变更，页面下次轮询时会再刷新一次
+    input_version = table_version(INPUT_ROOTS)
+    output_version = table_version(OUTPUT_ROOTS)
+
+    # 清空该会话的选中状态
+    input_selection = sum(SELECTIONS.replace(session, d, ()) for d in INPUT_ROOTS)
+    output_selection = sum(SELECTIONS.replace(session, d, ()) for d in OUTPUT_ROOTS)
+    input_page = render_page(INPUT_ROOTS, input_view)
+    output_page = render_page(OUTPUT_ROOTS, output_view)
+
+    log_info(f"执行完整刷新，input文件数: {sum(len(FILE_INDEX.entries(d)) for d in INPUT_ROOTS)}, "
+             f"output文件数: {sum(len(FILE_INDEX.entries(d)) for d in OUTPUT_ROOTS)}")
+    return (input_page, output_page, input_selection, output_selection,
+            "0", "暂无选中文件", "0", "暂无选中文件", input_version, output_version)
+
+
+# 启动后的首次复核完成时置位，页面加载事件等待它再刷新表格
+INDEX_READY = threading.Event()
+
+
+def reconcile_index():
+    """复核启动时载入的索引快照（只stat有变化的文件），然后为还没有元数据和内容哈希的文件排队"""
+    started = time.perf_counter()
+    METADATA.load()
+    HASHES.load()
+    scan_roots(INPUT_ROOTS + OUTPUT_ROOTS)  # 不同磁盘上的目录并行复核
+    INDEX_READY.set()
+    log_info(f"启动复核完成，耗时 {time.perf_counter() - started:.2f} 秒")
+    REMOTE.start()  # 代理节点的列表在后台拉取，节点较慢或离线时不影响本机文件的显示
+    for directory in local_roots():
+        METADATA.sync(directory)
+        HASHES.sync(directory)
+
+
+def initial_page(directory):
+    """构建界面时的表格初始值：只读取快照，不访问磁盘；没有快照时先显示空表格"""
+    if STARTUP_MODE == "scan" or (STARTUP_MODE == "snapshot" and all(map(FILE_INDEX.indexed, as_roots(directory)))):
+        return render_page(directory)
+    return gr.update(value=[], label="⏳ 正在加载文件列表…")
+
+
+def unique_name(dest_dir, filename):
+    """目标目录中已有同名文件时追加序号，避免覆盖内容不同的文件"""
+    stem, ext = os.path.splitext(filename)
+    candidate, n = filename, 1
+    while os.path.lexists(os.path.join(dest_dir, candidate)):
+        candidate = f"{stem}_{n}{ext}"
+        n += 1
+    return candidate
+
+
+def place_file(src_path, dest_dir, filename, digest=None):
+    """按去重策略决定新文件的来源和文件名：返回(硬链接来源, 文件名, 说明)；内容已存在且不需要新文件时来源为None
+    （说明只描述内容是否重复，是否真的建立了硬链接由调用方根据实际结果报告）"""
+    dest = os.path.join(dest_dir, filename)
+    existing = None
+    if DEDUP_UPLOAD_MODE != "off":
+        existing = HASHES.find_duplicate(src_path, digest, extra=[dest])
+    if existing == dest:
+        return None, filename, "内容相同，已跳过"
+    if existing and DEDUP_UPLOAD_MODE == "reject":
+        raise DuplicateContent(existing)
+    if os.path.lexists(dest):
+        filename = unique_name(dest_dir, filename)
+    if existing:
+        return existing, filename, f"与 {os.path.basename(existing)} 内容相同"
+    return src_path, filename, None
+
+
+def write_partial(link_src, src_path, dest_dir, partial, note):
+    """在目标目录中写出.partial文件：同一文件系统时硬链接link_src，否则复制src_path，返回方式"""
+    try:
+        if os.stat(link_src).st_dev != os.stat(dest_dir).st_dev:
+            raise OSError("不在同一文件系统")
+        os.link(link_src, partial)
+        return "去重硬链接" if note else "硬链接"
+    except OSError:
+        shutil.copyfile(src_path, partial)
+        size = os.path.getsize(partial)
+        METRICS.add_io(read=size, written=size, name="upload_file")  # 在线程池中执行，需要指定名称
+        return "复制"
+
+
+def ingest_file(src_path, dest_dir=INPUT_DIR, index=True):
+    """把已接收的临时文件放入目标目录：内容已存在时按DEDUP_UPLOAD_MODE跳过或硬链接到已有文件，
+    否则同一文件系统时硬链接、不同时复制；先写.partial再原子改名，同名的不同文件自动改名
+    （index=False时不更新文件索引，由调用方整批写入）"""
+    filename = os.path.basename(src_path)
+    # 持有原文件名的锁：同名上传串行处理，避免并发时选中同一个新文件名（路径锁不可嵌套，改名后不再另加锁）
+    with PATH_LOCKS.hold(os.path.join(dest_dir, filename)):
+        try:
+            link_src, filename, note = place_file(src_path, dest_dir, filename)
+        except DuplicateContent as e:
+            return e.path, "重复已拒绝"
+        dest = os.path.join(dest_dir, filename)
+        if link_src is None:
+            return dest, note
+        for attempt in range(2):
+            partial = f"{dest}.{secrets.token_hex(4)}.partial"
+            try:
+                method = write_partial(link_src, src_path, dest_dir, partial, note)
+                os.replace(partial, dest)
+                break
+            except FileNotFoundError:
+                # 放入期间文件夹被清空：.partial随旧目录移入了回收目录，在新建的空目录中重新放入一次
+                if attempt or not os.path.isdir(dest_dir):
+                    raise
+        if index:
+            FILE_INDEX.apply_event(dest_dir, filename)
+    return dest, method
+
+
+def ingest_files(src_paths, dest_dir=INPUT_DIR):
+    """并行放入多个文件，全部完成后一次性写入文件索引，返回[(目标路径, 方式)]"""
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        results = list(pool.map(functools.partial(ingest_file, dest_dir=dest_dir, index=False), src_paths))
+    FILE_INDEX.apply_batch([dest for dest, _ in results])
+    return results
+
+
+def upload_summary(results):
+    """记录每个上传文件的处理方式，返回{方式: 文件数}"""
+    methods = {}
+    for dest, method in results:
+        methods[method] = methods.get(method, 0) + 1
+        log_summary("upload", f"上传文件: {os.path.basename(dest)} 到 {os.path.dirname(dest)} 目录（{method}）")
+    return methods
+
+
+@instrument()
+def upload_file(files, input_view=None, output_view=None, session="default"):
+    """上传文件到input目录（支持多个文件并行处理）"""
+    if files and not isinstance(files, (list, tuple)):
+        files = [files]
+    if files:
+        # Gradio 3返回临时文件对象，新版本直接返回路径
+        src_paths = [getattr(f, "name", f) for f in files]
+        methods = upload_summary(ingest_files(src_paths))
+        summary = f"上传完成，共 {len(src_paths)} 个文件（" + "，".join(f"{m} {n} 个" for m, n in methods.items()) + "）"
+        log_info(summary)
+        if set(methods) - {"硬链接", "复制"}:
+            gr.Info(summary)  # 有重复内容被跳过或链接时提示用户
+    else:
+        log_info("未选择文件进行上传")
+    return full_refresh(input_view, output_view, session)
+
+
+class ChunkedUploads:
+    """分块、可续传的上传会话 - 数据直接写入INPUT_DIR中的.partial文件，边接收边计算SHA-256"""
+
+    def __init__(self, sessions_file):
+        self.sessions_file = sessions_file
+        self.lock = threading.Lock()
+        # upload_id -> {"filename", "size", "partial", "sha256"(可选，客户端提供的期望值)}
+        self.sessions = {}
+        self.hashers = {}  # upload_id -> 已接收数据的哈希对象（重启后按需重建）
+        self.write_locks = {}  # upload_id -> asyncio.Lock，保证同一上传的分块按顺序写入
+        try:
+            with open(sessions_file, "r", encoding="utf-8") as f:
+                self.sessions = {k: v for k, v in json.load(f).items() if os.path.exists(v["partial"])}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_error(f"载入上传会话失败: {e}")
+
+    def _save(self):
+        """保存会话列表（调用方需持有锁）"""
+        tmp_path = f"{self.sessions_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.sessions, f, ensure_ascii=False)
+        os.replace(tmp_path, self.sessions_file)
+
+    def create(self, filename, size, sha256=None):
+        """创建上传会话并预先建立.partial文件"""
+        filename = os.path.basename(filename or "")
+        if not filename.lower().endswith(VIDEO_EXTENSIONS):
+            raise ValueError(f"不支持的文件类型: {filename}")
+        upload_id = secrets.token_urlsafe(12)
+        partial = os.path.join(INPUT_DIR, f"{filename}.{upload_id}.partial")
+        open(partial, "wb").close()
+        with self.lock:
+            self.sessions[upload_id] = {"filename": filename, "size": int(size),
+                                        "partial": partial, "sha256": sha256}
+            self.hashers[upload_id] = hashlib.sha256()
+            self._save()
+        log_info(f"创建分块上传会话: {filename}，大小: {size}，ID: {upload_id}")
+        return upload_id
+
+    def get(self, upload_id):
+        """返回会话信息，不存在时返回None"""
+        return self.sessions.get(upload_id)
+
+    def offset(self, upload_id):
+        """已写入的字节数（即续传位置）"""
+        return os.path.getsize(self.sessions[upload_id]["partial"])
+
+    def write_lock(self, upload_id):
+        """返回该上传的写入锁"""
+        with self.lock:
+            return self.write_locks.setdefault(upload_id, asyncio.Lock())
+
+    def hasher(self, upload_id):
+        """返回已接收数据的哈希对象；服务重启后通过读取.partial重建"""
+        hasher = self.hashers.get(upload_id)
+        if hasher is None:
+            hasher = hashlib.sha256()
+            with open(self.sessions[upload_id]["partial"], "rb") as f:
+                for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+            self.hashers[upload_id] = hasher
+        return hasher
+
+    @staticmethod
+    def write(f, hasher, chunk):
+        """写入一个分块并更新哈希：在同一次线程调用中完成，请求在等待期间被取消时两者仍然一致"""
+        f.write(chunk)
+        hasher.update(chunk)
+
+    def reset_hasher(self, upload_id):
+        """分块请求异常结束（写入出错、连接断开）时丢弃哈希对象，下次按.partial的实际内容重建"""
+        with self.lock:
+            self.hashers.pop(upload_id, None)
+
+    def complete(self, upload_id):
+        """校验大小和哈希后原子改名为正式文件"""
+        session = self.sessions[upload_id]
+        received = self.offset(upload_id)
+        if received != session["size"]:
+            raise ValueError(f"文件尚未传完: {received}/{session['size']}")
+        digest = self.hasher(upload_id).hexdigest()
+        if session.get("sha256") and session["sha256"].lower() != digest:
+            raise ValueError("SHA-256校验失败")
+        with open(session["partial"], "rb+") as f:
+            os.fsync(f.fileno())
+        partial = session["partial"]
+        with PATH_LOCKS.hold(os.path.join(INPUT_DIR, session["filename"])):
+            try:
+                link_src, filename, note = place_file(partial, INPUT_DIR, session["filename"], digest)
+            except DuplicateContent:
+                self.abort(upload_id)
+                raise
+            dest = os.path.join(INPUT_DIR, filename)
+            if link_src is None:
+                os.unlink(partial)  # 同名文件内容相同，保留原文件
+            else:
+                if link_src != partial:
+                    # 内容已存在：改为硬链接到已有文件，释放刚上传的数据（跨文件系统时仍使用上传的文件）
+                    linked = f"{dest}.{secrets.token_hex(4)}.partial"
+                    try:
+                        os.link(link_src, linked)
+                        os.replace(linked, partial)
+                        note += "，已硬链接"
+                    except OSError:
+                        with contextlib.suppress(OSError):
+                            os.unlink(linked)
+                        note += "，无法硬链接，保留上传的文件"
+                os.replace(partial, dest)
+                FILE_INDEX.apply_event(INPUT_DIR, filename)
+        self._forget(upload_id)
+        log_info(f"分块上传完成: {filename}，SHA-256: {digest}" + (f"（{note}）" if note else ""))
+        return dest, digest
+
+    def abort(self, upload_id):
+        """取消上传并删除.partial文件"""
+        session = self.sessions.get(upload_id)
+        if session and os.path.exists(session["partial"]):
+            os.unlink(session["partial"])
+        self._forget(upload_id)
+        log_info(f"取消分块上传: {upload_id}")
+
+    def _forget(self, upload_id):
+        with self.lock:
+            self.sessions.pop(upload_id, None)
+            self.hashers.pop(upload_id, None)
+            self.write_locks.pop(upload_id, None)
+            self._save()
+
+
+# 全局分块上传管理器
+CHUNKED_UPLOADS = ChunkedUploads(UPLOAD_SESSIONS_FILE)
+
+
+def remove_file(path):
+    """删除单个文件，返回None表示成功，否则返回失败原因"""
+    if is_remote(path):
+        return REMOTE.delete(path)
+    try:
+        with PATH_LOCKS.hold(path):
+            os.remove(path)
+        return None
+    except FileNotFoundError:
+        return "文件不存在"
+    except Exception as e:
+        return str(e)
+
+
+def remove_files(file_paths, progress=None):
+    """线程池并行删除一批文件，全部完成后一次性更新文件索引，返回失败列表[(路径, 原因)]"""
+    total = len(file_paths)
+    failures = []
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+        futures = {pool.submit(remove_file, path): path for path in file_paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            error = future.result()
+            if error:
+                failures.append((futures[future], error))
+            if progress is not None and (done % 200 == 0 or done == total):
+                progress(done / total, desc=f"正在删除 {done}/{total}")
+    FILE_INDEX.apply_batch(file_paths)
+    return failures
+
+
+@instrument()
+def delete_files(file_paths, input_view=None, output_view=None, session="default", progress=None):
+    """批量删除文件（线程池并行删除，汇总结果后只记录一条日志）"""
+    if not file_paths:
+        log_info("删除请求中未选择文件")
+        return full_refresh(input_view, output_view, session)
+
+    total = len(file_paths)
+    started = time.time()
+    failures = remove_files(file_paths, progress)
+    summary = f"批量删除完成，成功删除 {total - len(failures)} 个文件，失败 {len(failures)} 个，耗时 {time.time() - started:.2f} 秒"
+    log_info(summary)
+    for path, error in failures[:10]:
+        log_error(f"删除文件失败: {path}, 错误: {error}")
+    if len(failures) > 10:
+        log_error(f"另有 {len(failures) - 10} 个文件删除失败")
+    gr.Info(summary)
+    return full_refresh(input_view, output_view, session)
+
+
+def remove_tree(path):
+    """后台删除回收目录"""
+    started = time.time()
+    shutil.rmtree(path, ignore_errors=True)
+    log_info(f"后台清理完成: {path}，耗时 {time.time() - started:.2f} 秒")
+
+
+# 回收目录只用一个线程慢慢删除，不与前台请求争抢磁盘
+TRASH_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trash")
+
+
+def sibling_trash(directory):
+    """存储位置旁边的隐藏回收目录"""
+    directory = os.path.abspath(directory)
+    return os.path.join(os.path.dirname(directory), TRASH_SIBLING.format(os.path.basename(directory)))
+
+
+def trash_dir_for(directory):
+    """与目录在同一文件系统上的回收目录（按st_dev判断），都不在同一文件系统（如目录本身是挂载点）时返回None"""
+    device = os.stat(directory).st_dev
+    if os.stat(TRASH_DIR).st_dev == device:
+        return TRASH_DIR
+    trash = sibling_trash(directory)
+    try:
+        if os.stat(os.path.dirname(trash)).st_dev != device:
+            return None
+        os.makedirs(trash, exist_ok=True)
+    except OSError:
+        return None
+    return trash if os.stat(trash).st_dev == device else None
+
+
+for _trash in [TRASH_DIR] + [sibling_trash(root) for root in INPUT_ROOTS + OUTPUT_ROOTS]:
+    if os.path.isdir(_trash):
+        for _leftover in os.listdir(_trash):
+            TRASH_POOL.submit(remove_tree, os.path.join(_trash, _leftover))  # 上次退出时未删完的目录
+
+
+def clear_folder(directory, input_view=None, output_view=None, session="default", progress=None):
+    """清空文件夹（面板的全部存储位置）：把目录整体改名到回收目录并重建空目录，实际删除在后台进行"""
+    leftovers = []
+    for root in as_roots(directory):
+        if is_remote(root):
+            # 代理节点上的存储位置逐个文件请求节点删除
+            leftovers += [os.path.join(root, f) for f in FILE_INDEX.entries(root)]
+        elif not move_to_trash(root):
+            # 目录是挂载点等无法在同一文件系统上改名时，退回逐个删除
+            leftovers += [os.path.join(root, f) for f in os.listdir(root)]
+    if leftovers:
+        return delete_files(leftovers, input_view, output_view, session, progress)
+    return full_refresh(input_view, output_view, session)
+
+
+def move_to_trash(directory):
+    """把目录整体改名到同一文件系统上的回收目录并重建空目录，无法改名时返回False"""
+    trash_dir = trash_dir_for(directory)
+    if trash_dir is None:
+        log_info(f"目录 {directory} 所在的文件系统上没有可用的回收目录，改为并行删除")
+        return False
+    trash = os.path.join(trash_dir, f"{os.path.basename(directory)}-{time.time_ns()}")
+    # 与处理任务的输出改名互斥：任务不会在目录移走后、.partial移回前结束
+    with JOBS.output_lock:
+        try:
+            os.rename(directory, trash)
+        except OSError as e:
+            log_info(f"无法整体移动目录 {directory}（{e}），改为并行删除")
+            return False
+        os.makedirs(directory, exist_ok=True)
+        # 正在进行的分块上传和处理任务写在目录中的.partial文件里，移回新目录以免中断
+        partials = [upload["partial"] for upload in list(CHUNKED_UPLOADS.sessions.values())] + JOBS.partials()
+        for partial in partials:
+            if os.path.dirname(partial) == directory:
+                try:
+                    os.rename(os.path.join(trash, os.path.basename(partial)), partial)
+                except OSError:
+                    pass
+    WATCHER.rewatch(directory)
+    FILE_INDEX.clear(directory)
+    TRASH_POOL.submit(remove_tree, trash)
+    log_info(f"已清空文件夹 {directory}，旧文件移至 {trash} 后台删除")
+    return True
+
+
+def archive_name(file_paths):
+    """根据来源文件夹和文件数生成压缩包文件名"""
+    # 确定来源文件夹名称 (input/output)
+    source_dir = ROOT_KEYS.get(os.path.dirname(file_paths[0]), "output") if file_paths else "output"
+    
+    # 获取文件名（不带扩展名）
+    if len(file_paths) == 1:
+        base_name = os.path.splitext(os.path.basename(file_paths[0]))[0]
+        return f"{source_dir}_{base_name}.zip"
+    return f"{source_dir}_多个文件.zip"
+
+
+class ArchiveCache:
+    """按内容寻址的压缩包缓存 - 相同文件集合直接复用已生成的ZIP，超出容量时按LRU淘汰"""
+
+    def __init__(self, manifest_file, quota_bytes):
+        self.manifest_file = manifest_file
+        self.quota_bytes = quota_bytes
+        self.lock = threading.Lock()
+        # key -> {"path": 压缩包路径, "size": 字节数, "last_access": 最近访问时间}
+        self.entries = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+        try:
+            with open(manifest_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = {k: v for k, v in data.get("entries", {}).items() if os.path.isfile(v["path"])}
+            self.stats.update(data.get("stats", {}))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_error(f"载入压缩包缓存清单失败: {e}")
+
+    @staticmethod
+    def make_key(file_paths):
+        """根据成员的(路径, 大小, 修改时间)计算缓存键"""
+        members = []
+        for path in file_paths:
+            try:
+                st = source_stat(path)
+            except FileNotFoundError:
+                continue
+            members.append((path if is_remote(path) else os.path.abspath(path), st.st_size, st.st_mtime_ns))
+        members.sort()
+        return hashlib.sha256(json.dumps(members).encode("utf-8")).hexdigest()
+
+    def _save(self):
+        """保存缓存清单（调用方需持有锁）"""
+        tmp_path = f"{self.manifest_file}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": self.entries, "stats": self.stats}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_file)
+        except Exception as e:
+            log_error(f"保存压缩包缓存清单失败: {e}")
+
+    def lookup(self, key):
+        """命中时返回压缩包路径并刷新访问时间，否则返回None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and os.path.isfile(entry["path"]):
+                entry["last_access"] = time.time()
+                self.stats["hits"] += 1
+                self._save()
+                return entry["path"]
+            self.entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+
+    def add(self, key, path):
+        """登记新生成的压缩包，并在超出容量时淘汰最久未使用的压缩包"""
+        with self.lock:
+            self.entries[key] = {"path": path, "size": os.path.getsize(path), "last_access": time.time()}
+            total = sum(e["size"] for e in self.entries.values())
+            for old_key in sorted(self.entries, key=lambda k: self.entries[k]["last_access"]):
+                if total <= self.quota_bytes:
+                    break
+                if old_key == key:
+                    continue  # 刚生成的压缩包即使超出容量也要先交给用户
+                evicted = self.entries.pop(old_key)
+                shutil.rmtree(os.path.dirname(evicted["path"]), ignore_errors=True)
+                ARCHIVE_LOCKS.discard(old_key)
+                total -= evicted["size"]
+                self.stats["evictions"] += 1
+                self.stats["evicted_bytes"] += evicted["size"]
+                log_info(f"压缩包缓存超出容量，淘汰: {evicted['path']}")
+            self._save()
+
+    def clear(self):
+        """清空缓存清单（文件由调用方删除）"""
+        with self.lock:
+            for key in self.entries:
+                ARCHIVE_LOCKS.discard(key)
+            self.entries = {}
+            self._save()
+
+    def summary(self):
+        """缓存占用与命中/淘汰统计"""
+        with self.lock:
+            used = sum(e["size"] for e in self.entries.values())
+            return (f"压缩包缓存: {len(self.entries)} 个, {used / 1024 / 1024:.2f} MB / "
+                    f"{self.quota_bytes / 1024 / 1024:.0f} MB，命中 {self.stats['hits']} 次，"
+                    f"未命中 {self.stats['misses']} 次，淘汰 {self.stats['evictions']} 个"
+                    f"（{self.stats['evicted_bytes'] / 1024 / 1024:.2f} MB）")
+
+
+# 全局压缩包缓存
+ARCHIVE_CACHE = ArchiveCache(ARCHIVE_CACHE_FILE, DOWNLOAD_QUOTA_BYTES)
+
+
+@instrument()
+def download_files(file_paths):
+    """批量下载文件 - 创建ZIP压缩包（相同文件集合直接复用缓存）"""
+    if not file_paths:
+        log_info("下载请求中未选择文件")
+        return None, "📥 请先选择要下载的文件！"  # 添加错误提示
+    
+    key = ArchiveCache.make_key(file_paths)
+    # 同一内容的压缩包同时只由一个请求生成，其余请求等待后直接命中缓存
+    with ARCHIVE_LOCKS.hold(key):
+        return build_archive(file_paths, key)
+
+
+def read_ahead(file_paths, chunk_size=STREAM_CHUNK_SIZE, depth=ARCHIVE_READ_AHEAD):
+    """按原顺序产出(路径, stat结果, 数据块迭代器)，文件不存在时后两项为None；
+    每个磁盘（或代理节点）由ARCHIVE_POOLS中的一个线程依次预读其上的文件（每个文件最多depth块），不同磁盘的读取并行进行"""
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=depth) for _ in file_paths]
+    by_device = {}
+    for i, path in enumerate(file_paths):
+        by_device.setdefault(ARCHIVE_POOLS.device(os.path.dirname(path)), []).append(i)
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False  # 消费方已放弃
+
+    def reader(indexes):
+        for i in indexes:
+            # 每个文件依次放入：stat结果（或异常）、数据块、结束标记b""
+            try:
+                f, st = open_source(file_paths[i])
+                with f:
+                    if not put(queues[i], st):
+                        return
+                    while chunk := f.read(chunk_size):
+                        if not put(queues[i], chunk):
+                            return
+            except OSError as e:
+                if not put(queues[i], e):
+                    return
+                continue
+            if not put(queues[i], b""):
+                return
+
+    def chunks(q):
+        while True:
+            item = q.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                return
+            yield item
+
+    for indexes in by_device.values():
+        ARCHIVE_POOLS.submit(os.path.dirname(file_paths[indexes[0]]), reader, indexes)
+    try:
+        for path, q in zip(file_paths, queues):
+            first = q.get()
+            if isinstance(first, FileNotFoundError):
+                yield path, None, None
+                continue
+            if isinstance(first, Exception):
+                raise first
+            yield path, first, chunks(q)
+    finally:
+        stop.set()
+
+
+def build_archive(file_paths, key):
+    """查找或生成压缩包（调用方需持有该内容键的锁）"""
+    zip_name = archive_name(file_paths)
+    cached_path = ARCHIVE_CACHE.lookup(key)
+    if cached_path:
+        log_info(f"压缩包缓存命中: {cached_path}")
+        return cached_path, "📥 下载文件已准备好！（使用缓存）"
+
+    # 每个内容键使用独立子目录，既保留友好文件名，又避免同名压缩包互相覆盖
+    zip_dir = os.path.join(DOWNLOAD_DIR, key[:16])
+    os.makedirs(zip_dir, exist_ok=True)
+    zip_path = os.path.join(zip_dir, zip_name)
+    tmp_path = f"{zip_path}.{secrets.token_hex(4)}.tmp"
+    
+    try:
+        missing = []
+        used_names = set()
+        with zipfile.ZipFile(tmp_path, 'w') as zipf:
+            # 源文件由各自磁盘的线程预读，写压缩包的同时其它磁盘上的后续文件已在读取
+            for i, (path, st, data) in enumerate(read_ahead(file_paths), 1):
+                if st is None:
+                    missing.append(path)
+                    continue
+                name = os.path.basename(path)
+                base, ext = os.path.splitext(name)
+                suffix = 1
+                while name in used_names:  # 不同存储位置中可能有同名文件
+                    name = f"{base}_{suffix}{ext}"
+                    suffix += 1
+                used_names.add(name)
+                info = zipfile.ZipInfo(name, time.localtime(max(st.st_mtime, 315532800))[:6])
+                info.external_attr = (st.st_mode & 0xFFFF) << 16
+                info.file_size = st.st_size  # 据此决定是否使用ZIP64
+                with zipf.open(info, "w") as member:
+                    for chunk in data:
+                        member.write(chunk)
+                log_summary("archive", f"正在打包 {zip_name}: {i}/{len(file_paths)}")
+        log_info(f"压缩包共添加 {len(file_paths) - len(missing)} 个文件")
+        if missing:
+            log_error(f"{len(missing)} 个文件不存在，未加入压缩包: {', '.join(missing[:10])}"
+                      + (" 等" if len(missing) > 10 else ""))
+        os.replace(tmp_path, zip_path)
+        ARCHIVE_CACHE.add(key, zip_path)
+        METRICS.add_io(read=sum(os.path.getsize(p) for p in file_paths if os.path.exists(p)),
+                       written=os.path.getsize(zip_path))
+
+        log_info(f"下载文件准备完成: {zip_path}")
+        return zip_path, "📥 下载文件已准备好！"  # 添加成功提示
+    except Exception as e:
+        log_error(f"创建下载文件失败: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return None, "📥 下载文件准备失败！"
+
+
+class ZipStream:
+    """流式ZIP64压缩包 - 视频不再压缩（STORED），边读源文件边输出，不占用磁盘"""
+
+    LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+    CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+    DATA_DESCRIPTOR = struct.Struct("<IIQQ")
+    ZIP64_LOCAL_EXTRA = struct.Struct("<HHQQ")
+    ZIP64_CENTRAL_EXTRA = struct.Struct("<HHQQQ")
+    ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+    ZIP64_LOCATOR = struct.Struct("<IIQI")
+    END = struct.Struct("<IHHHHIIH")
+    VERSION = 45  # ZIP64所需的最低版本
+    FLAGS = 0x0808  # bit3: 使用数据描述符; bit11: 文件名为UTF-8
+
+    def __init__(self, file_paths):
+        # 在开始前固定每个文件的大小，以便预先计算Content-Length
+        self.members = []
+        used_names = set()
+        for path in file_paths:
+            try:
+                st = source_stat(path)
+            except FileNotFoundError:
+                log_error(f"尝试添加不存在的文件到压缩包: {path}")
+                continue
+            name = os.path.basename(path)
+            base, ext = os.path.splitext(name)
+            suffix = 1
+            while name in used_names:  # input和output中可能有同名文件
+                name = f"{base}_{suffix}{ext}"
+                suffix += 1
+            used_names.add(name)
+            self.members.append((path, name.encode("utf-8"), st.st_size, self._dos_time(st.st_mtime)))
+
+    @staticmethod
+    def _dos_time(timestamp):
+        """把时间戳转换为ZIP使用的DOS日期和时间"""
+        t = time.localtime(max(timestamp, 315532800))  # DOS时间最早为1980年
+        return ((t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+                t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+    def content_length(self):
+        """压缩包的总字节数（无需读取任何文件内容）"""
+        total = self.ZIP64_END.size + self.ZIP64_LOCATOR.size + self.END.size
+        for _, name, size, _ in self.members:
+            total += self.LOCAL_HEADER.size + len(name) + self.ZIP64_LOCAL_EXTRA.size
+            total += size + self.DATA_DESCRIPTOR.size
+            total += self.CENTRAL_HEADER.size + len(name) + self.ZIP64_CENTRAL_EXTRA.size
+        return total
+
+    def __iter__(self):
+        """逐块生成压缩包内容"""
+        offset = 0
+        central = []
+        for path, name, size, (dos_date, dos_time) in self.members:
+            header = self.LOCAL_HEADER.pack(
+                0x04034b50, self.VERSION, self.FLAGS, 0, dos_time, dos_date,
+                0, 0xFFFFFFFF, 0xFFFFFFFF, len(name), self.ZIP64_LOCAL_EXTRA.size)
+            extra = self.ZIP64_LOCAL_EXTRA.pack(0x0001, 16, 0, 0)
+            yield header + name + extra
+            local_offset = offset
+            offset += len(header) + len(name) + len(extra)
+
+            crc = 0
+            remaining = size
+            f, _ = open_source(path)
+            with f:
+                while remaining > 0:
+                    chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        # 文件在下载过程中被截断，已承诺的长度无法兑现，只能中止
+                        raise IOError(f"文件在下载过程中被修改: {path}")
+                    crc = zlib.crc32(chunk, crc)
+                    remaining -= len(chunk)
+                    yield chunk
+            offset += size
+
+            descriptor = self.DATA_DESCRIPTOR.pack(0x08074b50, crc, size, size)
+            yield descriptor
+            offset += len(descriptor)
+            central.append((name, size, crc, dos_date, dos_time, local_offset))
+
+        # 中央目录
+        central_offset = offset
+        for name, size, crc, dos_date, dos_time, local_offset in central:
+            header = self.CENTRAL_HEADER.pack(
+                0x02014b50, 3 << 8 | self.VERSION, self.VERSION, self.FLAGS, 0, dos_time, dos_date,
+                crc, 0xFFFFFFFF, 0xFFFFFFFF, len(name), self.ZIP64_CENTRAL_EXTRA.size, 0,
+                0, 0, 0o100644 << 16, 0xFFFFFFFF)
+            extra = self.ZIP64_CENTRAL_EXTRA.pack(0x0001, 24, size, size, local_offset)
+            yield header + name + extra
+            offset += len(header) + len(name) + len(extra)
+        central_size = offset - central_offset
+
+        # ZIP64结束记录、定位器和传统结束记录
+        count = len(central)
+        yield self.ZIP64_END.pack(0x06064b50, self.ZIP64_END.size - 12, self.VERSION, self.VERSION,
+                                  0, 0, count, count, central_size, central_offset)
+        yield self.ZIP64_LOCATOR.pack(0x07064b50, 0, offset, 1)
+        yield self.END.pack(0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0)
+
+
+# 流式下载任务：token -> (文件路径列表, 压缩包名, 过期时间)
+STREAM_DOWNLOADS = {}
+STREAM_DOWNLOADS_LOCK = threading.Lock()  # 登记（同时清理过期任务）与下载请求在不同线程中并发访问
+
+
+def register_stream_download(file_paths):
+    """登记流式下载任务，返回(下载地址, 压缩包名)"""
+    now = time.time()
+    zip_name = archive_name(file_paths)
+    token = secrets.token_urlsafe(16)
+    with STREAM_DOWNLOADS_LOCK:
+        for expired in [t for t, task in STREAM_DOWNLOADS.items() if task[2] < now]:
+            del STREAM_DOWNLOADS[expired]
+        STREAM_DOWNLOADS[token] = (list(file_paths), zip_name, now + STREAM_DOWNLOAD_TTL)
+    log_info(f"登记流式下载: {zip_name}，文件数: {len(file_paths)}")
+    return f"/download/stream/{token}/{quote(zip_name)}", zip_name
+
+
+def stream_download_files(file_paths):
+    """登记流式下载任务，返回下载链接（不在DOWNLOAD_DIR中生成任何文件）"""
+    if not file_paths:
+        log_info("下载请求中未选择文件")
+        return "", "📥 请先选择要下载的文件！"
+
+    url, zip_name = register_stream_download(file_paths)
+    return f"[⬇️ 点击下载 {zip_name}]({url})（{len(file_paths)} 个文件，链接 {STREAM_DOWNLOAD_TTL // 60} 分钟内有效）", \
+        "📥 流式下载链接已生成！"
+
+
+def preview_url(file_path):
+    """返回文件的预览地址，文件不在任何input/output存储位置下时返回None"""
+    directory, name = os.path.split(file_path)
+    if is_remote(file_path):
+        # 代理节点上的文件经本机转发，浏览器不需要能直接访问节点
+        try:
+            agent, key, _ = REMOTE.locate(file_path)
+            mtime = REMOTE.stat(file_path).st_mtime
+        except FileNotFoundError:
+            return None
+        return f"/remote/{agent}/{key}/{quote(name)}?v={int(mtime)}"
+    for root, root_dir in PREVIEW_ROOTS.items():
+        if os.path.abspath(directory) == os.path.abspath(root_dir):
+            # 带上修改时间，文件被覆盖后浏览器会重新请求
+            return f"/preview/{root}/{quote(name)}?v={int(os.path.getmtime(file_path))}"
+    return None
+
+
+@instrument()
+def preview_file(file_path):
+    """预览单个视频文件（优先播放低码率代理，通过支持Range请求的预览接口播放，不复制到Gradio缓存）"""
+    if file_path and is_remote(file_path):
+        # 代理节点上的文件直接播放原文件，不在本机生成低码率代理
+        url = preview_url(file_path)
+        if url is None:
+            log_info(f"尝试预览不存在的文件: {file_path}")
+            return ""
+        log_info(f"预览文件: {file_path}")
+        return f'<video src="{url}" controls preload="metadata" style="width:100%;max-height:300px"></video>'
+    if file_path and os.path.exists(file_path):
+        url = preview_url(file_path)
+        if url is None:
+            log_info(f"尝试预览不在输入/输出目录中的文件: {file_path}")
+            return ""
+        proxy = PROXIES.lookup(file_path)
+        note = ""
+        if proxy:
+            url = preview_url(proxy)
+            note = "低码率预览"
+        elif PROXIES.status(file_path) == "pending":
+            note = "⏳ 正在生成低码率预览，当前播放原始文件"
+        log_info(f"预览文件: {file_path}{'（代理）' if proxy else ''}")
+        return (f'<video src="{url}" controls preload="metadata" style="width:100%;max-height:300px"></video>'
+                + (f"<div><small>{note}</small></div>" if note else ""))
+    else:
+        log_info(f"尝试预览不存在的文件: {file_path}")
+        return ""
+
+
+def list_downloads():
+    """列出下载目录中的所有文件（包括缓存子目录中的压缩包）"""
+    downloads = []
+    for root, _, files in os.walk(DOWNLOAD_DIR):
+        downloads.extend(os.path.join(root, f) for f in files
+                         if not f.startswith(".") and not f.endswith(".tmp"))
+    HASHES.sync_paths(DOWNLOAD_DIR, downloads)
+    log_info(f"列出下载目录文件，当前有 {len(downloads)} 个下载文件；{ARCHIVE_CACHE.summary()}")
+    return downloads
+
+
+def clear_downloads():
+    """清除下载目录中的所有文件"""
+    cleared_count = 0
+    for f in os.listdir(DOWNLOAD_DIR):
+        file_path = os.path.join(DOWNLOAD_DIR, f)
+        try:
+            if os.path.isdir(file_path):
+                cleared_count += sum(len(files) for _, _, files in os.walk(file_path))
+                shutil.rmtree(file_path)
+                log_info(f"清除下载目录: {file_path}")
+            elif os.path.isfile(file_path) and file_path != ARCHIVE_CACHE_FILE:
+                os.unlink(file_path)
+                log_info(f"清除下载文件: {file_path}")
+                cleared_count += 1
+        except Exception as e:
+            log_error(f"删除下载文件失败: {file_path} - {e}")
+    ARCHIVE_CACHE.clear()
+    
+    log_info(f"下载目录清理完成，共清除 {cleared_count} 个文件")
+    return "📥 下载文件已清除！", list_downloads(), ARCHIVE_CACHE.summary()
+
+
+# 文件选择处理函数
+class SelectionStore:
+    """按会话保存的选中文件 - 以文件名为键的集合（与FileTable共用文件名对象），单行切换为O(1)，不在页面和服务端之间往返整表"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (session, directory) -> dict.fromkeys(names)，用dict作为保留勾选顺序的集合
+        self.selections = {}
+        # (session, directory) -> 修改次数，页面通过它感知选中状态的变化
+        self.versions = {}
+
+    def get(self, session, directory):
+        """返回选中集合的副本（在锁内复制，其它事件并发切换、全选时遍历也不受影响）"""
+        with self.lock:
+            return dict(self.selections.get((session, directory), {}))
+
+    def head(self, session, directory, limit):
+        """返回(选中数量, 按勾选顺序的前limit个文件名)，只复制需要显示的部分"""
+        with self.lock:
+            current = self.selections.get((session, directory), {})
+            return len(current), list(itertools.islice(current, max(limit, 0)))
+
+    def contains(self, session, directory, name):
+        """文件是否被选中"""
+        with self.lock:
+            return name in self.selections.get((session, directory), ())
+
+    def version(self, session, directory):
+        """返回选中集合的版本号"""
+        return self.versions.get((session, directory), 0)
+
+    def _bump(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+        return self.versions[key]
+
+    def toggle(self, session, directory, name, selected):
+        """切换单个文件的选中状态，返回新的版本号"""
+        key = (session, directory)
+        with self.lock:
+            current = self.selections.setdefault(key, {})
+            if selected and name not in current:
+                current[name] = None
+            elif not selected and name in current:
+                del current[name]
+            else:
+                return self.versions.get(key, 0)
+            return self._bump(key)
+
+    def replace(self, session, directory, names):
+        """整体替换选中集合（全选/清空），返回新的版本号"""
+        key = (session, directory)
+        with self.lock:
+            self.selections[key] = dict.fromkeys(names)
+            return self._bump(key)
+
+    def drop(self, session):
+        """会话关闭时释放其选中状态"""
+        with self.lock:
+            for key in [k for k in self.selections if k[0] == session]:
+                self.selections.pop(key, None)
+                self.versions.pop(key, None)
+
+
+# 全局选中状态存储（按会话隔离）
+SELECTIONS = SelectionStore()
+
+
+def session_id(request):
+    """返回当前浏览器会话的标识"""
+    return getattr(request, "session_hash", None) or "default"
+
+
+def selection_summary(session, roots):
+    """生成面板的选中数量和文件名列表（只格式化前SELECTION_DISPLAY_LIMIT个文件名；多个存储位置时标出来源）"""
+    selections = [(d, *SELECTIONS.head(session, d, SELECTION_DISPLAY_LIMIT)) for d in roots]
+    count = sum(n for _, n, _ in selections)
+    names = ((f"[{ROOT_LABELS[d]}] {n}" if len(roots) > 1 else n) for d, _, shown in selections for n in shown)
+    lines = [f"• {name}" for name in itertools.islice(names, SELECTION_DISPLAY_LIMIT)]
+    if count > SELECTION_DISPLAY_LIMIT:
+        lines.append(f"… 以及另外 {count - SELECTION_DISPLAY_LIMIT} 个文件")
+    return str(count), "\n".join(lines) or "暂无选中文件"
+
+
+def selection_version(session, roots):
+    """面板的选中版本：各存储位置版本号之和（任一位置变化都会增加）"""
+    return sum(SELECTIONS.version(session, d) for d in roots)
+
+
+def update_selections(df, is_input=True, session="default"):
+    """根据当前页的勾选状态计算增量并写入选中集合，只更新对应面板"""
+    folder_name = "Input" if is_input else "Output"
+    roots = panel_roots(is_input)
+    try:
+        toggled = 0
+        # 只比较当前页的行，与文件夹总文件数无关；来源列决定文件属于哪个存储位置
+        for row in df or []:
+            checked = bool(row[0])
+            directory = ROOTS_BY_LABEL.get(row[2], roots[0])
+            if checked != SELECTIONS.contains(session, directory, row[1]):
+                SELECTIONS.toggle(session, directory, row[1], checked)
+                toggled += 1
+        count, display = selection_summary(session, roots)
+        log_info(f"更新选择状态 - {folder_name}切换: {toggled}, 选中: {count}")
+        return selection_version(session, roots), count, display
+    except Exception as e:
+        log_error(f"更新选择时出错: {e}")
+        return gr.update(), gr.update(), gr.update()
+
+
+def select_all_files(is_input=True, view=None, session="default"):
+    """全选当前文件夹的文件（包括其它页和其它存储位置中符合过滤条件的文件）"""
+    folder_name = "Input" if is_input else "Output"
+    roots = panel_roots(is_input)
+    log_info(f"执行全选操作 - {folder_name}文件夹")
+
+    # 从排序索引获取所有符合过滤条件的文件名（直接引用索引中的文件名对象，不拼接路径）
+    view = {**DEFAULT_VIEW, **(view or {})}
+    for directory in roots:
+        SELECTIONS.replace(session, directory, FILE_INDEX.query(directory, view["sort"], view["filter"]))
+
+    # 只重新渲染当前页
+    count, display = selection_summary(session, roots)
+    if count == "0":
+        log_info(f"{folder_name}文件夹为空，无可选文件")
+    log_info(f"全选完成 - {folder_name}文件夹，选中文件数: {count}")
+    return selection_version(session, roots), count, display, render_page(roots, view, session)
+
+
+def clear_selection_files(is_input=True, view=None, session="default"):
+    """清空当前文件夹的文件选择"""
+    folder_name = "Input" if is_input else "Output"
+    roots = panel_roots(is_input)
+    log_info(f"执行清空选择操作 - {folder_name}文件夹")
+
+    for directory in roots:
+        SELECTIONS.replace(session, directory, ())
+
+    log_info(f"清空选择完成 - {folder_name}文件夹")
+    return selection_version(session, roots), "0", "暂无选中文件", render_page(roots, view)
+
+
+def get_selected_paths(session, is_input=True):
+    """返回会话在某个文件夹（全部存储位置）中选中的文件路径列表"""
+    return [os.path.join(directory, name) for directory in panel_roots(is_input)
+            for name in SELECTIONS.get(session, directory)]
+
+
+def search_result_paths(text):
+    """重新执行搜索并返回全部结果的路径；查询无法解析时返回None"""
+    try:
+        results = search_files(text)
+    except ValueError as e:
+        gr.Warning(str(e))
+        return None
+    return [os.path.join(directory, name) for directory, names in results.items() for name in names]
+
+
+def run_search(text):
+    """执行搜索，返回结果表格（最多SEARCH_DISPLAY_LIMIT行）和结果摘要"""
+    started = time.perf_counter()
+    try:
+        results = search_files(text)
+    except ValueError as e:
+        return [], f"❌ {e}"
+    elapsed = (time.perf_counter() - started) * 1000
+    total = sum(len(names) for names in results.values())
+    rows = []
+    for directory, names in results.items():
+        entries = FILE_INDEX.entries(directory)
+        for name in itertools.islice(names, SEARCH_DISPLAY_LIMIT - len(rows)):
+            entry = entries.get(name)
+            if entry is not None:
+                _, _, source, _, size, mtime, *_, dup = format_row(directory, name, entry)
+                rows.append([source, name, size, mtime, dup])
+    counts = "，".join(f"{ROOT_LABELS.get(d, d)} {len(n)} 个" for d, n in results.items())
+    info = f"🔍 找到 {total} 个文件（{counts}），耗时 {elapsed:.1f} ms"
+    if total > len(rows):
+        info += f"，表格只显示前 {len(rows)} 个"
+    log_info(f"搜索: {text!r}，结果 {total} 个，耗时 {elapsed:.1f} ms")
+    return rows, info
+
+
+def select_search_results(text, input_view=None, output_view=None, session="default"):
+    """把两个文件夹的选中集合替换为搜索结果，返回两个面板的选中版本、数量、列表和当前页"""
+    try:
+        results = search_files(text)
+    except ValueError as e:
+        gr.Warning(str(e))
+        return (gr.update(),) * 8
+    outputs = []
+    for roots, view in ((INPUT_ROOTS, input_view), (OUTPUT_ROOTS, output_view)):
+        for directory in roots:
+            SELECTIONS.replace(session, directory, results.get(directory, ()))
+        outputs.append((selection_version(session, roots), *selection_summary(session, roots),
+                        render_page(roots, view, session)))
+    log_info(f"选中搜索结果 - Input: {outputs[0][1]}，Output: {outputs[1][1]}")
+    return (*outputs[0], *outputs[1])
+
+
+def update_preview_selector(session="default"):
+    """更新预览选择器的选项"""
+    # 合并输入和输出文件夹的选中文件（最多列出PREVIEW_CHOICES_LIMIT个）
+    all_selected_files = []
+    for directory in INPUT_ROOTS + OUTPUT_ROOTS:
+        label = ROOT_LABELS[directory]
+        remaining = PREVIEW_CHOICES_LIMIT - len(all_selected_files)
+        for file_name in SELECTIONS.head(session, directory, remaining)[1]:
+            all_selected_files.append((f"[{label}] {file_name}", os.path.join(directory, file_name)))
+
+    log_info(f"更新预览选择器选项，共有 {len(all_selected_files)} 个选中文件")
+    # 返回选项列表和默认选中值（第一个文件）
+    if all_selected_files:
+        return gr.update(choices=all_selected_files, value=all_selected_files[0][1])
+    else:
+        return gr.update(choices=[], value=None)
+
+
+# HTTP接口（与Gradio界面挂载在同一个服务上）
+api_app = FastAPI()
+
+
+def change_to_dict(change):
+    """把一条索引变更转换为可序列化的字典"""
+    seq, directory, kind, name, entry = change
+    row = format_row(directory, name, entry) if kind != "removed" else None
+    return {"seq": seq, "directory": directory, "kind": kind, "name": name,
+            "path": os.path.join(directory, name), "row": row}
+
+
+@api_app.get("/api/file-changes")
+async def file_changes_stream(since: int = 0):
+    """以Server-Sent Events推送新增/删除/修改的行，不发送完整列表"""
+    async def event_stream():
+        cursor = since
+        while True:
+            changes = FILE_INDEX.changes_since(cursor)
+            if changes is None:
+                # 客户端落后太多，日志已被截断，通知其整体重载
+                cursor = await asyncio.to_thread(FILE_INDEX.durable_seq)
+                yield f"event: reset\ndata: {json.dumps({'seq': cursor})}\n\n"
+                continue
+            if changes:
+                await asyncio.to_thread(FILE_INDEX.durable_seq)  # 推送的seq先写入持久化日志
+            for change in changes:
+                cursor = change[0]
+                yield f"data: {json.dumps(change_to_dict(change), ensure_ascii=False)}\n\n"
+            await asyncio.sleep(WATCH_PUSH_INTERVAL / 2)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+def change_roots(side):
+    """变更日志和清单接口的目录范围：side为input/output时只取该面板的存储位置，为空时取全部"""
+    if side not in ("", "input", "output"):
+        raise HTTPException(status_code=400, detail="side只能是input或output")
+    return list(panel_roots(side == "input")) if side else INPUT_ROOTS + OUTPUT_ROOTS
+
+
+@api_app.get("/api/changes")
+def changes_page(since: int = 0, limit: int = CHANGES_PAGE_LIMIT, side: str = ""):
+    """按游标分页读取持久化的变更日志：返回since之后的变更和下一页的游标next；
+    游标早于日志保留的范围（或晚于当前序号，例如日志被清空）时返回410，应先读取/api/manifest再从其seq继续"""
+    roots = change_roots(side)
+    limit = max(1, min(limit, CHANGES_PAGE_LIMIT))
+    rows, first, head = FILE_INDEX.change_log.since(since, limit, roots if side else None)
+    if since < first - 1 or since > head:
+        return Response(json.dumps({"detail": "游标已失效，请重新读取清单", "seq": head}, ensure_ascii=False),
+                        status_code=410, media_type="application/json")
+    changes = [{"seq": seq, "time": ts, "kind": kind, "path": os.path.join(directory, name),
+                "source": ROOT_LABELS.get(directory, directory), "name": name, "size": size, "mtime": mtime}
+               for seq, ts, directory, kind, name, size, mtime in rows]
+    more = len(rows) == limit
+    return {"changes": changes, "next": rows[-1][0] if more else head, "more": more, "seq": head}
+
+
+@api_app.get("/api/manifest")
+def manifest(request: Request, side: str = ""):
+    """当前全部文件的紧凑清单（路径、大小、修改时间、抽样哈希、完整SHA-256）及对应的变更序号seq，
+    之后从seq开始读取/api/changes即可保持同步；内容未变化时返回304，客户端接受gzip时压缩"""
+    roots = change_roots(side)
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    with FILE_INDEX.lock:
+        seq = FILE_INDEX.durable_seq()
+        etag = f'"{seq}-{HASHES.version}-{AGENT_INSTANCE}-{side}{"-gzip" if compress else ""}"'
+        headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        rows = [(d, name, entry) for d in roots for name, entry in FILE_INDEX.entries(d).items()]
+    digests = HASHES.digests([HASHES.entry_key(d, entry) for d, _, entry in rows])
+    body = json.dumps({"seq": seq, "fields": ["path", "size", "mtime", "sample", "sha256"],
+                       "files": [[os.path.join(d, name), size, mtime, sample, full]
+                                 for (d, name, (size, mtime, _)), (sample, full) in zip(rows, digests)]},
+                      ensure_ascii=False).encode("utf-8")
+    if compress:
+        body = gzip.compress(body, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@api_app.get("/download/stream/{token}/{filename}")
+def stream_download(token: str, filename: str):
+    """边打包边发送ZIP64压缩包，并预先给出Content-Length以便浏览器显示进度"""
+    with STREAM_DOWNLOADS_LOCK:
+        task = STREAM_DOWNLOADS.get(token)
+    if not task or task[2] < time.time():
+        raise HTTPException(status_code=404, detail="下载链接不存在或已过期")
+    file_paths, zip_name, _ = task
+    archive = ZipStream(file_paths)
+    log_info(f"开始流式下载: {zip_name}，文件数: {len(archive.members)}")
+    headers = {
+        "Content-Length": str(archive.content_length()),
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(zip_name)}",
+    }
+    @instrument("stream_download")
+    def counted():
+        for chunk in archive:
+            METRICS.add_io(written=len(chunk), name="stream_download")
+            yield chunk
+
+    return StreamingResponse(counted(), media_type="application/zip", headers=headers)
+
+
+def get_upload_session(upload_id):
+    """获取上传会话，不存在时返回404"""
+    session = CHUNKED_UPLOADS.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    return session
+
+
+@api_app.post("/api/upload")
+async def create_upload(payload: dict):
+    """创建分块上传会话：{"filename": ..., "size": ..., "sha256": 可选}"""
+    try:
+        upload_id = CHUNKED_UPLOADS.create(payload.get("filename"), payload.get("size", 0), payload.get("sha256"))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"upload_id": upload_id, "offset": 0}
+
+
+@api_app.get("/api/upload/{upload_id}")
+async def upload_status(upload_id: str):
+    """查询续传位置"""
+    session = get_upload_session(upload_id)
+    return {"upload_id": upload_id, "filename": session["filename"],
+            "size": session["size"], "offset": CHUNKED_UPLOADS.offset(upload_id)}
+
+
+@api_app.put("/api/upload/{upload_id}")
+@instrument()
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    """写入一个分块：请求体为原始字节，offset必须等于当前已接收的字节数"""
+    session = get_upload_session(upload_id)
+    async with CHUNKED_UPLOADS.write_lock(upload_id):
+        current = CHUNKED_UPLOADS.offset(upload_id)
+        if offset != current:
+            raise HTTPException(status_code=409, detail={"message": "偏移量不匹配", "offset": current})
+        hasher = await asyncio.to_thread(CHUNKED_UPLOADS.hasher, upload_id)
+        try:
+            with open(session["partial"], "r+b") as f:
+                f.seek(offset)
+                async for chunk in request.stream():
+                    if current + len(chunk) > session["size"]:
+                        raise HTTPException(status_code=413, detail="数据超出声明的文件大小")
+                    await asyncio.to_thread(CHUNKED_UPLOADS.write, f, hasher, chunk)
+                    METRICS.add_io(written=len(chunk), name="upload_chunk")
+                    current += len(chunk)
+        except HTTPException:
+            raise  # 超出大小的分块没有写入，文件与哈希仍一致
+        except BaseException:
+            # 写入出错或请求被取消：无法确定最后一块是否已写入，按文件内容重建哈希，续传位置也以文件为准
+            CHUNKED_UPLOADS.reset_hasher(upload_id)
+            raise
+    return {"upload_id": upload_id, "offset": current}
+
+
+@api_app.post("/api/upload/{upload_id}/complete")
+async def complete_upload(upload_id: str):
+    """校验并完成上传"""
+    get_upload_session(upload_id)
+    async with CHUNKED_UPLOADS.write_lock(upload_id):
+        try:
+            dest, digest = await asyncio.to_thread(CHUNKED_UPLOADS.complete, upload_id)
+        except DuplicateContent as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return {"path": dest, "sha256": digest}
+
+
+@api_app.delete("/api/upload/{upload_id}")
+async def abort_upload(upload_id: str):
+    """取消上传"""
+    get_upload_session(upload_id)
+    CHUNKED_UPLOADS.abort(upload_id)
+    return {"upload_id": upload_id, "aborted": True}
+
+
+# 批量接口：不经过界面，每批操作整批写入文件索引并返回一个汇总结果
+BATCH_LIST_LIMIT = 1000  # 列表接口每页最多返回的文件数
+
+
+def batch_paths(payload):
+    """批量操作的目标文件：paths中的路径（须是存储位置下的视频文件，不含上传和处理中的.partial），加上按query
+    （搜索语法）或glob（文件名通配符）在索引中查到的文件；side限定input或output。返回(路径列表, 被拒绝的路径)"""
+    roots = set(change_roots(payload.get("side") or ""))
+    paths, rejected = [], []
+    for path in payload.get("paths") or []:
+        path = path if is_remote(path) else os.path.normpath(path)
+        name = os.path.basename(path).lower()
+        valid = os.path.dirname(path) in roots and name.endswith(VIDEO_EXTENSIONS) and not name.endswith(".partial")
+        (paths if valid else rejected).append(path)
+    terms = [payload.get("query") or ""]
+    if payload.get("glob"):
+        terms.append(shlex.quote(payload["glob"]))
+    if any(t.strip() for t in terms):
+        if payload.get("side"):
+            terms.append(f"in:{payload['side']}")
+        try:
+            results = search_files(" ".join(terms))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        seen = set(paths)
+        paths += [p for d, names in results.items() for p in (os.path.join(d, n) for n in names) if p not in seen]
+    return paths, rejected
+
+
+def file_record(directory, name, entry):
+    """列表接口中的一个文件"""
+    path = os.path.join(directory, name)
+    info = METADATA.get(path, entry[0], entry[1]) or {}
+    return {"path": path, "name": name, "source": ROOT_LABELS.get(directory, directory),
+            "size": entry[0], "mtime": entry[1], **{field: info.get(field) for field in MEDIA_FIELDS}}
+
+
+def encode_cursor(key, roots):
+    """把(排序值, 文件名, 目录序号)编码为不透明的游标字符串（目录用来源名称表示，存储位置增加后仍有效）"""
+    value, name, d = key
+    raw = json.dumps([value, name, ROOT_LABELS.get(roots[d], roots[d])], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, roots):
+    try:
+        value, name, label = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return value, name, roots.index(ROOTS_BY_LABEL.get(label, label))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="游标无效")
+
+
+@api_app.get("/api/files")
+def batch_list(side: str = "input", sort: str = "name", descending: bool = False, filter: str = "",
+               cursor: str = "", limit: int = 100):
+    """按游标分页列出input或output（全部存储位置合并）的文件，只读索引；返回next_cursor直到最后一页"""
+    if side not in ("input", "output") or sort not in {value for _, value in SORT_OPTIONS}:
+        raise HTTPException(status_code=400, detail="side或sort无效")
+    roots = list(panel_roots(side == "input"))
+    scan_roots(roots)
+    limit = max(1, min(limit, BATCH_LIST_LIMIT))
+    key = decode_cursor(cursor, roots) if cursor else None
+    items, last, total = FILE_INDEX.page_after(roots, sort, filter, key, limit, descending)
+    with FILE_INDEX.lock:
+        tables = {d: FILE_INDEX.entries(roots[d]) for d in {d for d, _ in items}}
+        files = [file_record(roots[d], n, tables[d][n]) for d, n in items if n in tables[d]]
+    return {"files": files, "total": total, "seq": FILE_INDEX.durable_seq(),
+            "next_cursor": encode_cursor(last, roots) if last and len(items) == limit else None}
+
+
+@api_app.post("/api/batch/upload")
+def batch_upload(files: list[UploadFile] = File(...)):
+    """一次上传多个文件到input目录（multipart字段files），去重和改名规则与界面上传相同"""
+    staging = tempfile.mkdtemp(prefix="batch-", dir=CACHE_DIR)  # 与input目录通常在同一文件系统，可以硬链接
+    try:
+        src_paths, rejected = [], []
+        for upload in files:
+            name = os.path.basename(upload.filename or "")
+            if not name or name.startswith(".") or not name.lower().endswith(VIDEO_EXTENSIONS) \
+                    or os.path.exists(os.path.join(staging, name)):
+                rejected.append(upload.filename)
+                continue
+            with open(os.path.join(staging, name), "wb") as f:
+                shutil.copyfileobj(upload.file, f, STREAM_CHUNK_SIZE)
+            src_paths.append(os.path.join(staging, name))
+        results = ingest_files(src_paths)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    methods = upload_summary(results)
+    log_info(f"批量接口上传 {len(results)} 个文件，拒绝 {len(rejected)} 个")
+    return {"uploaded": [{"path": dest, "method": method} for dest, method in results],
+            "rejected": rejected, "methods": methods, "seq": FILE_INDEX.durable_seq()}
+
+
+@api_app.post("/api/batch/delete")
+def batch_delete(payload: dict):
+    """按路径列表、glob或搜索语法批量删除：{"paths": [...], "glob": "*.mkv", "query": "size>2GB", "side": "output"}"""
+    paths, rejected = batch_paths(payload)
+    started = time.time()
+    failures = remove_files(paths)
+    log_info(f"批量接口删除完成，成功 {len(paths) - len(failures)} 个，失败 {len(failures)} 个，"
+             f"耗时 {time.time() - started:.2f} 秒")
+    return {"requested": len(paths), "deleted": len(paths) - len(failures),
+            "failed": [{"path": path, "error": error} for path, error in failures],
+            "rejected": rejected, "seq": FILE_INDEX.durable_seq()}
+
+
+@api_app.post("/api/batch/archive")
+def batch_archive(payload: dict):
+    """把路径列表或查询结果打包：返回压缩包的下载地址（"stream": true时返回流式下载地址，不生成文件）"""
+    paths, rejected = batch_paths(payload)
+    if not paths:
+        raise HTTPException(status_code=404, detail="没有匹配的文件")
+    if payload.get("stream"):
+        url, _ = register_stream_download(paths)
+        return {"files": len(paths), "url": url, "rejected": rejected}
+    zip_path, message = download_files(paths)
+    if zip_path is None:
+        raise HTTPException(status_code=500, detail=message)
+    url = "/api/downloads/" + "/".join(quote(part) for part in os.path.relpath(zip_path, DOWNLOAD_DIR).split(os.sep))
+    return {"files": len(paths), "url": url, "size": os.path.getsize(zip_path), "rejected": rejected}
+
+
+@api_app.get("/api/downloads/{key}/{filename}")
+def get_archive(key: str, filename: str):
+    """下载批量接口生成的压缩包"""
+    path = os.path.join(DOWNLOAD_DIR, key, filename)
+    if not re.fullmatch(r"[0-9a-f]{16}", key) or filename != os.path.basename(filename) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="压缩包不存在")
+    return FileResponse(path, media_type="application/zip", filename=filename)
+
+
+class RangeFileResponse(Response):
+    """支持单段Range请求的文件响应：服务器提供zerocopysend扩展时零拷贝发送，否则用pread分块发送"""
+
+    def __init__(self, path, start, end, status_code, headers, send_body=True):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.start = start
+        self.end = end  # 不包含
+        self.send_body = send_body
+
+    @instrument("preview_stream")
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.end <= self.start:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": fd,
+                            "offset": self.start, "count": self.end - self.start})
+                METRICS.add_io(read=self.end - self.start, name="preview_stream")
+                return
+            offset = self.start
+            while offset < self.end:
+                chunk = await asyncio.to_thread(os.pread, fd, min(STREAM_CHUNK_SIZE, self.end - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                METRICS.add_io(read=len(chunk), name="preview_stream")
+                await send({"type": "http.response.body", "body": chunk, "more_body": offset < self.end})
+            if offset < self.end:
+                # 文件在发送过程中被截断
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(fd)
+
+
+def parse_range(header, size):
+    """解析单段Range头，返回(start, end)，end不包含；无法满足时返回None"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # 后缀范围：最后N个字节
+        length = min(int(last), size)
+        return (size - length, size) if length else None
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size or end <= start:
+        return None
+    return start, end
+
+
+@api_app.api_route("/preview/{root}/{filename}", methods=["GET", "HEAD"])
+def preview_stream(root: str, filename: str, request: Request):
+    """视频预览：支持Range请求和条件请求，直接从输入/输出目录读取"""
+    directory = PREVIEW_ROOTS.get(root)
+    if directory is None or filename != os.path.basename(filename) or filename.startswith(".") \
+            or not filename.lower().endswith(VIDEO_EXTENSIONS):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    path = os.path.join(directory, filename)
+    real_dir = os.path.realpath(directory)
+    if os.path.dirname(os.path.realpath(path)) != real_dir:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    try:
+        st = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    media_type = "video/webm" if filename.lower().endswith(".webm") else "video/mp4"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if not if_none_match and request.headers.get("if-modified-since"):
+        try:
+            if int(st.st_mtime) <= parsedate_to_datetime(request.headers["if-modified-since"]).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    size = st.st_size
+    start, end, status_code = 0, size, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range与当前版本不一致时忽略Range，返回完整文件
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["Content-Length"] = str(end - start)
+    headers["Content-Type"] = media_type
+    return RangeFileResponse(path, start, end, status_code, headers, send_body=request.method != "HEAD")
+
+
+# 代理节点接口：主界面汇总多台机器时调用（文件内容通过上面的/preview接口按Range读取）
+AGENT_INSTANCE = secrets.token_hex(4)  # 进程标识，节点重启后旧的ETag不会误判为未变化
+
+
+def check_agent_token(request):
+    """配置了WEBUI_AGENT_TOKEN时校验请求携带的令牌"""
+    if AGENT_TOKEN and not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {AGENT_TOKEN}"):
+        raise HTTPException(status_code=401, detail="令牌无效")
+
+
+if SERVER_MODE == "agent":
+    @api_app.middleware("http")
+    async def require_agent_token(request: Request, call_next):
+        """代理节点模式下所有接口（预览、上传、批量、变更等）都校验令牌，而不只是/agent/*"""
+        try:
+            check_agent_token(request)
+        except HTTPException as e:
+            return JSONResponse({"detail": e.detail}, status_code=e.status_code)
+        return await call_next(request)
+
+
+@api_app.get("/agent/files")
+def agent_files(request: Request):
+    """代理节点接口：本机各存储位置的文件列表（按列）及元数据；内容未变化时返回304"""
+    check_agent_token(request)
+    roots = local_roots()
+    scan_roots(roots)
+    etag = f'"{AGENT_INSTANCE}-{"-".join(str(FILE_INDEX.version(d)) for d in roots)}-{METADATA.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    data = []
+    with FILE_INDEX.lock:
+        for directory in roots:
+            table = FILE_INDEX.entries(directory)
+            media = []
+            for name, size, mtime in zip(table.names, table.sizes, table.mtimes):
+                info = METADATA.get(os.path.join(directory, name), size, mtime)
+                media.append([info.get(field) for field in MEDIA_FIELDS] if info else None)
+            data.append({"key": ROOT_KEYS[directory], "label": ROOT_LABELS[directory],
+                         "side": "input" if directory in INPUT_ROOTS else "output",
+                         "files": table.to_columns(), "media": media})
+    return Response(json.dumps({"roots": data}, ensure_ascii=False), media_type="application/json",
+                    headers={"ETag": etag})
+
+
+@api_app.delete("/agent/files/{root}/{filename}")
+def agent_delete(root: str, filename: str, request: Request):
+    """代理节点接口：删除存储位置中的一个文件"""
+    check_agent_token(request)
+    directory = PREVIEW_ROOTS.get(root) if root != "proxy" else None
+    if directory is None or filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    error = remove_file(os.path.join(directory, filename))
+    if error == "文件不存在":
+        raise HTTPException(status_code=404, detail=error)
+    if error:
+        raise HTTPException(status_code=500, detail=error)
+    FILE_INDEX.apply_event(directory, filename)
+    log_summary("agent-delete", f"代理节点接口删除文件: {os.path.join(directory, filename)}")
+    return {"deleted": filename}
+
+
+# 转发预览请求时透传的请求头和响应头
+REMOTE_REQUEST_HEADERS = ("range", "if-range", "if-none-match", "if-modified-since")
+REMOTE_RESPONSE_HEADERS = ("content-type", "content-length", "content-range", "accept-ranges",
+                           "etag", "last-modified", "cache-control")
+
+
+@api_app.api_route("/remote/{agent}/{root}/{filename}", methods=["GET", "HEAD"])
+def remote_preview(agent: str, root: str, filename: str, request: Request):
+    """预览代理节点上的文件：透传Range和条件请求头，经连接池流式转发节点的响应"""
+    path = f"{REMOTE_PREFIX}{agent}/{root}/{filename}"
+    try:
+        url = REMOTE.url(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    headers = {k: request.headers[k] for k in REMOTE_REQUEST_HEADERS if k in request.headers}
+    try:
+        upstream = REMOTE.client.send(REMOTE.client.build_request(request.method, url, headers=headers), stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"代理节点不可用: {e}")
+    return StreamingResponse(upstream.iter_raw(), status_code=upstream.status_code,
+                             headers={k: upstream.headers[k] for k in REMOTE_RESPONSE_HEADERS if k in upstream.headers},
+                             background=BackgroundTask(upstream.close))
+
+
+@api_app.get("/thumbnails/{filename}")
+def get_thumbnail(filename: str):
+    """返回缓存的缩略图"""
+    if not re.fullmatch(r"[0-9a-f]{40}\.jpg", filename):
+        raise HTTPException(status_code=404, detail="缩略图不存在")
+    path = os.path.join(THUMB_DIR, filename)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="缩略图不存在")
+    # 缓存键包含文件大小和修改时间，内容不会变化，可以长期缓存
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+@api_app.get("/metrics")
+def metrics():
+    """Prometheus文本格式的调用统计和当前状态"""
+    lines = ["# HELP webui_index_files 索引中的视频文件数", "# TYPE webui_index_files gauge"]
+    for directory in INPUT_ROOTS + OUTPUT_ROOTS:
+        lines.append(f'webui_index_files{{directory="{directory}"}} {len(FILE_INDEX.entries(directory))}')
+    lines += ["# HELP webui_device_pools 按磁盘划分的线程池数", "# TYPE webui_device_pools gauge"]
+    for pools in (SCAN_POOLS, HASHES.pool, ARCHIVE_POOLS):
+        lines.append(f'webui_device_pools{{kind="{pools.name}"}} {pools.count()}')
+    lines += ["# HELP webui_agent_up 代理节点是否可用", "# TYPE webui_agent_up gauge"]
+    for name, up in REMOTE.status().items():
+        lines.append(f'webui_agent_up{{agent="{name}"}} {int(bool(up))}')
+    lines += ["# HELP webui_jobs 处理任务数", "# TYPE webui_jobs gauge"]
+    with JOBS.lock:
+        statuses = [job["status"] for job in JOBS.jobs.values()]
+    for status in JobScheduler.STATUS_LABELS:
+        lines.append(f'webui_jobs{{status="{status}"}} {statuses.count(status)}')
+    lines += ["# HELP webui_thumbnail_queue 等待生成的缩略图数", "# TYPE webui_thumbnail_queue gauge",
+              f"webui_thumbnail_queue {len(THUMBNAILS.queued)}"]
+    return PlainTextResponse(METRICS.render() + "\n".join(lines) + "\n",
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# 创建Gradio界面（代理节点模式下不构建）
+def build_ui():
+    """构建界面并为全部事件处理函数加上调用统计"""
+    with gr.Blocks(title="视频文件管理预览系统") as demo:
+        gr.Markdown("## 🎥 视频文件管理预览系统")
+        gr.Markdown("上传视频到input目录，处理后的视频保存到output目录")
+
+        # 选中的文件保存在服务端SELECTIONS中，这里只存版本号，用于触发依赖选中状态的更新
+        input_selection_version = gr.State(0)
+        output_selection_version = gr.State(0)
+
+        with gr.Row():
+            with gr.Column():
+                gr.Markdown("### 📤 Input文件夹")
+                # 初始值只来自索引快照，页面加载后再由on_page_load刷新
+                initial_input, initial_output = initial_page(INPUT_ROOTS), initial_page(OUTPUT_ROOTS)
+                # 页面上表格对应的索引版本号，用于判断是否需要推送变更
+                input_version = gr.State(table_version(INPUT_ROOTS))
+                output_version = gr.State(table_version(OUTPUT_ROOTS))
+
+                input_view = gr.State(dict(DEFAULT_VIEW))
+                with gr.Row():
+                    input_filter = gr.Textbox(label="文件名过滤", placeholder="输入关键字后回车", scale=3)
+                    input_sort = gr.Dropdown(choices=SORT_OPTIONS, value=DEFAULT_VIEW["sort"], label="排序", scale=2)
+                    input_descending = gr.Checkbox(value=DEFAULT_VIEW["descending"], label="降序", scale=1)
+                    input_page_size = gr.Dropdown(choices=PAGE_SIZES, value=DEFAULT_VIEW["page_size"], label="每页", scale=1)
+
+                input_files = gr.DataFrame(
+                    headers=TABLE_HEADERS,
+                    datatype=TABLE_DATATYPES,
+                    interactive=True,
+                    type="array",
+                    value=initial_input["value"],  # 设置初始值（仅第一页）
+                    label=initial_input["label"]
+                )
+
+                with gr.Row():
+                    input_prev_btn = gr.Button("◀ 上一页", size="sm")
+                    input_page_num = gr.Number(value=1, label="页码", precision=0, minimum=1)
+                    input_next_btn = gr.Button("下一页 ▶", size="sm")
+
+                with gr.Row():
+                    # 移除全选复选框，改为全选按钮
+                    select_all_input_btn = gr.Button("✅ 全选", size="sm")
+                    clear_selection_input_btn = gr.Button("⭕ 清空选择", size="sm")
+                    refresh_input_btn = gr.Button("🔄 刷新", size="sm")
+                    upload_btn = gr.UploadButton("⬆️ 上传视频", file_types=["video"], file_count="multiple", size="sm")
+                with gr.Row():
+                    with gr.Column(scale=1):
+                        gr.Markdown("**已选中文件:**")
+                        input_selected_count = gr.Textbox("0", label="数量")
+                        input_selected_display = gr.Textbox("暂无选中文件", label="文件列表", lines=4, interactive=False)
+
+                with gr.Row():
+                    download_selected_input = gr.Button("📥 下载选中文件", size="sm")
+                    delete_selected_input = gr.Button("🗑️ 删除选中文件", variant="stop", size="sm")
+                    clear_input_btn = gr.Button("🧹 清空文件夹", variant="stop", size="sm")
+                    download_all_input = gr.Button("📦 下载全部", size="sm")
+
+            with gr.Column():
+                gr.Markdown("### 📥 Output文件夹")
+                output_view = gr.State(dict(DEFAULT_VIEW))
+                with gr.Row():
+                    output_filter = gr.Textbox(label="文件名过滤", placeholder="输入关键字后回车", scale=3)
+                    output_sort = gr.Dropdown(choices=SORT_OPTIONS, value=DEFAULT_VIEW["sort"], label="排序", scale=2)
+                    output_descending = gr.Checkbox(value=DEFAULT_VIEW["descending"], label="降序", scale=1)
+                    output_page_size = gr.Dropdown(choices=PAGE_SIZES, value=DEFAULT_VIEW["page_size"], label="每页", scale=1)
+
+                output_files = gr.DataFrame(
+                    headers=TABLE_HEADERS,
+                    datatype=TABLE_DATATYPES,
+                    interactive=True,
+                    type="array",
+                    value=initial_output["value"],  # 设置初始值（仅第一页）
+                    label=initial_output["label"]
+                )
+
+                with gr.Row():
+                    output_prev_btn = gr.Button("◀ 上一页", size="sm")
+                    output_page_num = gr.Number(value=1, label="页码", precision=0, minimum=1)
+                    output_next_btn = gr.Button("下一页 ▶", size="sm")
+
+                with gr.Row():
+                    # 移除全选复选框，改为全选按钮
+                    select_all_output_btn = gr.Button("✅ 全选", size="sm")
+                    clear_selection_output_btn = gr.Button("⭕ 清空选择", size="sm")
+                    refresh_output_btn = gr.Button("🔄 刷新", size="sm")
+
+                with gr.Row():
+                    with gr.Column(scale=1):
+                        gr.Markdown("**已选中文件:**")
+                        output_selected_count = gr.Textbox("0", label="数量")
+                        output_selected_display = gr.Textbox("暂无选中文件", label="文件列表", lines=4, interactive=False)
+
+                with gr.Row():
+                    download_selected_output = gr.Button("📥 下载选中文件", size="sm")
+                    delete_selected_output = gr.Button("🗑️ 删除选中文件", variant="stop", size="sm")
+                    clear_output_btn = gr.Button("🧹 清空文件夹", variant="stop", size="sm")
+                    download_all_output = gr.Button("📦 下载全部", size="sm")
+
+        with gr.Row():
+            with gr.Column():
+                gr.Markdown("### 🔍 搜索")
+                with gr.Row():
+                    search_box = gr.Textbox(label="搜索Input和Output文件夹", scale=4,
+                                            placeholder="例如: *.mkv size>2GB age<1w（支持子串、通配符、size/age/mtime范围、in:input）")
+                    search_btn = gr.Button("🔍 搜索", variant="primary", scale=1)
+                search_info = gr.Markdown()
+                search_results = gr.DataFrame(headers=["来源", "文件名", "大小", "修改时间", "重复"],
+                                              interactive=False, label=f"搜索结果（最多显示{SEARCH_DISPLAY_LIMIT}个）")
+                with gr.Row():
+                    select_search_btn = gr.Button("✅ 选中全部结果", size="sm")
+                    download_search_btn = gr.Button("📥 下载全部结果", size="sm")
+                    delete_search_btn = gr.Button("🗑️ 删除全部结果", variant="stop", size="sm")
+
+        with gr.Row():
+            with gr.Column(scale=1):
+                gr.Markdown("### 📺 视频预览")
+                # 添加下拉框用于选择预览视频
+                preview_selector = gr.Dropdown(choices=[], label="选择预览视频", interactive=True)
+                # 通过/preview接口播放，支持拖动进度条，不经过Gradio的文件缓存
+                video_preview = gr.HTML()
+
+                with gr.Row():
+                    preview_btn = gr.Button("👁️ 预览选中视频")
+                    clear_preview_btn = gr.Button("🧹 清除预览", size="sm")
+
+                # 添加预览下拉框到状态管理
+                selected_preview_file = gr.State(None)
+                # 下载组件
+                download_comp = gr.File(label="下载文件")  # 已有下载在页面加载时列出
+                # 流式下载：直接从源文件打包发送，不在downloads目录生成压缩包
+                stream_download_mode = gr.Checkbox(value=True, label="流式下载（不生成临时压缩包）")
+                download_link = gr.Markdown()
+                download_cache_info = gr.Markdown(ARCHIVE_CACHE.summary())
+
+                # 添加清除下载按钮
+                with gr.Row():
+                    clear_downloads_btn = gr.Button("🗑️ 清除所有下载文件", size="sm", variant="stop")
+
+            with gr.Column(scale=1):
+                gr.Markdown("### ⚙️ 处理任务")
+                with gr.Row():
+                    job_processor = gr.Dropdown(choices=[(label, name) for name, (label, _, _) in PROCESSORS.items()],
+                                                value=next(iter(PROCESSORS)), label="处理器", scale=2)
+                    job_priority = gr.Dropdown(choices=JOB_PRIORITIES, value=1, label="优先级", scale=1)
+                process_btn = gr.Button("▶️ 处理选中的Input文件", variant="primary")
+                job_table = gr.DataFrame(headers=["任务ID", "文件", "处理器", "状态", "进度", "信息"],
+                                         value=JOBS.rows(), interactive=False, label="最近的任务")
+                with gr.Row():
+                    cancel_job_ids = gr.Textbox(label="任务ID", placeholder="多个用逗号分隔，留空取消全部未结束任务", scale=3)
+                    cancel_job_btn = gr.Button("⏹ 取消任务", size="sm", variant="stop", scale=1)
+                    refresh_jobs_btn = gr.Button("🔄 刷新任务", size="sm", scale=1)
+
+        # 状态区域
+        status = gr.Textbox(label="操作状态", interactive=False)
+
+        # 删除之前的初始化调用（已移到组件创建时）
+        # initial_input, initial_output, _, _ = full_refresh()
+
+
+        # 绑定事件 - 只选择状态更新（用户勾选时只发送当前页，并只更新对应面板）
+        def on_input_select(df, request: gr.Request):
+            return update_selections(df, True, session_id(request))
+
+        def on_output_select(df, request: gr.Request):
+            return update_selections(df, False, session_id(request))
+
+        input_files.input(
+            fn=on_input_select,
+            inputs=input_files,
+            outputs=[input_selection_version, input_selected_count, input_selected_display],
+            show_progress="hidden"
+        )
+
+        output_files.input(
+            fn=on_output_select,
+            inputs=output_files,
+            outputs=[output_selection_version, output_selected_count, output_selected_display],
+            show_progress="hidden"
+        )
+
+        # 更新预览选择器选项当选择状态变化时
+        def on_selection_change(request: gr.Request):
+            return update_preview_selector(session_id(request))
+
+        input_selection_version.change(fn=on_selection_change, outputs=preview_selector)
+        output_selection_version.change(fn=on_selection_change, outputs=preview_selector)
+
+        # 页面加载时等待启动复核完成，再刷新表格和下载列表（异步等待，不占用队列的工作线程）
+        async def on_page_load(input_view, output_view, request: gr.Request):
+            while not INDEX_READY.is_set():
+                await asyncio.sleep(0.2)
+            session = session_id(request)
+
+            def load():
+                tables = poll_file_changes(None, None, input_view, output_view, session)
+                return (*tables, list_downloads(), ARCHIVE_CACHE.summary())
+            return await asyncio.to_thread(load)
+
+        demo.load(
+            fn=on_page_load,
+            inputs=[input_view, output_view],
+            outputs=[input_files, output_files, input_version, output_version, download_comp, download_cache_info],
+            show_progress="hidden"
+        )
+
+        # 会话关闭时释放选中状态
+        def on_unload(request: gr.Request):
+            SELECTIONS.drop(session_id(request))
+
+        demo.unload(on_unload)
+
+        # 当预览选择器变更时自动预览选中的视频
+        preview_selector.change(
+            fn=preview_file,
+            inputs=preview_selector,
+            outputs=video_preview
+        )
+
+        # 刷新功能 - 仅刷新文件列表
+        def on_refresh_input(input_version, output_version, input_view, output_view, request: gr.Request):
+            log_info("点击刷新Input文件夹")
+            return refresh_files_only(input_version, output_version, input_view, output_view, session_id(request))
+
+        def on_refresh_output(input_version, output_version, input_view, output_view, request: gr.Request):
+            log_info("点击刷新Output文件夹")
+            return refresh_files_only(input_version, output_version, input_view, output_view, session_id(request))
+
+        refresh_input_btn.click(
+            fn=on_refresh_input,
+            inputs=[input_version, output_version, input_view, output_view],
+            outputs=[input_files, output_files, input_version, output_version]
+        )
+
+        refresh_output_btn.click(
+            fn=on_refresh_output,
+            inputs=[input_version, output_version, input_view, output_view],
+            outputs=[input_files, output_files, input_version, output_version]
+        )
+
+        # 分页、排序和过滤 - 只在服务端计算，页面只接收当前页
+        for directory, view, table, filter_box, sort_box, descending_box, page_size_box, page_num, prev_btn, next_btn in (
+            (INPUT_ROOTS, input_view, input_files, input_filter, input_sort,
+             input_descending, input_page_size, input_page_num, input_prev_btn, input_next_btn),
+            (OUTPUT_ROOTS, output_view, output_files, output_filter, output_sort,
+             output_descending, output_page_size, output_page_num, output_prev_btn, output_next_btn),
+        ):
+            def make_view_handler(directory, **fixed):
+                """生成修改视图的事件处理函数，value为对应控件的当前值"""
+                def handler(v, value=None, request: gr.Request = None):
+                    changes = {k: (f(v, value) if callable(f) else value) for k, f in fixed.items()}
+                    return change_view(v, directory, session_id(request), **changes)
+                return handler
+
+            view_outputs = [view, table, page_num]
+            filter_box.submit(fn=make_view_handler(directory, filter=None),
+                              inputs=[view, filter_box], outputs=view_outputs)
+            sort_box.change(fn=make_view_handler(directory, sort=None),
+                            inputs=[view, sort_box], outputs=view_outputs)
+            descending_box.change(fn=make_view_handler(directory, descending=None),
+                                  inputs=[view, descending_box], outputs=view_outputs)
+            page_size_box.change(fn=make_view_handler(directory, page_size=lambda v, size: int(size)),
+                                 inputs=[view, page_size_box], outputs=view_outputs)
+            page_num.submit(fn=make_view_handler(directory, page=lambda v, num: int(num or 1)),
+                            inputs=[view, page_num], outputs=view_outputs)
+            prev_btn.click(fn=make_view_handler(directory, page=lambda v, _: v["page"] - 1),
+                           inputs=[view], outputs=view_outputs)
+            next_btn.click(fn=make_view_handler(directory, page=lambda v, _: v["page"] + 1),
+                           inputs=[view], outputs=view_outputs)
+
+        # 定时推送监听器发现的变更（无变化时不发送任何表格数据）
+        if WATCHER.mode != "off":
+            def on_timer_tick(input_version, output_version, input_view, output_view, request: gr.Request):
+                return poll_file_changes(input_version, output_version, input_view, output_view, session_id(request))
+
+            change_timer = gr.Timer(WATCH_PUSH_INTERVAL)
+            change_timer.tick(
+                fn=on_timer_tick,
+                inputs=[input_version, output_version, input_view, output_view],
+                outputs=[input_files, output_files, input_version, output_version],
+                show_progress="hidden"
+            )
+
+        # 上传/删除后完全刷新时需要更新的组件
+        refresh_outputs = [
+            input_files, output_files,
+            input_selection_version, output_selection_version,
+            input_selected_count, input_selected_display,
+            output_selected_count, output_selected_display,
+            input_version, output_version
+        ]
+
+        # 上传功能 - 完全刷新
+        def on_upload(files, input_view, output_view, request: gr.Request):
+            return upload_file(files, input_view, output_view, session_id(request))
+
+        upload_btn.upload(
+            fn=on_upload,
+            inputs=[upload_btn, input_view, output_view],
+            outputs=refresh_outputs
+        )
+
+        # 预览功能 - 支持从下拉框选择或默认选择第一个
+        def on_preview(selected_preview, request: gr.Request):
+            session = session_id(request)
+            candidates = (os.path.join(d, n) for d in INPUT_ROOTS + OUTPUT_ROOTS for n in SELECTIONS.head(session, d, 1)[1])
+            return preview_file(selected_preview if selected_preview else next(candidates, None))
+
+        preview_btn.click(
+            fn=on_preview,
+            inputs=preview_selector,
+            outputs=video_preview
+        )
+
+        clear_preview_btn.click(
+            fn=lambda: [log_info("清除视频预览"), ""][1],
+            outputs=video_preview
+        )
+
+        # 删除功能 - 选中文件
+        def on_delete_input(input_view, output_view, request: gr.Request, progress=gr.Progress()):
+            session = session_id(request)
+            return delete_files(get_selected_paths(session, True), input_view, output_view, session, progress)
+
+        def on_delete_output(input_view, output_view, request: gr.Request, progress=gr.Progress()):
+            session = session_id(request)
+            return delete_files(get_selected_paths(session, False), input_view, output_view, session, progress)
+
+        delete_selected_input.click(
+            fn=on_delete_input,
+            inputs=[input_view, output_view],
+            outputs=refresh_outputs
+        )
+
+        delete_selected_output.click(
+            fn=on_delete_output,
+            inputs=[input_view, output_view],
+            outputs=refresh_outputs
+        )
+
+        # 下载功能 - 选中文件
+        def download_and_refresh(file_paths, streaming=False):
+            if streaming:
+                link, msg = stream_download_files(file_paths)
+                return gr.update(), msg, link, gr.update()
+            zip_path, msg = download_files(file_paths)
+            return list_downloads(), msg, "", ARCHIVE_CACHE.summary()
+
+        def on_download_input(streaming, request: gr.Request):
+            return download_and_refresh(get_selected_paths(session_id(request), True), streaming)
+
+        def on_download_output(streaming, request: gr.Request):
+            return download_and_refresh(get_selected_paths(session_id(request), False), streaming)
+
+        download_selected_input.click(
+            fn=on_download_input,
+            inputs=stream_download_mode,
+            outputs=[download_comp, status, download_link, download_cache_info]
+        )
+
+        download_selected_output.click(
+            fn=on_download_output,
+            inputs=stream_download_mode,
+            outputs=[download_comp, status, download_link, download_cache_info]
+        )
+
+        # 下载全部文件
+        download_all_input.click(
+            fn=lambda streaming: download_and_refresh(list_video_paths(INPUT_ROOTS), streaming),
+            inputs=stream_download_mode,
+            outputs=[download_comp, status, download_link, download_cache_info]
+        )
+
+        download_all_output.click(
+            fn=lambda streaming: download_and_refresh(list_video_paths(OUTPUT_ROOTS), streaming),
+            inputs=stream_download_mode,
+            outputs=[download_comp, status, download_link, download_cache_info]
+        )
+
+        # 清空文件夹
+        def on_clear_input(input_view, output_view, request: gr.Request, progress=gr.Progress()):
+            log_info("清空Input文件夹")
+            return clear_folder(INPUT_ROOTS, input_view, output_view, session_id(request), progress)
+
+        def on_clear_output(input_view, output_view, request: gr.Request, progress=gr.Progress()):
+            log_info("清空Output文件夹")
+            return clear_folder(OUTPUT_ROOTS, input_view, output_view, session_id(request), progress)
+
+        clear_input_btn.click(
+            fn=on_clear_input,
+            inputs=[input_view, output_view],
+            outputs=refresh_outputs
+        )
+
+        clear_output_btn.click(
+            fn=on_clear_output,
+            inputs=[input_view, output_view],
+            outputs=refresh_outputs
+        )
+
+        # 处理任务：生成器持续把进度推送到状态框，输出文件完成后直接进入output索引
+        def on_process(processor, priority, request: gr.Request):
+            paths = get_selected_paths(session_id(request), True)
+            if any(map(is_remote, paths)):
+                # 处理任务在本机运行，代理节点上的文件需在该节点的界面中处理
+                paths = [p for p in paths if not is_remote(p)]
+                if not paths:
+                    yield "代理节点上的文件不能在本机处理，请在该节点上处理", JOBS.rows()
+                    return
+            if not paths:
+                yield "请先在Input文件夹中选择要处理的文件", JOBS.rows()
+                return
+            job_ids = JOBS.submit(paths, processor, int(priority))
+            while True:
+                text, finished = JOBS.summary(job_ids)
+                yield text, JOBS.rows()
+                if finished:
+                    break
+                time.sleep(0.5)
+
+        process_btn.click(
+            fn=on_process,
+            inputs=[job_processor, job_priority],
+            outputs=[status, job_table]
+        )
+
+        def on_cancel_jobs(job_ids):
+            ids = [i.strip() for i in job_ids.split(",") if i.strip()] or JOBS.active_ids()
+            cancelled = [i for i in ids if JOBS.cancel(i)]
+            return f"已取消 {len(cancelled)} 个任务", JOBS.rows()
+
+        cancel_job_btn.click(
+            fn=on_cancel_jobs,
+            inputs=cancel_job_ids,
+            outputs=[status, job_table]
+        )
+
+        refresh_jobs_btn.click(
+            fn=lambda: JOBS.rows(),
+            outputs=job_table
+        )
+
+        # 绑定清除下载事件
+        clear_downloads_btn.click(
+            fn=clear_downloads,
+            outputs=[status, download_comp, download_cache_info]  # 更新状态、下载组件和缓存统计
+        )
+
+        # 全选/清空选择 - 直接替换服务端选中集合，只重新渲染当前页
+        def on_select_all_input(view, request: gr.Request):
+            return select_all_files(True, view, session_id(request))
+
+        def on_select_all_output(view, request: gr.Request):
+            return select_all_files(False, view, session_id(request))
+
+        def on_clear_selection_input(view, request: gr.Request):
+            return clear_selection_files(True, view, session_id(request))
+
+        def on_clear_selection_output(view, request: gr.Request):
+            return clear_selection_files(False, view, session_id(request))
+
+        # 全选按钮功能 - Input文件夹
+        select_all_input_btn.click(
+            fn=on_select_all_input,
+            inputs=input_view,
+            outputs=[
+                input_selection_version,
+                input_selected_count,
+                input_selected_display,
+                input_files
+            ]
+        )
+
+        # 全选按钮功能 - Output文件夹
+        select_all_output_btn.click(
+            fn=on_select_all_output,
+            inputs=output_view,
+            outputs=[
+                output_selection_version,
+                output_selected_count,
+                output_selected_display,
+                output_files
+            ]
+        )
+
+        # 清空选择按钮功能 - Input文件夹
+        clear_selection_input_btn.click(
+            fn=on_clear_selection_input,
+            inputs=input_view,
+            outputs=[
+                input_selection_version,
+                input_selected_count,
+                input_selected_display,
+                input_files
+            ]
+        )
+
+        # 清空选择按钮功能 - Output文件夹
+        clear_selection_output_btn.click(
+            fn=on_clear_selection_output,
+            inputs=output_view,
+            outputs=[
+                output_selection_version,
+                output_selected_count,
+                output_selected_display,
+                output_files
+            ]
+        )
+
+        # 搜索 - 选中、下载、删除都在服务端重新执行查询，作用于全部结果而不只是表格中显示的部分
+        search_box.submit(fn=run_search, inputs=search_box, outputs=[search_results, search_info])
+        search_btn.click(fn=run_search, inputs=search_box, outputs=[search_results, search_info])
+
+        def on_select_search(text, input_view, output_view, request: gr.Request):
+            return select_search_results(text, input_view, output_view, session_id(request))
+
+        select_search_btn.click(
+            fn=on_select_search,
+            inputs=[search_box, input_view, output_view],
+            outputs=[
+                input_selection_version, input_selected_count, input_selected_display, input_files,
+                output_selection_version, output_selected_count, output_selected_display, output_files
+            ]
+        )
+
+        def on_download_search(text, streaming):
+            paths = search_result_paths(text)
+            if paths is None:
+                return gr.update(), gr.update(), gr.update(), gr.update()
+            return download_and_refresh(paths, streaming)
+
+        download_search_btn.click(
+            fn=on_download_search,
+            inputs=[search_box, stream_download_mode],
+            outputs=[download_comp, status, download_link, download_cache_info]
+        )
+
+        def on_delete_search(text, input_view, output_view, request: gr.Request, progress=gr.Progress()):
+            session = session_id(request)
+            paths = search_result_paths(text)
+            result = delete_files(paths or [], input_view, output_view, session, progress)
+            return (*result, *run_search(text))
+
+        delete_search_btn.click(
+            fn=on_delete_search,
+            inputs=[search_box, input_view, output_view],
+            outputs=refresh_outputs + [search_results, search_info]
+        )
+
+    # 为所有界面事件处理函数加上调用统计（名称优先使用api_name）
+    for block_fn in (demo.fns.values() if isinstance(demo.fns, dict) else demo.fns):
+        if block_fn.fn is not None:
+            api_name = getattr(block_fn, "api_name", None)
+            block_fn.fn = instrument(f"gradio:{api_name if isinstance(api_name, str) else block_fn.fn.__name__}")(block_fn.fn)
+
+    # 共享状态都在带锁的全局索引/选中集合中，视图状态按会话保存，事件可以并发处理
+    demo.queue(default_concurrency_limit=QUEUE_CONCURRENCY)
+    return demo
+
+
+# scan模式在构建界面前同步复核；其它模式下界面直接使用快照，复核在端口打开后于后台进行
+if STARTUP_MODE == "scan":
+    reconcile_index()
+
+# 把Gradio界面挂载到同一个FastAPI应用上，使自定义HTTP接口与界面共用端口；代理节点只提供HTTP接口
+if SERVER_MODE == "agent":
+    app = api_app
+else:
+    demo = build_ui()
+    app = gr.mount_gradio_app(api_app, demo, path="")
+
+if STARTUP_MODE != "scan":
+    threading.Thread(target=reconcile_index, name="index-reconcile", daemon=True).start()
+
+# 启动应用
+if __name__ == "__main__":
+    import uvicorn
+    import webbrowser
+    if SERVER_MODE == "agent":
+        log_info(f"以代理节点模式启动，监听 {SERVER_HOST}:{SERVER_PORT}")
+        if not AGENT_TOKEN:
+            log_error("未设置WEBUI_AGENT_TOKEN，代理节点的全部接口（包括删除和上传）都不校验令牌")
+    else:
+        log_info("启动视频文件管理预览系统")
+        threading.Timer(1.5, webbrowser.open, args=(f"http://127.0.0.1:{SERVER_PORT}",)).start()
+    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
     log_info("视频文件管理预览系统已关闭")
\ No newline at end of file